@@ -0,0 +1,6 @@
+'''
+Analysis utilities shared by the experiment analysis scripts in this repository.
+
+Analysis scripts live in experiments/<experiment>/analysis/ and import these utilities by adding
+the repository root to their python path.
+'''
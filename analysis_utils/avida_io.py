@@ -0,0 +1,223 @@
+'''
+Readers for Avida output files.
+'''
+
+import csv
+
+from . import parse_cache
+
+def clean_legend_field(line, patch_logic3=True, strip_hash=False):
+    """
+    Given a single line of an Avida legend table, return the corresponding field name.
+
+    - patch_logic3: drop the description that follows 3-input logic task names (e.g., "Logic 3AA (A+B+C)")
+    - strip_hash: remove "#" characters from field names
+
+    The defaults match most of the analysis scripts; older (2020-08) experiments did not patch 3-input logic
+    task names, and the hitchhiking experiments also strip "#".
+    """
+    line = line.strip()
+    # patch 3-input logic tasks because avida file format is nonsense
+    if patch_logic3 and "Logic 3" in line:
+        line = line.split("(")[0]
+    field = line.split(":")[-1].strip().lower()
+    if strip_hash:
+        field = field.replace("#", "").strip()
+    return field.replace(" ", "_")
+
+def read_avida_dat_legend(fp, patch_logic3=True, strip_hash=False):
+    """
+    Given a file pointer at the start of an Avida .dat/.spop file, consume the file header and
+    return the list of field names from its legend table (see clean_legend_field for the options).
+
+    After returning, fp is positioned at the first line after the legend table (i.e., the data).
+    """
+    fields = []
+    in_legend = False
+    for line in fp:
+        line = line.strip()
+        if not in_legend:
+            if line == "# Legend:":     # Handles analyze mode detail files.
+                in_legend = True
+                continue
+            elif "#  1:" in line:       # Handles time.dat file.
+                in_legend = True
+            else:
+                continue
+        if line == "": break
+        fields.append(clean_legend_field(line, patch_logic3, strip_hash))
+    return fields
+
+def dat_cache_kind(backfill_missing_fields, patch_logic3, strip_hash):
+    """
+    Return the parse cache kind for an Avida .dat/.spop file read with the given options.
+    """
+    return f"dat-backfill-{int(backfill_missing_fields)}-logic3-{int(patch_logic3)}-hash-{int(strip_hash)}"
+
+def iter_avida_dat_values(fp, fields, backfill_missing_fields=False):
+    """
+    Given a file pointer positioned after an Avida legend table, yield the list of values on each data line.
+    """
+    for line in fp:
+        line = line.strip()
+        if line == "": continue
+        data_line = line.split(" ")
+        if len(data_line) > len(fields):
+            print("found more items than there are fields!")
+            print(fields)
+            print(data_line)
+            exit(-1)
+        elif backfill_missing_fields:
+            num_backfill = len(fields) - len(data_line)
+            for _ in range(num_backfill): data_line.append("")
+        elif len(data_line) != len(fields):
+            print("data fields mismatch!")
+            print(fields)
+            print(data_line)
+            exit(-1)
+        yield data_line
+
+def rows_from_columns(columns, chunk_size=4096):
+    """
+    Given a {field: column} dictionary (as returned by read_avida_dat_table), yield one {field: value}
+    dictionary per row. Columns are decoded chunk_size rows at a time, so only the current chunk is ever
+    held as python values.
+    """
+    fields = list(columns.keys())
+    num_rows = len(columns[fields[0]]) if len(fields) else 0
+    for chunk_start in range(0, num_rows, chunk_size):
+        chunk_end = chunk_start + chunk_size
+        chunk = [parse_cache.decode_column(columns[field][chunk_start:chunk_end]) for field in fields]
+        for values in zip(*chunk):
+            yield {field:value for field,value in zip(fields, values)}
+
+def read_avida_dat_table(path, backfill_missing_fields=False, patch_logic3=True, strip_hash=False):
+    """
+    Read an Avida .dat/.spop file as a {field: column} dictionary of (string) values.
+
+    If the parse cache is enabled, parsed files are cached on disk (see parse_cache.py).
+    """
+    def parse():
+        with open(path, "r") as fp:
+            fields = read_avida_dat_legend(fp, patch_logic3, strip_hash)
+            # (if a field name repeats, the last column with that name wins)
+            field_index = {field: i for i, field in enumerate(fields)}
+            columns = {field: [] for field in field_index}
+            for data_line in iter_avida_dat_values(fp, fields, backfill_missing_fields):
+                for field in field_index: columns[field].append(data_line[field_index[field]])
+        return columns
+    return parse_cache.cached_columns(path, dat_cache_kind(backfill_missing_fields, patch_logic3, strip_hash), parse)
+
+def iter_avida_dat_file(path, backfill_missing_fields=False, patch_logic3=True, strip_hash=False):
+    """
+    Lazily read an Avida .dat/.spop file, yielding one {field: value} dictionary per data line.
+
+    Values are left as strings. If backfill_missing_fields is True, lines with fewer values than
+    there are fields are padded with empty strings (e.g., .spop files, where trailing fields are
+    omitted for some organisms). See clean_legend_field for patch_logic3 and strip_hash.
+
+    If the parse cache is enabled and the file is already cached, rows are decoded from the cache entry a
+    chunk at a time. Otherwise, the file is streamed (and not added to the cache, which would require
+    holding the whole file in memory).
+    """
+    if parse_cache.cache_enabled():
+        columns = parse_cache.load_cache_entry(
+            parse_cache.cache_entry_path(path, dat_cache_kind(backfill_missing_fields, patch_logic3, strip_hash))
+        )
+        if columns != None:
+            yield from rows_from_columns(columns)
+            return
+    with open(path, "r") as fp:
+        fields = read_avida_dat_legend(fp, patch_logic3, strip_hash)
+        for data_line in iter_avida_dat_values(fp, fields, backfill_missing_fields):
+            yield {field:value for field,value in zip(fields, data_line)}
+
+def read_avida_dat_file(path, backfill_missing_fields=False, patch_logic3=True, strip_hash=False):
+    """
+    Read an entire Avida .dat/.spop file, returning a list of {field: value} dictionaries.
+    (Prefer iter_avida_dat_file when rows only need to be visited in order.)
+    """
+    if not parse_cache.cache_enabled():
+        return list(iter_avida_dat_file(path, backfill_missing_fields, patch_logic3, strip_hash))
+    return list(rows_from_columns(read_avida_dat_table(path, backfill_missing_fields, patch_logic3, strip_hash)))
+
+def iter_avida_dat_projection(path, fields, backfill_missing_fields=False, patch_logic3=True, strip_hash=False):
+    """
+    Lazily read only the given fields from an Avida .dat/.spop file, yielding a tuple of values (ordered as
+    in fields) per data line. Columns after the last requested field are never tokenized, which matters for
+    .spop files (long genome sequences followed by long lists of occupied cells).
+    """
+    with open(path, "r") as fp:
+        file_fields = read_avida_dat_legend(fp, patch_logic3, strip_hash)
+        for field in fields:
+            if not field in file_fields:
+                print(f"Field ({field}) not found in {path}!")
+                exit(-1)
+        field_ids = [file_fields.index(field) for field in fields]
+        max_id = max(field_ids)
+        for line in fp:
+            line = line.strip()
+            if line == "": continue
+            data_line = line.split(" ", max_id + 1)
+            if len(data_line) <= max_id:
+                if not backfill_missing_fields:
+                    print("data fields mismatch!")
+                    print(file_fields)
+                    print(data_line)
+                    exit(-1)
+                data_line += ["" for _ in range(max_id + 1 - len(data_line))]
+            yield tuple(data_line[i] for i in field_ids)
+
+def lookup_avida_dat_rows(path, fields, key_fields, keys=None, backfill_missing_fields=True, patch_logic3=True, strip_hash=False):
+    """
+    Read selected rows and columns from an Avida .dat/.spop file, returning {key: {field: value}} where
+    each key is the tuple of the row's key_fields values.
+
+    keys may be:
+    - None: every row is returned.
+    - a function: rows whose key it returns True for are returned.
+    - a collection of key tuples: rows with those keys are returned, and reading stops as soon as all
+      of them have been found.
+    """
+    wanted = None
+    if keys != None and not callable(keys):
+        wanted = set(keys)
+        if len(wanted) == 0: return {}
+    num_keys = len(key_fields)
+    table = {}
+    for values in iter_avida_dat_projection(path, list(key_fields) + list(fields), backfill_missing_fields, patch_logic3, strip_hash):
+        key = values[:num_keys]
+        if wanted != None:
+            if not key in wanted: continue
+        elif keys != None and not keys(key):
+            continue
+        table[key] = {field:value for field,value in zip(fields, values[num_keys:])}
+        if wanted != None and len(table) == len(wanted): break
+    return table
+
+def read_csv_records(file_path):
+    """
+    Read a csv file, returning its header and a csv reader over its data lines.
+    """
+    with open(file_path, "r") as fp:
+        content = fp.read().strip().split("\n")
+    header = content[0].split(",")
+    return header, csv.reader(content[1:], quotechar='"', delimiter=',', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+def read_csv(file_path):
+    """
+    Read a csv file (e.g., lineage.csv, phylodiversity.csv, dominant.csv), returning a list of
+    {field: value} dictionaries. If the parse cache is enabled, parsed files are cached on disk (see
+    parse_cache.py).
+    """
+    if not parse_cache.cache_enabled():
+        header, records = read_csv_records(file_path)
+        return [{header[i]: l[i] for i in range(len(header))} for l in records]
+    def parse():
+        header, records = read_csv_records(file_path)
+        field_index = {field: i for i, field in enumerate(header)}
+        columns = {field: [] for field in field_index}
+        for l in records:
+            for field in field_index: columns[field].append(l[field_index[field]])
+        return columns
+    return list(rows_from_columns(parse_cache.cached_columns(file_path, "csv", parse)))
@@ -0,0 +1,135 @@
+'''
+Columnar (numpy) loaders for Avida time-series .dat files (e.g., time.dat, tasks.dat, instruction.dat).
+
+Columns are returned as a dictionary of numpy arrays keyed by the legend-derived field names (the same
+names read_avida_dat_file uses). Rows are sorted by update so that update lookups are binary searches.
+'''
+
+import numpy as np
+
+from .avida_io import read_avida_dat_legend
+from . import parse_cache
+
+def infer_column(values):
+    """
+    Given a numpy array of strings, return it converted to the narrowest of int64, float64, or str
+    that represents every value exactly as written (e.g., "27.0270" stays a string, so output keeps the
+    file's formatting).
+    """
+    for dtype in (np.int64, np.float64):
+        try:
+            converted = values.astype(dtype)
+        except ValueError:
+            continue
+        if np.array_equal(converted.astype(str), values): return converted
+    return values
+
+def parse_avida_dat_columns(path, sort_field="update", patch_logic3=True, strip_hash=False):
+    """
+    Parse every column of an Avida .dat file into typed numpy arrays (rows sorted by sort_field, if given).
+    """
+    with open(path, "r") as fp:
+        file_fields = read_avida_dat_legend(fp, patch_logic3, strip_hash)
+        try:
+            table = np.loadtxt((line for line in fp if line.strip() != ""), dtype=str, comments=None, ndmin=2)
+        except ValueError as err:
+            print("data fields mismatch!")
+            print(file_fields)
+            print(err)
+            exit(-1)
+    if table.size == 0:
+        table = table.reshape(0, len(file_fields))
+    elif table.shape[1] != len(file_fields):
+        print("data fields mismatch!")
+        print(file_fields)
+        print(table[0])
+        exit(-1)
+    columns = {field: infer_column(table[:, i]) for i, field in enumerate(file_fields)}
+    # Make sure rows are ordered by update (Avida writes them in order, so this is usually a no-op).
+    if sort_field != None and sort_field in columns:
+        key = columns[sort_field]
+        if len(key) and np.any(key[1:] < key[:-1]):
+            order = np.argsort(key, kind="stable")
+            columns = {field: columns[field][order] for field in columns}
+    return columns
+
+def load_avida_dat_columns(path, fields=None, sort_field="update", patch_logic3=True, strip_hash=False):
+    """
+    Load an Avida .dat file as a dictionary of typed numpy column arrays.
+
+    - fields: if given, only these fields are returned.
+    - sort_field: rows are (stably) sorted by this field if it exists (pass None to keep file order).
+    - patch_logic3, strip_hash: legend options (see avida_io.clean_legend_field).
+
+    Parsed files are cached on disk (see parse_cache.py).
+    """
+    columns = parse_cache.cached_columns(
+        path,
+        f"columns-{sort_field}-logic3-{int(patch_logic3)}-hash-{int(strip_hash)}",
+        lambda: parse_avida_dat_columns(path, sort_field, patch_logic3, strip_hash)
+    )
+    wanted = list(columns.keys()) if fields is None else fields
+    selected = {}
+    for field in wanted:
+        if not field in columns:
+            print(f"Field ({field}) not found in {path}!")
+            exit(-1)
+        # (the cache stores string columns as bytes)
+        selected[field] = columns[field].astype(str) if columns[field].dtype.kind == "S" else columns[field]
+    return selected
+
+def update_index(columns, update, update_field="update"):
+    """
+    Return the row index for the given update (binary search over the sorted update column).
+    """
+    updates = columns[update_field]
+    i = np.searchsorted(updates, update, side="left")
+    if i >= len(updates) or updates[i] != update:
+        print(f"Update ({update}) not found!")
+        exit(-1)
+    return int(i)
+
+def value_at_update(columns, field, update, update_field="update"):
+    """
+    Return the value of field at the given update.
+    """
+    return columns[field][update_index(columns, update, update_field)]
+
+def update_range_slice(columns, start, end, update_field="update"):
+    """
+    Return a slice selecting rows with start <= update <= end.
+    """
+    updates = columns[update_field]
+    return slice(
+        int(np.searchsorted(updates, start, side="left")),
+        int(np.searchsorted(updates, end, side="right"))
+    )
+
+def join_time_series(sources, update_field="update"):
+    """
+    Join time series sources into a single columnar table in one pass over each source.
+
+    sources is a list of (name, columns, prefix) tuples, where columns is a {field: numpy array} dictionary
+    with an update column (e.g., from load_avida_dat_columns or csv_index.read_csv_update_range_columns).
+    Every source must have exactly the same updates (otherwise, we report a time series resolution mismatch
+    for that source). The joined table has rows sorted by update, with the update column and each source's
+    other fields (renamed to prefix + field).
+    """
+    joined = {}
+    updates = None
+    for name, columns, prefix in sources:
+        source_updates = columns[update_field]
+        if len(source_updates) and np.any(source_updates[1:] < source_updates[:-1]):
+            order = np.argsort(source_updates, kind="stable")
+            columns = {field: columns[field][order] for field in columns}
+            source_updates = columns[update_field]
+        if updates is None:
+            updates = source_updates
+            joined[update_field] = updates
+        elif not np.array_equal(updates, source_updates):
+            print(f"Time series resolution mismatch ({name})!")
+            exit(-1)
+        for field in columns:
+            if field == update_field: continue
+            joined[prefix + field] = columns[field]
+    return joined
@@ -0,0 +1,176 @@
+'''
+Update-indexed random access into update-sorted csv files (e.g., lineage.csv, phylodiversity.csv, dominant.csv).
+
+The first time a file is read, we build a sparse index (the byte offset of every Nth row along with that
+row's update) and save it next to the file (<file>.update_index.npz). Reads of an update window then seek
+straight to the nearest indexed row at or before the window instead of parsing the whole file.
+'''
+
+import csv, os
+import numpy as np
+
+index_suffix = ".update_index.npz"
+default_stride = 256
+
+def parse_csv_line(line):
+    return next(csv.reader([line], quotechar='"', delimiter=',', quoting=csv.QUOTE_ALL, skipinitialspace=True))
+
+def row_update(line, update_i):
+    """
+    Return the update for a single (bytes) csv line, given the update column's index.
+    """
+    # Fast path: update is (almost always) the first, unquoted column.
+    if update_i == 0 and not line.startswith(b'"'):
+        return int(line.split(b",", 1)[0])
+    return int(parse_csv_line(line.decode())[update_i])
+
+def build_update_index(path, update_field="update", stride=default_stride):
+    """
+    Scan the csv file at path, returning its sparse update index as a dictionary:
+    - header: list of field names
+    - updates/offsets: update and byte offset of every stride-th data row
+    - sorted: whether the file's rows are ordered by update (if not, the index can't be used for seeking)
+    """
+    updates = []
+    offsets = []
+    is_sorted = True
+    prev_update = None
+    with open(path, "rb") as fp:
+        header = fp.readline().decode().strip().split(",")
+        if not update_field in header:
+            print(f"Field ({update_field}) not found in {path}!")
+            exit(-1)
+        update_i = header.index(update_field)
+        row_i = 0
+        offset = fp.tell()
+        for line in fp:
+            if line.strip() != b"":
+                u = row_update(line, update_i)
+                if row_i % stride == 0:
+                    updates.append(u)
+                    offsets.append(offset)
+                if prev_update != None and u < prev_update: is_sorted = False
+                prev_update = u
+                row_i += 1
+            offset += len(line)
+    return {
+        "header": header,
+        "updates": np.array(updates, dtype=np.int64),
+        "offsets": np.array(offsets, dtype=np.int64),
+        "sorted": is_sorted
+    }
+
+def load_update_index(path, update_field="update", stride=default_stride):
+    """
+    Return the update index for the csv file at path, loading it from its sidecar file if it is up to date
+    (and otherwise building it and saving the sidecar).
+    """
+    stat = os.stat(path)
+    index_path = path + index_suffix
+    source_info = np.array([stat.st_size, stat.st_mtime_ns, stride], dtype=np.int64)
+    if os.path.exists(index_path):
+        try:
+            with np.load(index_path, allow_pickle=False) as saved:
+                if np.array_equal(saved["source_info"], source_info) and str(saved["update_field"]) == update_field:
+                    return {
+                        "header": saved["header"].tolist(),
+                        "updates": saved["updates"],
+                        "offsets": saved["offsets"],
+                        "sorted": bool(saved["sorted"])
+                    }
+        except (OSError, KeyError, ValueError):
+            pass
+    index = build_update_index(path, update_field, stride)
+    try:
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as fp:
+            np.savez(
+                fp,
+                source_info=source_info,
+                update_field=np.array(update_field),
+                header=np.array(index["header"], dtype=str),
+                updates=index["updates"],
+                offsets=index["offsets"],
+                sorted=np.array(index["sorted"])
+            )
+        os.replace(tmp_path, index_path)
+    except OSError:
+        # Read-only data directory; just use the index in memory.
+        pass
+    return index
+
+def iter_update_range_lines(path, index, start, end, update_field="update"):
+    """
+    Yield (update, line) for each (bytes) data line of the csv file at path with start <= update <= end,
+    using the file's update index to skip ahead.
+    """
+    update_i = index["header"].index(update_field)
+    if index["sorted"]:
+        # Rows before the last indexed row with update < start can all be skipped.
+        start_row = max(int(np.searchsorted(index["updates"], start, side="left")) - 1, 0)
+        offset = int(index["offsets"][start_row]) if len(index["offsets"]) else None
+    else:
+        offset = None
+    with open(path, "rb") as fp:
+        if offset == None:
+            fp.readline() # skip header
+        else:
+            fp.seek(offset)
+        for line in fp:
+            if line.strip() == b"": continue
+            u = row_update(line, update_i)
+            if u < start: continue
+            if u > end:
+                if index["sorted"]: break
+                continue
+            yield u, line
+
+def read_csv_update_range(path, start, end, update_field="update"):
+    """
+    Return the rows of the csv file at path with start <= update <= end as a list of {field: value}
+    dictionaries (values are strings, as with read_csv).
+    """
+    index = load_update_index(path, update_field)
+    header = index["header"]
+    rows = []
+    for _, line in iter_update_range_lines(path, index, start, end, update_field):
+        values = parse_csv_line(line.decode().strip())
+        rows.append({header[i]: values[i] for i in range(len(header))})
+    return rows
+
+def read_csv_update_range_columns(path, start, end, fields=None, update_field="update"):
+    """
+    Return the rows of the csv file at path with start <= update <= end as {field: numpy array} columns
+    (update as int64, every other field as strings), without building a dictionary per row.
+
+    - fields: if given, only these fields (plus update) are returned.
+    """
+    index = load_update_index(path, update_field)
+    header = index["header"]
+    wanted = [field for field in (header if fields == None else fields) if field != update_field]
+    for field in wanted:
+        if not field in header:
+            print(f"Field ({field}) not found in {path}!")
+            exit(-1)
+    positions = [header.index(field) for field in wanted]
+    updates = []
+    values = [[] for _ in wanted]
+    for u, line in iter_update_range_lines(path, index, start, end, update_field):
+        updates.append(u)
+        if len(wanted) == 0: continue
+        row = parse_csv_line(line.decode().strip())
+        for column, i in zip(values, positions): column.append(row[i])
+    columns = {update_field: np.array(updates, dtype=np.int64)}
+    for field, column in zip(wanted, values):
+        columns[field] = np.array(column, dtype=str)
+    return columns
+
+def read_csv_at_update(path, update, update_field="update"):
+    """
+    Return the (first) row of the csv file at path for the given update as a {field: value} dictionary.
+    """
+    rows = read_csv_update_range(path, update, update, update_field)
+    if len(rows) == 0:
+        print(f"Update ({update}) not found in {path}!")
+        exit(-1)
+    return rows[0]
@@ -0,0 +1,180 @@
+'''
+Environment schedules: which environment is active at each update of a run.
+
+An EnvironmentSchedule can be built from a change rate (the environment cycles through env_order every
+period_length updates) or from the run's Avida events file (by replaying its SetReactionValue and
+SetReactionValueMult events). Periodic schedules are looked up arithmetically; irregular schedules are
+stored as change points and looked up by binary search. Lookups work on single updates or numpy arrays.
+'''
+
+import os
+import numpy as np
+
+class EnvironmentSchedule:
+    """
+    - env_names: environment names (lookups return names, or indices into env_names)
+    - cycle/period_length: environment indices cycled through every period_length updates, starting at
+      update 0 (a single-environment cycle is a constant environment)
+    - starts/codes: for irregular schedules, the update at which each environment segment starts (the
+      first at update 0) and its environment index
+
+    Negative updates (e.g., the update born of a run's initial ancestor) are treated as update 0.
+    """
+    def __init__(self, env_names, cycle=None, period_length=0, starts=None, codes=None):
+        self.env_names = list(env_names)
+        self.period_length = period_length
+        self.cycle = None if cycle is None else np.array(cycle, dtype=np.int64)
+        self.starts = None if starts is None else np.array(starts, dtype=np.int64)
+        self.codes = None if codes is None else np.array(codes, dtype=np.int64)
+        if self.cycle is None and self.starts is None:
+            print("Environment schedule needs a cycle or change points!")
+            exit(-1)
+
+    @classmethod
+    def from_change_rate(cls, period_length, env_order=("even", "odd"), constant_env="all"):
+        """
+        Environment cycles through env_order every period_length updates (or is constant_env if
+        period_length is 0), as with our change rate treatments.
+        """
+        env_names = list(env_order) + [constant_env]
+        if period_length == 0:
+            return cls(env_names, cycle=[len(env_order)])
+        return cls(env_names, cycle=list(range(len(env_order))), period_length=period_length)
+
+    @classmethod
+    def from_events_file(cls, path, environments, max_update):
+        """
+        Replay the reaction value events in an Avida events file (through max_update).
+
+        environments maps environment names to the set of reactions rewarded (value > 0) in that
+        environment, e.g., {"even": {"NOT", "AND", "OR"}, ...}; any other combination of rewarded
+        reactions is named by its (sorted, comma-separated) reactions.
+        """
+        events = read_reaction_events(path, max_update)
+        env_lookup = {frozenset(rewarded): name for name, rewarded in environments.items()}
+        env_names = list(environments.keys())
+        values = {}
+        def current_env():
+            rewarded = frozenset(reaction for reaction in values if values[reaction] > 0)
+            name = env_lookup.get(rewarded, ",".join(sorted(rewarded)))
+            if not name in env_names: env_names.append(name)
+            return env_names.index(name)
+        starts = []
+        codes = []
+        event_i = 0
+        while event_i < len(events):
+            update = events[event_i][0]
+            if len(codes) == 0 and update > 0:
+                # (before any events, no reactions are rewarded)
+                starts.append(0)
+                codes.append(current_env())
+            # Apply every event at this update before checking the environment.
+            while event_i < len(events) and events[event_i][0] == update:
+                _, action, reaction, value = events[event_i]
+                if action == "SetReactionValue":
+                    values[reaction] = value
+                else:
+                    values[reaction] = values.get(reaction, 0.0) * value
+                event_i += 1
+            code = current_env()
+            if len(codes) == 0 or code != codes[-1]:
+                starts.append(max(update, 0))
+                codes.append(code)
+        if len(codes) == 0:
+            starts.append(0)
+            codes.append(current_env())
+        return cls.compress(env_names, starts, codes, max_update)
+
+    @classmethod
+    def compress(cls, env_names, starts, codes, max_update):
+        """
+        Return a periodic schedule for change points that are evenly spaced (with a repeating cycle of
+        environments), and an irregular (change point) schedule otherwise.
+        """
+        if len(codes) == 1:
+            return cls(env_names, cycle=codes)
+        period_length = starts[1] - starts[0]
+        evenly_spaced = all(start == i * period_length for i, start in enumerate(starts))
+        if evenly_spaced:
+            for cycle_length in range(2, len(codes) + 1):
+                if all(codes[i] == codes[i % cycle_length] for i in range(len(codes))):
+                    # (the last change point must be the last one before max_update)
+                    if starts[-1] + period_length > max_update:
+                        return cls(env_names, cycle=codes[:cycle_length], period_length=period_length)
+                    break
+        return cls(env_names, starts=starts, codes=codes)
+
+    def code_at(self, update):
+        """
+        Return the index (in env_names) of the environment at update.
+        """
+        update = max(int(update), 0)
+        if self.cycle is not None:
+            if len(self.cycle) == 1: return int(self.cycle[0])
+            return int(self.cycle[(update // self.period_length) % len(self.cycle)])
+        return int(self.codes[np.searchsorted(self.starts, update, side="right") - 1])
+
+    def codes_at(self, updates):
+        """
+        Return the index (in env_names) of the environment at each update in an array of updates.
+        """
+        updates = np.maximum(np.asarray(updates, dtype=np.int64), 0)
+        if self.cycle is not None:
+            if len(self.cycle) == 1: return np.full(updates.shape, self.cycle[0], dtype=np.int64)
+            return self.cycle[(updates // self.period_length) % len(self.cycle)]
+        return self.codes[np.searchsorted(self.starts, updates, side="right") - 1]
+
+    def env_at(self, update):
+        return self.env_names[self.code_at(update)]
+
+    def envs_at(self, updates):
+        return np.array(self.env_names)[self.codes_at(updates)]
+
+    def __getitem__(self, update):
+        return self.env_at(update)
+
+def load_run_schedule(run_path, event_file, environments, change_rate, max_update, env_order=("even", "odd"), constant_env="all"):
+    """
+    Return the environment schedule for a run: replayed from the run's copy of its events file if there is
+    one, or built from its change rate otherwise.
+    """
+    events_path = os.path.join(run_path, event_file)
+    if os.path.exists(events_path):
+        return EnvironmentSchedule.from_events_file(events_path, environments, max_update)
+    return EnvironmentSchedule.from_change_rate(change_rate, env_order=env_order, constant_env=constant_env)
+
+def parse_event_times(timing, max_update):
+    """
+    Return the updates at which an event with the given timing (begin, N, start:interval, or
+    start:interval:stop) fires, through max_update.
+    """
+    parts = [0 if part == "begin" else part for part in timing.split(":")]
+    if parts[0] == "end": return []
+    start = int(parts[0])
+    if len(parts) == 1:
+        return [start] if start <= max_update else []
+    interval = int(parts[1])
+    stop = max_update if len(parts) < 3 or parts[2] == "end" else min(int(parts[2]), max_update)
+    if interval <= 0: return [start] if start <= max_update else []
+    return list(range(start, stop + 1, interval))
+
+def read_reaction_events(path, max_update):
+    """
+    Return a list of (update, action, reaction, value) for each update-triggered SetReactionValue or
+    SetReactionValueMult event in an Avida events file, ordered by update (and file order within an update).
+    """
+    events = []
+    order = 0
+    with open(path, "r") as fp:
+        for line in fp:
+            line = line.split("#")[0].strip()
+            if line == "": continue
+            tokens = line.split()
+            if len(tokens) < 5 or tokens[0] != "u": continue
+            action = tokens[2]
+            if not action in {"SetReactionValue", "SetReactionValueMult"}: continue
+            for update in parse_event_times(tokens[1], max_update):
+                events.append((update, order, action, tokens[3], float(tokens[4])))
+                order += 1
+    events.sort(key=lambda event: (event[0], event[1]))
+    return [(update, action, reaction, value) for update, _, action, reaction, value in events]
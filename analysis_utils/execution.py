@@ -0,0 +1,123 @@
+'''
+Array-based execution architecture analyses: which genome sites are executed in which environments.
+
+Site execution is given as a (num_envs, num_sites) boolean array (executed[env, site]), e.g., built from
+per-environment trace site counts (execution_mask). A site is toggled if it is executed in some, but not all,
+environments (for two environments: executed in exactly one), and shared if it is executed in every
+environment. Toggled sites are grouped into chunks: runs of contiguous toggled sites, where sites that are
+unexecuted nops (nop instructions executed in no environment) are skipped (neither part of a chunk nor
+breaking one up). Sites past the end of the genome (executed, e.g., by running off its end) count toward
+executed/toggled/shared sites, but only sites within the genome are grouped into chunks.
+
+Several genomes (e.g., one per run) can be processed at once by concatenating them along the site axis and
+passing genome_offsets (the start of each genome in the concatenated arrays, followed by the total length),
+as with lineage_offsets in lineage_steps. Counters are then returned as arrays with one entry per genome.
+'''
+
+import numpy as np
+
+def execution_mask(site_counts, genome_length):
+    """
+    Given per-environment site execution counts (a list of arrays indexed by site), return the boolean array
+    of executed sites, with one column per site up to the genome length or the largest executed site
+    (whichever is larger): (num_envs, max(genome_length, max site + 1)).
+    """
+    site_counts = [np.asarray(counts) for counts in site_counts]
+    num_sites = max([genome_length] + [len(counts) for counts in site_counts])
+    executed = np.zeros((len(site_counts), num_sites), dtype=bool)
+    for env_i, counts in enumerate(site_counts):
+        executed[env_i, :len(counts)] = counts > 0
+    return executed
+
+def nop_sites(genome_sequence):
+    """
+    Return a boolean array marking the nop instructions in a genome (list of instruction names).
+    """
+    if len(genome_sequence) == 0: return np.zeros(0, dtype=bool)
+    return np.char.find(np.array(genome_sequence, dtype=str), "nop-") >= 0
+
+def toggled_sites(executed):
+    executed = np.asarray(executed, dtype=bool)
+    return executed.any(axis=0) & ~executed.all(axis=0)
+
+def shared_sites(executed):
+    return np.asarray(executed, dtype=bool).all(axis=0)
+
+def genome_ids(num_sites, genome_offsets):
+    genome_offsets = np.asarray(genome_offsets, dtype=np.int64)
+    return np.repeat(np.arange(len(genome_offsets) - 1), np.diff(genome_offsets))[:num_sites]
+
+def chunk_lengths(toggled, skip, genome_offsets=None):
+    """
+    Return (lengths, genome) for each chunk of contiguous toggled sites (in site order), skipping sites
+    marked in skip; genome gives the index of the genome each chunk is in (chunks never span genomes).
+    """
+    toggled = np.asarray(toggled, dtype=bool)
+    if genome_offsets is None:
+        genome_offsets = np.array([0, len(toggled)], dtype=np.int64)
+    genome = genome_ids(len(toggled), genome_offsets)
+    # Drop skipped sites, then find runs of toggled sites among the remaining ones.
+    kept = ~np.asarray(skip, dtype=bool)
+    toggled, genome = toggled[kept], genome[kept]
+    positions = np.flatnonzero(toggled)
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    chunk_genome = genome[positions]
+    starts_chunk = np.ones(len(positions), dtype=bool)
+    starts_chunk[1:] = (np.diff(positions) != 1) | (np.diff(chunk_genome) != 0)
+    chunk_ids = np.cumsum(starts_chunk) - 1
+    return np.bincount(chunk_ids).astype(np.int64), chunk_genome[starts_chunk]
+
+def execution_architecture(executed, nops, genome_offsets=None, genome_lengths=None):
+    """
+    Summarize site execution across environments:
+    - num_executed: (num_envs,) number of sites executed in each environment
+    - num_toggled: number of toggled sites
+    - num_shared: number of sites executed in every environment
+    - chunk_lengths: lengths of each genome's chunks of toggled sites (one array per genome if batched)
+
+    - executed: (num_envs, num_sites) boolean array
+    - nops: (num_sites,) boolean array marking nop instructions
+    - genome_lengths: length of each genome (a single length if not batched); sites past it are left out of
+      chunks. Defaults to every site being within the genome.
+    """
+    executed = np.asarray(executed, dtype=bool)
+    batch = genome_offsets is not None
+    if not batch:
+        genome_offsets = np.array([0, executed.shape[1]], dtype=np.int64)
+    genome_offsets = np.asarray(genome_offsets, dtype=np.int64)
+    num_genomes = len(genome_offsets) - 1
+    genome = genome_ids(executed.shape[1], genome_offsets)
+    if genome_lengths is None:
+        genome_lengths = np.diff(genome_offsets)
+    genome_lengths = np.atleast_1d(np.asarray(genome_lengths, dtype=np.int64))
+
+    toggled = toggled_sites(executed)
+    shared = shared_sites(executed)
+    # (we don't want unexecuted nops to break up/count toward chunk size)
+    unexecuted_nops = np.asarray(nops, dtype=bool) & ~executed.any(axis=0)
+    # (chunks only include sites within the genome)
+    past_genome = np.arange(executed.shape[1]) - genome_offsets[genome] >= genome_lengths[genome]
+    lengths, chunk_genome = chunk_lengths(toggled, unexecuted_nops | past_genome, genome_offsets)
+
+    def per_genome(mask):
+        return np.bincount(genome[mask], minlength=num_genomes)
+    num_executed = np.stack([per_genome(env_executed) for env_executed in executed]).reshape(len(executed), num_genomes)
+    num_toggled = per_genome(toggled)
+    num_shared = per_genome(shared)
+    # (chunks are in site order, so each genome's chunks are contiguous)
+    chunk_offsets = np.concatenate([[0], np.cumsum(np.bincount(chunk_genome, minlength=num_genomes))])
+    genome_chunk_lengths = [lengths[chunk_offsets[i]:chunk_offsets[i + 1]] for i in range(num_genomes)]
+    if batch:
+        return {
+            "num_executed": num_executed,
+            "num_toggled": num_toggled,
+            "num_shared": num_shared,
+            "chunk_lengths": genome_chunk_lengths
+        }
+    return {
+        "num_executed": num_executed[:, 0],
+        "num_toggled": int(num_toggled[0]),
+        "num_shared": int(num_shared[0]),
+        "chunk_lengths": genome_chunk_lengths[0]
+    }
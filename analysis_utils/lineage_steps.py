@@ -0,0 +1,142 @@
+'''
+Array-based classification of the steps along dominant lineages.
+
+A lineage is given as aligned arrays with one entry per genotype (ancestor first). Per-environment values
+(packed phenotypes, match scores, instruction execution counts, etc.) are stacked along a leading
+environment axis: shape (num_envs, num_genotypes, ...). For each genotype, expressed (and unexpressed) give
+the index of the environment it was born into (and the alternate environment), or -1 for none (e.g., in a
+constant environment, there is no unexpressed phenotype).
+
+Several lineages can be processed at once by concatenating their arrays and passing lineage_offsets
+(the start of each lineage in the concatenated arrays, followed by the total length). Counters are then
+returned as arrays with one entry per lineage; without lineage_offsets, counters are ints.
+'''
+
+import numpy as np
+
+from .phenotype import phenotypes_differ
+
+def environment_indices(environment_schedule, update_born, env_names):
+    """
+    Return the index (in env_names) of the environment at each update born, or -1 for environments not
+    in env_names. environment_schedule is an env_schedule.EnvironmentSchedule.
+    """
+    env_codes = {env: i for i, env in enumerate(env_names)}
+    schedule_codes = np.array([env_codes.get(env, -1) for env in environment_schedule.env_names], dtype=np.int64)
+    return schedule_codes[environment_schedule.codes_at(update_born)]
+
+def lineage_steps(num_genotypes, lineage_offsets=None):
+    """
+    Return (cur, prev, lineage) index arrays for every step (genotype, parent genotype) along the lineage(s),
+    where lineage gives each step's lineage number.
+    """
+    if lineage_offsets is None:
+        lineage_offsets = np.array([0, num_genotypes], dtype=np.int64)
+    lineage_offsets = np.asarray(lineage_offsets, dtype=np.int64)
+    lineage = np.repeat(np.arange(len(lineage_offsets) - 1), np.diff(lineage_offsets))
+    is_step = np.ones(num_genotypes, dtype=bool)
+    is_step[lineage_offsets[:-1][lineage_offsets[:-1] < num_genotypes]] = False
+    cur = np.flatnonzero(is_step)
+    return cur, cur - 1, lineage[cur]
+
+def count_steps(mask, lineage, num_lineages, batch):
+    counts = np.bincount(lineage[mask], minlength=num_lineages)
+    return counts if batch else int(counts[0])
+
+def select_environment(values, env, genotypes):
+    """
+    Return values[env[i], genotypes[i]] for each i (entries with env == -1 come from environment 0;
+    mask them out).
+    """
+    return values[np.maximum(env, 0), genotypes]
+
+def mutation_step_counts(muts_from_parent, aggregate, phenotypes, match_scores, expressed, unexpressed, lineage_offsets=None):
+    """
+    Classify each mutation step (genotype with mutations from its parent) along the lineage(s):
+    - num_mut_steps
+    - change_aggregate: did the step change the aggregate phenotype?
+    - change_expressed/change_unexpressed: did it change the phenotype expressed in (or the phenotype
+      unexpressed in) the environment the genotype was born into?
+    - {expressed,unexpressed}_{deleterious,beneficial}: of those changes, did the match score drop/rise?
+      (counted only in changing environments, i.e., when there is an unexpressed phenotype)
+
+    - muts_from_parent: (num_genotypes,) mutation counts
+    - aggregate: (num_genotypes, num_words) packed aggregate phenotypes
+    - phenotypes: (num_envs, num_genotypes, num_words) packed phenotypes
+    - match_scores: (num_envs, num_genotypes) match scores
+    - expressed, unexpressed: (num_genotypes,) environment indices (-1 for none)
+    """
+    expressed = np.asarray(expressed, dtype=np.int64)
+    unexpressed = np.asarray(unexpressed, dtype=np.int64)
+    num_genotypes = len(muts_from_parent)
+    batch = lineage_offsets is not None
+    num_lineages = len(lineage_offsets) - 1 if batch else 1
+    cur, prev, lineage = lineage_steps(num_genotypes, lineage_offsets)
+    # Only steps with mutations count.
+    mutated = np.asarray(muts_from_parent)[cur] > 0
+    cur, prev, lineage = cur[mutated], prev[mutated], lineage[mutated]
+
+    # (both the genotype and its parent are compared in the environment the genotype was born into)
+    expressed, unexpressed = expressed[cur], unexpressed[cur]
+    has_expressed = expressed >= 0
+    has_unexpressed = unexpressed >= 0
+    change_agg = phenotypes_differ(aggregate[cur], aggregate[prev])
+    change_expressed = has_expressed & phenotypes_differ(
+        select_environment(phenotypes, expressed, cur),
+        select_environment(phenotypes, expressed, prev)
+    )
+    change_unexpressed = has_unexpressed & phenotypes_differ(
+        select_environment(phenotypes, unexpressed, cur),
+        select_environment(phenotypes, unexpressed, prev)
+    )
+    cur_expressed_score = select_environment(match_scores, expressed, cur)
+    prev_expressed_score = select_environment(match_scores, expressed, prev)
+    cur_unexpressed_score = select_environment(match_scores, unexpressed, cur)
+    prev_unexpressed_score = select_environment(match_scores, unexpressed, prev)
+    # (we do not classify steps as deleterious/beneficial in constant environments)
+    classify_expressed = change_expressed & has_unexpressed
+
+    return {
+        "num_mut_steps": count_steps(np.ones(len(cur), dtype=bool), lineage, num_lineages, batch),
+        "change_aggregate": count_steps(change_agg, lineage, num_lineages, batch),
+        "change_expressed": count_steps(change_expressed, lineage, num_lineages, batch),
+        "change_unexpressed": count_steps(change_unexpressed, lineage, num_lineages, batch),
+        "expressed_deleterious": count_steps(classify_expressed & (prev_expressed_score > cur_expressed_score), lineage, num_lineages, batch),
+        "expressed_beneficial": count_steps(classify_expressed & (prev_expressed_score < cur_expressed_score), lineage, num_lineages, batch),
+        "unexpressed_deleterious": count_steps(change_unexpressed & (prev_unexpressed_score > cur_unexpressed_score), lineage, num_lineages, batch),
+        "unexpressed_beneficial": count_steps(change_unexpressed & (prev_unexpressed_score < cur_unexpressed_score), lineage, num_lineages, batch)
+    }
+
+def increase_step_counts(values, combined, expressed, unexpressed, aggregate_changed, lineage_offsets=None):
+    """
+    Count the steps along the lineage(s) where a value (e.g., times an instruction is executed) increases:
+    - increases: combined value (e.g., mean across environments) increased
+    - increases_with_aggregate_change: ... on a step that also changed the aggregate phenotype
+    - increases_in_expressed: increased only in the expressed environment
+    - increases_in_unexpressed: increased only in the unexpressed environment
+
+    - values: (num_envs, num_genotypes) per-environment values
+    - combined: (num_genotypes,) combined values
+    - expressed, unexpressed: (num_genotypes,) environment indices (-1 for none)
+    - aggregate_changed: (num_genotypes,) did the aggregate phenotype change from the parent genotype?
+    """
+    values = np.asarray(values)
+    combined = np.asarray(combined)
+    expressed = np.asarray(expressed, dtype=np.int64)
+    unexpressed = np.asarray(unexpressed, dtype=np.int64)
+    num_genotypes = len(combined)
+    batch = lineage_offsets is not None
+    num_lineages = len(lineage_offsets) - 1 if batch else 1
+    cur, prev, lineage = lineage_steps(num_genotypes, lineage_offsets)
+
+    # (both the genotype and its parent are compared in the environment the genotype was born into)
+    expressed, unexpressed = expressed[cur], unexpressed[cur]
+    increased = combined[cur] > combined[prev]
+    expressed_increased = (expressed >= 0) & (select_environment(values, expressed, cur) > select_environment(values, expressed, prev))
+    unexpressed_increased = (unexpressed >= 0) & (select_environment(values, unexpressed, cur) > select_environment(values, unexpressed, prev))
+    return {
+        "increases": count_steps(increased, lineage, num_lineages, batch),
+        "increases_with_aggregate_change": count_steps(increased & np.asarray(aggregate_changed)[cur], lineage, num_lineages, batch),
+        "increases_in_expressed": count_steps(expressed_increased & ~unexpressed_increased, lineage, num_lineages, batch),
+        "increases_in_unexpressed": count_steps(unexpressed_increased & ~expressed_increased, lineage, num_lineages, batch)
+    }
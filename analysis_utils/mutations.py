@@ -0,0 +1,62 @@
+'''
+Batch parsing of Avida's mutations_from_parent column (e.g., "M12ab,I3c,D20d" or "(none)").
+
+Each comma-separated token is a mutation: its first character is the mutation type (M: substitution,
+I: insertion, D: deletion), followed by the site and the instruction(s) involved (M12ab: site 12 mutated
+from a to b; I3c: c inserted at site 3; D20d: d deleted from site 20).
+'''
+
+import re
+import numpy as np
+
+mutation_types = ["M", "I", "D"]
+mutation_type_codes = {mut_type: i for i, mut_type in enumerate(mutation_types)}
+
+# Every non-empty token: (type character)(site digits)(instructions)
+token_pattern = re.compile(r"([^,\n])(\d*)([^,\n]*)")
+
+def parse_mutations_from_parent(values):
+    """
+    Parse a mutations_from_parent column (one string per genotype) in one pass.
+
+    Returns a dictionary with per-genotype arrays:
+    - substitutions, insertions, deletions: number of mutations of each type
+    - total: substitutions + insertions + deletions
+    - tokens: number of comma-separated tokens (as len(value.split(",")), so "(none)" counts as 1)
+    and flat arrays with one entry per (M/I/D) mutation, in order:
+    - genotype: index of the genotype the mutation is in
+    - type: index into mutation_types
+    - site: mutated site (-1 if missing)
+    - inst: instruction after the mutation (substitutions, insertions) or the deleted instruction (deletions)
+
+    Tokens of any other type (e.g., "(none)") are reported as unknown mutation types, as our aggregation
+    scripts always have.
+    """
+    values = list(values)
+    num_genotypes = len(values)
+    text = "\n".join(values)
+    line_starts = np.cumsum([0] + [len(value) + 1 for value in values[:-1]], dtype=np.int64)
+    matches = list(token_pattern.finditer(text))
+
+    genotype = np.searchsorted(line_starts, np.array([m.start() for m in matches], dtype=np.int64), side="right") - 1
+    type_codes = np.array([mutation_type_codes.get(m.group(1), -1) for m in matches], dtype=np.int64)
+    for m, code in zip(matches, type_codes.tolist()):
+        if code == -1: print("Unknown mutation type (" + m.group(0) + ")!")
+    known = type_codes >= 0
+    known_matches = [m for m, is_known in zip(matches, known.tolist()) if is_known]
+
+    counts = [
+        np.bincount(genotype[type_codes == code], minlength=num_genotypes).astype(np.int64)
+        for code in range(len(mutation_types))
+    ]
+    return {
+        "substitutions": counts[0],
+        "insertions": counts[1],
+        "deletions": counts[2],
+        "total": counts[0] + counts[1] + counts[2],
+        "tokens": np.array([value.count(",") + 1 for value in values], dtype=np.int64),
+        "genotype": genotype[known],
+        "type": type_codes[known],
+        "site": np.array([int(m.group(2)) if m.group(2) != "" else -1 for m in known_matches], dtype=np.int64),
+        "inst": np.array([m.group(3)[-1:] for m in known_matches], dtype="U1")
+    }
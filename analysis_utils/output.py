@@ -0,0 +1,253 @@
+'''
+Streaming writers for aggregated output.
+
+- CSVStreamWriter: csv (optionally gzip-compressed).
+- FeatherWriter: Arrow IPC / Feather (v2) files, which R (arrow::read_feather) can memory-map instead of
+  parsing text. Requires pyarrow.
+'''
+
+import gzip, io
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+default_buffer_size = 1024 * 1024
+
+def column_values(column):
+    """
+    Return a column as a list of python values (written the same way whether the column is a list or array).
+    """
+    return column.tolist() if isinstance(column, np.ndarray) else column
+
+class CSVStreamWriter:
+    """
+    Write rows ({field: value} dictionaries) to a csv file through a single long-lived, buffered file handle.
+
+    The schema is fixed: it is either given up front (fields) or taken from the first row written (sorted
+    field names, to match our aggregation scripts' output). Every row must have exactly the schema's fields.
+    Values are written with str (no quoting), as our aggregation scripts always have.
+
+    - compress: write gzip-compressed csv (path should end with .gz).
+    - flush_rows: flush after every row (e.g., for summary output, so rows land on disk as they're produced).
+    """
+    def __init__(self, path, fields=None, compress=False, flush_rows=False, buffer_size=default_buffer_size):
+        self.path = path
+        self.fields = None
+        self.flush_rows = flush_rows
+        self.rows_written = 0
+        if compress:
+            raw = gzip.open(path, "wb", compresslevel=6)
+            self.fp = io.TextIOWrapper(io.BufferedWriter(raw, buffer_size=buffer_size), newline="")
+        else:
+            self.fp = open(path, "w", buffering=buffer_size, newline="")
+        if fields != None: self.set_fields(fields)
+
+    def set_fields(self, fields):
+        self.fields = list(fields)
+        self.field_set = set(self.fields)
+        self.fp.write(",".join(self.fields) + "\n")
+
+    def check_fields(self, fields):
+        if self.fields == None:
+            self.set_fields(sorted(fields))
+        elif len(fields) != len(self.fields) or not all(field in self.field_set for field in fields):
+            print(f"Header mismatch ({self.path})!")
+            print(self.fields)
+            print(sorted(fields))
+            exit(-1)
+
+    def write_row(self, row):
+        self.check_fields(row.keys())
+        self.fp.write(",".join([str(row[field]) for field in self.fields]) + "\n")
+        self.rows_written += 1
+        if self.flush_rows: self.fp.flush()
+
+    def write_rows(self, rows):
+        for row in rows: self.write_row(row)
+
+    def write_columns(self, columns):
+        """
+        Write a table given as {field: list or numpy array} columns (all the same length), one row per index.
+        """
+        self.check_fields(columns.keys())
+        values = [column_values(columns[field]) for field in self.fields]
+        num_rows = len(values[0]) if len(values) else 0
+        self.fp.write("".join(",".join(map(str, row)) + "\n" for row in zip(*values)))
+        self.rows_written += num_rows
+        if self.flush_rows: self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def infer_chunk(values):
+    """
+    Given a list of values (python/numpy values or their string forms), return (kind, numpy array) where
+    kind is the narrowest of bool, int, float, or str that represents every value without changing how
+    it would be written to csv (e.g., "0110" stays a string).
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+        kind = {"b": "bool", "i": "int", "u": "int", "f": "float"}[values.dtype.kind]
+        return kind, values.astype({"bool": bool, "int": np.int64, "float": np.float64}[kind])
+    if all(isinstance(value, (bool, np.bool_)) for value in values):
+        return "bool", np.array(values, dtype=bool)
+    strings = np.array([str(value) for value in values])
+    if np.all((strings == "True") | (strings == "False")):
+        return "bool", strings == "True"
+    try:
+        ints = strings.astype(np.int64)
+        if np.array_equal(ints.astype(str), strings):
+            return "int", ints
+    except (ValueError, OverflowError):
+        pass
+    try:
+        floats = strings.astype(np.float64)
+        # Leading zeros (e.g., "0110") mean the value is a code rather than a number.
+        digits = np.char.lstrip(strings, "-")
+        leading_zero = np.char.startswith(digits, "0") & (np.char.str_len(digits) > 1) & ~np.char.startswith(digits, "0.")
+        if not np.any(leading_zero):
+            return "float", floats
+    except ValueError:
+        pass
+    return "str", strings
+
+class FeatherWriter:
+    """
+    Write rows ({field: value} dictionaries) to an Arrow IPC (Feather v2) file.
+
+    Each column is typed as bool, int64, float64, or string (whatever represents every value in the column).
+    String columns are dictionary-encoded (R reads them as factors) when they have few distinct values
+    relative to the number of rows, or when listed in dictionary_fields (which are always strings).
+
+    Rows are collected in batches of batch_rows and stored as typed column chunks (string columns as
+    dictionary codes), so memory use is much lower than holding the rows themselves; the file is written
+    on close. compression may be "uncompressed" (the default; lets R memory-map the file), "lz4", or "zstd".
+
+    The schema is fixed by the first row, as with CSVStreamWriter.
+    """
+    def __init__(self, path, fields=None, dictionary_fields=None, compression="uncompressed", batch_rows=65536, max_dictionary_ratio=0.5):
+        if pa == None:
+            print("Feather output requires pyarrow (pip install pyarrow)!")
+            exit(-1)
+        self.path = path
+        self.fields = None
+        self.dictionary_fields = set() if dictionary_fields == None else set(dictionary_fields)
+        self.compression = compression
+        self.batch_rows = batch_rows
+        self.max_dictionary_ratio = max_dictionary_ratio
+        self.rows_written = 0
+        if fields != None: self.set_fields(fields)
+
+    def set_fields(self, fields):
+        self.fields = list(fields)
+        self.field_set = set(self.fields)
+        self.batch = {field: [] for field in self.fields}
+        self.kinds = {field: None for field in self.fields}
+        self.chunks = {field: [] for field in self.fields}
+        # For string columns: {value: code} and the values in code order.
+        self.dictionaries = {field: {} for field in self.fields}
+
+    check_fields = CSVStreamWriter.check_fields
+
+    def write_row(self, row):
+        self.check_fields(row.keys())
+        for field in self.fields:
+            self.batch[field].append(row[field])
+        self.rows_written += 1
+        if len(self.batch[self.fields[0]]) >= self.batch_rows: self.flush_batch()
+
+    def write_rows(self, rows):
+        for row in rows: self.write_row(row)
+
+    def write_columns(self, columns):
+        """
+        Write a table given as {field: list or numpy array} columns (all the same length), one row per index.
+        """
+        self.check_fields(columns.keys())
+        self.flush_batch()
+        if len(self.fields) == 0 or len(columns[self.fields[0]]) == 0: return
+        for field in self.fields:
+            self.add_chunk(field, columns[field])
+        self.rows_written += len(columns[self.fields[0]])
+
+    def encode_strings(self, field, strings):
+        dictionary = self.dictionaries[field]
+        codes = np.empty(len(strings), dtype=np.int32)
+        for i, value in enumerate(strings.tolist()):
+            code = dictionary.get(value)
+            if code == None:
+                code = len(dictionary)
+                dictionary[value] = code
+            codes[i] = code
+        return codes
+
+    def promote_to_strings(self, field):
+        # Convert this column's previous (numeric/bool) chunks to dictionary-coded strings.
+        self.chunks[field] = [self.encode_strings(field, chunk.astype(str)) for chunk in self.chunks[field]]
+        self.kinds[field] = "str"
+
+    def flush_batch(self):
+        if self.fields == None or len(self.fields) == 0 or len(self.batch[self.fields[0]]) == 0: return
+        for field in self.fields:
+            self.add_chunk(field, self.batch[field])
+            self.batch[field] = []
+
+    def add_chunk(self, field, values):
+        """
+        Add a chunk of values (list or numpy array) to a column, promoting the column's type if needed.
+        """
+        if field in self.dictionary_fields:
+            kind, chunk = "str", np.array([str(value) for value in column_values(values)])
+        else:
+            kind, chunk = infer_chunk(values)
+        prev_kind = self.kinds[field]
+        if prev_kind == None:
+            self.kinds[field] = kind
+        elif prev_kind != kind:
+            if {prev_kind, kind} == {"int", "float"}:
+                self.chunks[field] = [prev.astype(np.float64) for prev in self.chunks[field]]
+                chunk = chunk.astype(np.float64)
+                self.kinds[field] = "float"
+            else:
+                if prev_kind != "str": self.promote_to_strings(field)
+                if kind != "str": chunk = chunk.astype(str)
+        if self.kinds[field] == "str": chunk = self.encode_strings(field, chunk)
+        self.chunks[field].append(chunk)
+
+    def build_table(self):
+        self.flush_batch()
+        if self.fields == None: return pa.table({})
+        columns = {}
+        for field in self.fields:
+            if len(self.chunks[field]) == 0:
+                columns[field] = pa.array([], type=pa.string())
+                continue
+            values = np.concatenate(self.chunks[field])
+            if self.kinds[field] != "str":
+                columns[field] = pa.array(values)
+                continue
+            dictionary = pa.array(list(self.dictionaries[field].keys()), type=pa.string())
+            encoded = pa.DictionaryArray.from_arrays(pa.array(values, type=pa.int32()), dictionary)
+            if field in self.dictionary_fields or len(dictionary) <= self.max_dictionary_ratio * len(values):
+                columns[field] = encoded
+            else:
+                columns[field] = encoded.dictionary_decode()
+        return pa.table(columns)
+
+    def close(self):
+        feather.write_feather(self.build_table(), self.path, compression=self.compression)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
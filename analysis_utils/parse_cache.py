@@ -0,0 +1,195 @@
+'''
+On-disk cache of parsed Avida output files (opt-in).
+
+Parsed files are stored as binary .npz files in a cache directory, keyed by the source file's path, size,
+and modification time (so editing or replacing a source file invalidates its cache entry). Least recently
+used entries are evicted once the cache grows beyond a size limit.
+
+The cache is off unless turned on (set ANALYSIS_UTILS_CACHE=1, pass --cache to scripts that accept it, or
+call configure_cache(enabled=True)). Configuration (environment variables, or configure_cache):
+- ANALYSIS_UTILS_CACHE: set to 1 to turn the cache on
+- ANALYSIS_UTILS_CACHE_DIR: cache location (default: ~/.cache/evolutionary-consequences-of-plasticity/parse-cache)
+- ANALYSIS_UTILS_CACHE_MAX_BYTES: size limit for the cache directory (default: 512 MiB)
+'''
+
+import hashlib, os, errno
+import numpy as np
+
+# Bump whenever the parsers change in a way that changes their output (invalidates all cache entries).
+CACHE_VERSION = 2
+
+default_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "evolutionary-consequences-of-plasticity", "parse-cache")
+default_max_bytes = 512 * 1024**2
+
+cache_config = {
+    "enabled": not os.environ.get("ANALYSIS_UTILS_CACHE", "0") in {"", "0"},
+    "cache_dir": os.environ.get("ANALYSIS_UTILS_CACHE_DIR", default_cache_dir),
+    "max_bytes": int(os.environ.get("ANALYSIS_UTILS_CACHE_MAX_BYTES", default_max_bytes))
+}
+
+# Have we told the user where the cache lives yet? (printed once, on first use)
+cache_announced = False
+
+# Running total of cache directory size (computed lazily, then maintained as we add/evict entries).
+cache_size_bytes = None
+
+def configure_cache(enabled=None, cache_dir=None, max_bytes=None):
+    """
+    Override cache settings (e.g., from a script's command line arguments).
+    """
+    global cache_size_bytes
+    if enabled != None: cache_config["enabled"] = enabled
+    if max_bytes != None: cache_config["max_bytes"] = max_bytes
+    if cache_dir != None and cache_dir != cache_config["cache_dir"]:
+        cache_config["cache_dir"] = cache_dir
+        cache_size_bytes = None
+
+def cache_enabled():
+    return cache_config["enabled"]
+
+def announce_cache():
+    """
+    Print the cache location and size limit (the first time the cache is used).
+    """
+    global cache_announced
+    if cache_announced: return
+    cache_announced = True
+    print(f"Using parse cache: {cache_config['cache_dir']} (limit: {cache_config['max_bytes'] / 1024**2:.0f} MiB)")
+
+def cache_entry_path(path, kind):
+    """
+    Return the cache file location for the given source file and parse kind.
+    """
+    announce_cache()
+    stat = os.stat(path)
+    key = f"{CACHE_VERSION}|{kind}|{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(cache_config["cache_dir"], digest[:2], f"{digest}.npz")
+
+def compact_array(values):
+    """
+    Convert a list of python values into a numpy array, storing ascii strings as bytes (1 byte/character).
+    """
+    array = np.array(values)
+    if array.dtype.kind == "U":
+        try:
+            array = array.astype("S")
+        except UnicodeEncodeError:
+            pass
+    return array
+
+def load_cache_entry(entry_path):
+    """
+    Load {name: array} from a cache entry (or return None if there is no usable entry).
+    """
+    try:
+        with np.load(entry_path, allow_pickle=False) as entry:
+            fields = entry["__fields__"].astype(str).tolist()
+            columns = {field: entry[f"arr_{i}"] for i, field in enumerate(fields)}
+    except (OSError, KeyError, ValueError):
+        return None
+    # Mark as recently used (eviction is least recently used first).
+    try:
+        os.utime(entry_path)
+    except OSError:
+        pass
+    return columns
+
+def store_cache_entry(entry_path, columns):
+    """
+    Write {name: array} to a cache entry (atomically, so concurrent readers never see a partial file).
+    """
+    global cache_size_bytes
+    try:
+        os.makedirs(os.path.dirname(entry_path))
+    except OSError as exc:
+        if not (exc.errno == errno.EEXIST and os.path.isdir(os.path.dirname(entry_path))): raise
+    fields = list(columns.keys())
+    arrays = {f"arr_{i}": columns[field] for i, field in enumerate(fields)}
+    tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fp:
+        np.savez(fp, __fields__=np.array(fields, dtype=str), **arrays)
+    os.replace(tmp_path, entry_path)
+    if cache_size_bytes == None:
+        cache_size_bytes = compute_cache_size()
+    else:
+        cache_size_bytes += os.path.getsize(entry_path)
+    if cache_size_bytes > cache_config["max_bytes"]:
+        evict(cache_config["max_bytes"])
+
+def list_cache_entries():
+    """
+    Return a list of (path, size, mtime) for every entry in the cache directory.
+    """
+    entries = []
+    cache_dir = cache_config["cache_dir"]
+    if not os.path.isdir(cache_dir): return entries
+    for subdir in os.listdir(cache_dir):
+        subdir_path = os.path.join(cache_dir, subdir)
+        if not os.path.isdir(subdir_path): continue
+        for fname in os.listdir(subdir_path):
+            if not fname.endswith(".npz"): continue
+            fpath = os.path.join(subdir_path, fname)
+            try:
+                stat = os.stat(fpath)
+            except OSError:
+                continue
+            entries.append((fpath, stat.st_size, stat.st_mtime))
+    return entries
+
+def compute_cache_size():
+    return sum(size for _, size, _ in list_cache_entries())
+
+def evict(max_bytes):
+    """
+    Remove least recently used entries until the cache is at most 75% of max_bytes
+    (leaving some headroom so that we do not evict on every subsequent write).
+    """
+    global cache_size_bytes
+    entries = list_cache_entries()
+    entries.sort(key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in entries)
+    target = int(max_bytes * 0.75)
+    for fpath, size, _ in entries:
+        if total <= target: break
+        try:
+            os.remove(fpath)
+            total -= size
+        except OSError:
+            continue
+    cache_size_bytes = total
+
+def clear_cache():
+    evict(0)
+
+def cached_columns(path, kind, parse):
+    """
+    Return the result of parse() (a {name: list or numpy array} dictionary of equal-length columns) for the
+    file at path, loading it from the cache when the file has not changed since it was cached.
+
+    kind distinguishes different parses of the same file (e.g., raw strings vs. typed columns).
+    Column values come back as numpy arrays (string columns as bytes arrays; see decode_column).
+    """
+    if not cache_enabled():
+        return parse()
+    entry_path = cache_entry_path(path, kind)
+    columns = load_cache_entry(entry_path)
+    if columns != None:
+        return columns
+    columns = {name: compact_array(values) for name, values in parse().items()}
+    try:
+        store_cache_entry(entry_path, columns)
+    except OSError as err:
+        # A read-only or full cache directory should never stop an analysis.
+        print(f"Unable to write parse cache entry ({err}).")
+    return columns
+
+def decode_column(values):
+    """
+    Return a column (list or numpy array, as returned by cached_columns) as a list of python values.
+    """
+    if isinstance(values, list):
+        return values
+    if values.dtype.kind == "S":
+        values = values.astype(str)
+    return values.tolist()
@@ -0,0 +1,92 @@
+'''
+Bit-packed phenotypes (task profiles).
+
+A phenotype over an ordered list of traits (e.g., ["not", "nand", "and", "ornot", "or", "andnot"]) is packed
+into a row of uint64 words: trait i is bit (63 - i % 64) of word i // 64, so a phenotype over 64 or fewer
+traits is a single integer bitmask whose binary form reads like the phenotype string ("101010"), and larger
+task sets (e.g., the 77 complex-features tasks) take a few words.
+
+Packed phenotypes are compared with array equality, and match scores (the number of traits that agree with
+a target profile, as simple_match_coeff computes on strings) are num_traits - popcount(phenotype XOR profile).
+Convert back to the string form (phenotype_strings) only for output.
+
+Trait values are treated as performed (nonzero) or not performed (0), as in our environments each task is
+rewarded at most once (max_count=1).
+'''
+
+import numpy as np
+
+word_bits = 64
+
+# Bits set in each byte value (for numpy versions without np.bitwise_count).
+byte_popcounts = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def num_words(num_traits):
+    return max((num_traits + word_bits - 1) // word_bits, 1)
+
+def pack_bits(performed):
+    """
+    Pack a (num_phenotypes, num_traits) boolean array into a (num_phenotypes, num_words) uint64 array.
+    """
+    performed = np.asarray(performed, dtype=bool)
+    if performed.ndim == 1: performed = performed.reshape(1, -1)
+    words = num_words(performed.shape[1])
+    padded = np.zeros((performed.shape[0], words * word_bits), dtype=bool)
+    padded[:, :performed.shape[1]] = performed
+    # Big-endian bit and byte order, so trait 0 is the most significant bit of word 0.
+    packed = np.packbits(padded, axis=1, bitorder="big")
+    return np.ascontiguousarray(packed).view(">u8").astype(np.uint64)
+
+def pack_phenotypes(rows, traits):
+    """
+    Given a list of {trait: value} dictionaries (e.g., lineage rows from read_avida_dat_file), return their
+    phenotypes over traits as a (len(rows), num_words(len(traits))) uint64 array.
+    """
+    performed = np.array(
+        [[str(row[trait]) != "0" for trait in traits] for row in rows],
+        dtype=bool
+    ).reshape(len(rows), len(traits))
+    return pack_bits(performed)
+
+def pack_profile(profile):
+    """
+    Pack a phenotype string (e.g., "101010") into a (num_words,) uint64 array.
+    """
+    return pack_bits([char != "0" for char in profile])[0]
+
+def popcount(words):
+    """
+    Return the number of set bits in each row of a (..., num_words) uint64 array.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    as_bytes = np.ascontiguousarray(words).view(np.uint8)
+    return byte_popcounts[as_bytes].sum(axis=-1, dtype=np.int64)
+
+def match_scores(phenotypes, profile, num_traits):
+    """
+    Return the match score (number of traits in agreement) of each packed phenotype against profile
+    (a phenotype string or packed profile).
+    """
+    if isinstance(profile, str):
+        if len(profile) != num_traits:
+            print(f"Length mismatch! {profile} ({num_traits} traits)")
+            exit(-1)
+        profile = pack_profile(profile)
+    return num_traits - popcount(np.bitwise_xor(phenotypes, profile))
+
+def phenotypes_differ(a, b):
+    """
+    Return whether each packed phenotype in a differs from the corresponding phenotype in b.
+    """
+    return np.any(a != b, axis=-1)
+
+def phenotype_strings(phenotypes, num_traits):
+    """
+    Convert packed phenotypes back to their string form (e.g., "101010").
+    """
+    phenotypes = np.asarray(phenotypes, dtype=np.uint64)
+    if phenotypes.ndim == 1: phenotypes = phenotypes.reshape(1, -1)
+    bits = np.unpackbits(phenotypes.astype(">u8").view(np.uint8), axis=1, bitorder="big")[:, :num_traits]
+    chars = np.where(bits == 1, "1", "0")
+    return ["".join(row) for row in chars.tolist()]
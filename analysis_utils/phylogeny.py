@@ -0,0 +1,291 @@
+'''
+Array-backed phylogenies (e.g., built from phylogeny snapshot files for Muller plots).
+
+Taxa are stored by index (in order of first appearance) in parallel numpy arrays instead of one object per
+taxon: taxon ids, parent indices (-1 for the root and for taxa whose parent is unknown), and sequence and
+phenotype ids (interned in ValueTables; id 0 is the empty value, used for taxa only seen as a parent).
+Taxon ids are mapped to indices with a direct-address array, so taxon ids must be non-negative integers.
+
+Each taxon with a parent is linked as one of its parent's children when first added with that parent;
+children are ordered by when they were linked. Linking a child is O(1), and the children of every taxon are
+built into a CSR-style index (children_index) on demand for traversals (breadth_first_order).
+
+compress_by_phenotype compresses a phylogeny by phenotype (e.g., for Muller plots) given its parents in a
+topological order. SnapshotPopulations accumulates taxon populations across snapshots for the Muller
+population table.
+'''
+
+import numpy as np
+
+class ValueTable:
+    """
+    Interns values (e.g., sequences or phenotypes) as integer ids, numbered in order of first appearance.
+    Id 0 is the empty value ("").
+    """
+    def __init__(self):
+        self.ids = {"": 0}
+        self.values = [""]
+
+    def intern(self, values):
+        """
+        Return an array with the id of each value in values (adding new values to the table).
+        """
+        ids = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            value_id = self.ids.get(value)
+            if value_id == None:
+                value_id = len(self.values)
+                self.ids[value] = value_id
+                self.values.append(value)
+            ids[i] = value_id
+        return ids
+
+    def lookup(self, ids):
+        """
+        Return an (object) array with the value of each id in ids.
+        """
+        return np.array(self.values, dtype=object)[np.asarray(ids)]
+
+    def __len__(self):
+        return len(self.values)
+
+def grown(array, size, fill):
+    """
+    Return array with room for at least size entries (growing capacity geometrically); new entries are fill.
+    """
+    if size <= len(array): return array
+    larger = np.full(max(size, 2 * len(array), 16), fill, dtype=array.dtype)
+    larger[:len(array)] = array
+    return larger
+
+class Phylogeny:
+    """
+    - taxon_id, parent, sequence, phenotype, link_rank: per-taxon arrays (use num_taxa to slice off spare
+      capacity, or the taxon_ids/parents/sequences/phenotypes accessors)
+    - index_of: taxon id => taxon index (-1 if not in the phylogeny)
+    - root: index of the root taxon (the last taxon added without a parent), or -1
+    """
+    def __init__(self):
+        self.num_taxa = 0
+        self.taxon_id = np.zeros(0, dtype=np.int64)
+        self.parent = np.zeros(0, dtype=np.int64)
+        self.sequence = np.zeros(0, dtype=np.int32)
+        self.phenotype = np.zeros(0, dtype=np.int32)
+        # Order in which each taxon was linked as a child of its parent (-1 if not linked).
+        self.link_rank = np.zeros(0, dtype=np.int64)
+        self.num_links = 0
+        self.index_of = np.zeros(0, dtype=np.int64)
+        self.root = -1
+        self.children_cache = None
+
+    def taxon_ids(self): return self.taxon_id[:self.num_taxa]
+    def parents(self): return self.parent[:self.num_taxa]
+    def sequences(self): return self.sequence[:self.num_taxa]
+    def phenotypes(self): return self.phenotype[:self.num_taxa]
+
+    def indices(self, taxon_ids, add=False):
+        """
+        Return the index of each taxon id (-1 for taxa not in the phylogeny), adding missing taxa (with no
+        parent, sequence, or phenotype) if add is True.
+        """
+        taxon_ids = np.asarray(taxon_ids, dtype=np.int64)
+        if len(taxon_ids) and taxon_ids.min() < 0:
+            print("Taxon ids must be non-negative!")
+            exit(-1)
+        if not add:
+            known = taxon_ids < len(self.index_of)
+            found = np.full(len(taxon_ids), -1, dtype=np.int64)
+            found[known] = self.index_of[taxon_ids[known]]
+            return found
+        self.index_of = grown(self.index_of, int(taxon_ids.max(initial=-1)) + 1, -1)
+        missing = self.index_of[taxon_ids] == -1
+        if missing.any():
+            # (in order of first appearance)
+            new_ids, first = np.unique(taxon_ids[missing], return_index=True)
+            new_ids = new_ids[np.argsort(first, kind="stable")]
+            start = self.num_taxa
+            self.num_taxa += len(new_ids)
+            self.taxon_id = grown(self.taxon_id, self.num_taxa, -1)
+            self.parent = grown(self.parent, self.num_taxa, -1)
+            self.sequence = grown(self.sequence, self.num_taxa, 0)
+            self.phenotype = grown(self.phenotype, self.num_taxa, 0)
+            self.link_rank = grown(self.link_rank, self.num_taxa, -1)
+            self.taxon_id[start:self.num_taxa] = new_ids
+            self.index_of[new_ids] = np.arange(start, self.num_taxa)
+        return self.index_of[taxon_ids]
+
+    def add_taxa(self, taxon_ids, parent_ids, sequences, phenotypes):
+        """
+        Add (or update) taxa, in order: set each taxon's parent (-1 for none), sequence id, and phenotype id,
+        and link it as a child of its parent (adding the parent if it isn't in the phylogeny yet).
+        """
+        parent_ids = np.asarray(parent_ids, dtype=np.int64)
+        index = self.indices(taxon_ids, add=True)
+        has_parent = parent_ids != -1
+        parent_index = np.full(len(index), -1, dtype=np.int64)
+        parent_index[has_parent] = self.indices(parent_ids[has_parent], add=True)
+        # Link taxa that aren't yet children of their (new) parent, in order.
+        relink = has_parent & ((self.link_rank[index] == -1) | (self.parent[index] != parent_index))
+        self.link_rank[index[relink]] = self.num_links + np.arange(np.count_nonzero(relink))
+        self.num_links += int(np.count_nonzero(relink))
+        # (for repeated taxa, the last entry wins)
+        self.parent[index] = parent_index
+        self.sequence[index] = sequences
+        self.phenotype[index] = phenotypes
+        roots = np.flatnonzero(~has_parent)
+        if len(roots): self.root = int(index[roots[-1]])
+        self.children_cache = None
+
+    def children_index(self):
+        """
+        Return (offsets, children): the children of taxon i are children[offsets[i]:offsets[i + 1]], in the
+        order they were linked.
+        """
+        if self.children_cache == None:
+            parents = self.parents()
+            linked = np.flatnonzero((parents != -1) & (self.link_rank[:self.num_taxa] != -1))
+            order = np.lexsort((self.link_rank[linked], parents[linked]))
+            counts = np.bincount(parents[linked], minlength=self.num_taxa)
+            self.children_cache = (
+                np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                linked[order]
+            )
+        return self.children_cache
+
+    def breadth_first_order(self, root=None):
+        """
+        Return the indices of root (default: the phylogeny's root) and its descendants in breadth-first order
+        (each generation's children in order of their parents, then of when they were linked).
+        """
+        if root == None: root = self.root
+        if root == -1: return np.zeros(0, dtype=np.int64)
+        offsets, children = self.children_index()
+        levels = [np.array([root], dtype=np.int64)]
+        frontier = levels[0]
+        while len(frontier):
+            starts = offsets[frontier]
+            counts = offsets[frontier + 1] - starts
+            # Gather each frontier taxon's children (in frontier order).
+            positions = np.repeat(starts - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts) + np.arange(counts.sum())
+            frontier = children[positions]
+            levels.append(frontier)
+        return np.concatenate(levels)
+
+def nearest_marked_ancestors(parent_positions, marked):
+    """
+    Given taxa in topological order (parent_positions[i] < i is the position of taxon i's parent; the first
+    taxon is the root), return the position of each taxon's nearest marked ancestor-or-self (or the root's
+    position, 0, if there is none). Resolved by pointer jumping: O(n log depth).
+    """
+    ancestors = np.where(marked, np.arange(len(marked)), parent_positions)
+    if len(ancestors): ancestors[0] = 0
+    while True:
+        jumped = ancestors[ancestors]
+        if np.array_equal(jumped, ancestors): return ancestors
+        ancestors = jumped
+
+def compress_by_phenotype(parents, phenotypes, order):
+    """
+    Compress a phylogeny by phenotype. Taxa are visited in order (topological, root first; e.g.,
+    Phylogeny.breadth_first_order): a taxon with the same phenotype as its parent gets its parent's compressed
+    id, and any other taxon gets a new compressed id (numbered in order, from 0 for the root). Empty phenotypes
+    (id 0) are first filled in from the taxon's nearest ancestor with a phenotype.
+
+    Returns (new_ids, phenotypes, compressed_parents): each taxon's compressed id (-1 for taxa not in order),
+    phenotypes with empty phenotypes filled in, and the compressed id of each compressed taxon's parent (-1 for
+    the root).
+    """
+    parents = np.asarray(parents, dtype=np.int64)
+    phenotypes = np.array(phenotypes)
+    order = np.asarray(order, dtype=np.int64)
+    new_ids = np.full(len(parents), -1, dtype=np.int64)
+    if len(order) == 0: return new_ids, phenotypes, np.zeros(0, dtype=np.int64)
+    # Work on positions in order.
+    position = np.full(len(parents), -1, dtype=np.int64)
+    position[order] = np.arange(len(order))
+    parent_positions = position[parents[order]]
+    parent_positions[0] = 0
+    # Fill in empty phenotypes (the root's phenotype is kept as is).
+    ordered_phenotypes = phenotypes[order]
+    ordered_phenotypes = ordered_phenotypes[nearest_marked_ancestors(parent_positions, ordered_phenotypes != 0)]
+    # Taxa whose phenotype differs from their parent's start a new compressed taxon.
+    starts = ordered_phenotypes != ordered_phenotypes[parent_positions]
+    starts[0] = True
+    start_positions = np.flatnonzero(starts)
+    compressed_ids = np.cumsum(starts) - 1
+    ordered_new_ids = compressed_ids[nearest_marked_ancestors(parent_positions, starts)]
+    new_ids[order] = ordered_new_ids
+    phenotypes[order] = ordered_phenotypes
+    compressed_parents = ordered_new_ids[parent_positions[start_positions]]
+    compressed_parents[0] = -1
+    return new_ids, phenotypes, compressed_parents
+
+class SnapshotPopulations:
+    """
+    Accumulates taxon populations (num_orgs) across phylogeny snapshots without keeping a row per taxon per
+    snapshot: nonzero populations are kept as (taxon, snapshot, population) entries (at most one per
+    organism), and each taxon's presence in snapshots (including with no organisms, e.g., ancestors kept by
+    full phylogeny tracking) is run-length encoded as runs of consecutive snapshots.
+
+    populations() then folds taxa into groups (e.g., compressed taxa) once they are known.
+    """
+    def __init__(self):
+        self.times = []
+        # Snapshot at which each taxon's current run of snapshots started (-1 if not in the last snapshot)
+        self.run_start = np.zeros(0, dtype=np.int64)
+        self.runs = []      # (taxa, first snapshot, last snapshot) arrays of finished runs
+        self.counts = []    # (taxa, snapshot, population) arrays of nonzero populations
+
+    def add_snapshot(self, time, taxa, num_orgs):
+        """
+        Add a snapshot's taxa (indices) and their populations.
+        """
+        taxa = np.asarray(taxa, dtype=np.int64)
+        num_orgs = np.asarray(num_orgs, dtype=np.int64)
+        snapshot = len(self.times)
+        self.times.append(time)
+        self.run_start = grown(self.run_start, int(taxa.max(initial=-1)) + 1, -1)
+        present = np.zeros(len(self.run_start), dtype=bool)
+        present[taxa] = True
+        self.close_runs(np.flatnonzero((self.run_start != -1) & ~present), snapshot - 1)
+        started = present & (self.run_start == -1)
+        self.run_start[started] = snapshot
+        nonzero = num_orgs != 0
+        self.counts.append((taxa[nonzero], np.full(np.count_nonzero(nonzero), snapshot, dtype=np.int64), num_orgs[nonzero]))
+
+    def close_runs(self, taxa, last):
+        self.runs.append((taxa, self.run_start[taxa], np.full(len(taxa), last, dtype=np.int64)))
+        self.run_start[taxa] = -1
+
+    def populations(self, groups):
+        """
+        Return (group, snapshot, population) arrays with the total population of each group (groups[taxon];
+        -1 to drop a taxon) in each snapshot that any of its taxa are in, ordered by group then snapshot.
+        """
+        groups = np.asarray(groups, dtype=np.int64)
+        self.close_runs(np.flatnonzero(self.run_start != -1), len(self.times) - 1)
+        num_snapshots = len(self.times)
+        taxa, first, last = [np.concatenate([np.zeros(0, dtype=np.int64)] + [run[i] for run in self.runs]) for i in range(3)]
+        taxon_groups = groups[taxa]
+        kept = taxon_groups != -1
+        taxon_groups, first, last = taxon_groups[kept], first[kept], last[kept]
+        # Merge each group's (overlapping) runs: runs ordered by group then first snapshot start a new
+        # segment unless they overlap the furthest run so far.
+        order = np.lexsort((first, taxon_groups))
+        starts = taxon_groups[order] * num_snapshots + first[order]
+        ends = taxon_groups[order] * num_snapshots + last[order]
+        furthest = np.maximum.accumulate(ends)
+        new_segment = np.ones(len(starts), dtype=bool)
+        new_segment[1:] = starts[1:] > furthest[:-1]
+        segment_starts = starts[new_segment]
+        segment_ends = np.maximum.reduceat(ends, np.flatnonzero(new_segment)) if len(starts) else starts
+        # One key (group * num_snapshots + snapshot) per group per snapshot covered by a segment
+        lengths = segment_ends - segment_starts + 1
+        keys = np.repeat(segment_starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) + np.arange(lengths.sum())
+        # Add up populations
+        count_taxa, count_snapshots, count_values = [np.concatenate([np.zeros(0, dtype=np.int64)] + [count[i] for count in self.counts]) for i in range(3)]
+        count_groups = groups[count_taxa]
+        kept = count_groups != -1
+        populations = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(populations, np.searchsorted(keys, count_groups[kept] * num_snapshots + count_snapshots[kept]), count_values[kept])
+        return keys // num_snapshots, keys % num_snapshots, populations
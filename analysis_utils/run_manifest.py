@@ -0,0 +1,83 @@
+'''
+Manifest of processed runs, used to incrementally re-aggregate data as runs are added or change.
+
+The manifest (a json file in the output directory) records, for each processed run, fingerprints (size and
+modification time) of the run's input files. Each run's extracted information (its output rows) is saved
+to a separate json record file as soon as the run is processed, so an aggregation that gets interrupted
+(e.g., by a wall time limit) picks up where it left off.
+'''
+
+import json, os, errno
+
+def file_fingerprint(path):
+    """
+    Return [size, modification time (ns)] for the file at path (or None if the file does not exist).
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def write_json_atomic(path, content):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fp:
+        # Values we can't represent in json (e.g., numpy integers) are written the same way they are
+        # written to our csv output (i.e., via str).
+        json.dump(content, fp, default=str)
+    os.replace(tmp_path, path)
+
+class RunManifest:
+    """
+    Tracks which runs have been processed (and with what inputs) for a single aggregation output directory.
+
+    settings should capture everything (other than run inputs) that affects a run's record, e.g., the
+    analysis update. If the settings differ from those in an existing manifest, the manifest is reset.
+    """
+    def __init__(self, dump_dir, name, settings):
+        self.manifest_path = os.path.join(dump_dir, f"{name}_manifest.json")
+        self.records_dir = os.path.join(dump_dir, f"{name}_runs")
+        try:
+            os.makedirs(self.records_dir)
+        except OSError as exc:
+            if not (exc.errno == errno.EEXIST and os.path.isdir(self.records_dir)): raise
+        self.settings = json.loads(json.dumps(settings))
+        self.runs = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as fp:
+                manifest = json.load(fp)
+            if manifest.get("settings") == self.settings:
+                self.runs = manifest.get("runs", {})
+            else:
+                print("Aggregation settings changed since last run; reprocessing all runs.")
+
+    def fingerprint(self, run_path, input_files):
+        """
+        Return fingerprints for the given input files (paths relative to run_path).
+        """
+        return {fname: file_fingerprint(os.path.join(run_path, fname)) for fname in input_files}
+
+    def record_path(self, run_key):
+        return os.path.join(self.records_dir, f"{run_key}.json")
+
+    def is_current(self, run_key, inputs):
+        """
+        Has this run already been processed with exactly these inputs?
+        """
+        return (
+            run_key in self.runs
+            and self.runs[run_key] == inputs
+            and os.path.exists(self.record_path(run_key))
+        )
+
+    def load_record(self, run_key):
+        with open(self.record_path(run_key), "r") as fp:
+            return json.load(fp)
+
+    def save_record(self, run_key, inputs, record):
+        """
+        Save a processed run's record and mark the run as processed in the manifest.
+        """
+        write_json_atomic(self.record_path(run_key), record)
+        self.runs[run_key] = inputs
+        write_json_atomic(self.manifest_path, {"settings": self.settings, "runs": self.runs})
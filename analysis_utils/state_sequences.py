@@ -0,0 +1,205 @@
+'''
+Array-based state sequences along lineages.
+
+A lineage's genotype sequence has one entry per genotype (ancestor first): the genotype's state (e.g., its
+phenotype in each environment), the update it was born (its start), and how long it lasted (its duration:
+until the next genotype's start, or until max_update for the last genotype). Compressing a genotype sequence
+merges consecutive genotypes with the same state into a single entry (e.g., a phenotype sequence), summing
+their durations.
+
+States are encoded as integer codes (encode_states) so sequences are compared and compressed with array
+operations. Several lineages can be processed at once by concatenating their arrays and passing
+lineage_offsets (the start of each lineage in the concatenated arrays, followed by the total length), as in
+lineage_steps.
+
+write_sequence_bundle saves sequences in a compact form for the state-sequence visualization: a JSON
+manifest (the state table, per-replicate information, and sequence offsets) plus a binary file of
+little-endian int32 arrays per sequence (states as codes into the state table), so a viewer only downloads
+the sequences it draws. slice_sequence and state_occupancy cut sequences into update ranges and time bins
+(e.g., for pre-sliced visualization tiles).
+'''
+
+import json, os
+import numpy as np
+
+def single_lineage_offsets(length):
+    return np.array([0, length], dtype=np.int64)
+
+def encode_states(states):
+    """
+    Encode states (a sequence of hashable values, or a 2d array with one row per state) as integer codes,
+    numbered in order of first appearance. Returns (codes, state_table) where state_table[code] is the state
+    (a row of the array for 2d arrays).
+    """
+    states = np.asarray(states)
+    if len(states) == 0:
+        return np.zeros(0, dtype=np.int64), states[:0]
+    axis = 0 if states.ndim > 1 else None
+    table, first, inverse = np.unique(states, return_index=True, return_inverse=True, axis=axis)
+    # Renumber codes by first appearance.
+    order = np.argsort(first, kind="stable")
+    renumber = np.empty(len(order), dtype=np.int64)
+    renumber[order] = np.arange(len(order))
+    return renumber[inverse.reshape(-1)], table[order]
+
+def lineage_ids(length, lineage_offsets):
+    lineage_offsets = np.asarray(lineage_offsets, dtype=np.int64)
+    return np.repeat(np.arange(len(lineage_offsets) - 1), np.diff(lineage_offsets))[:length]
+
+def genotype_sequence_timing(update_born, max_update, lineage_offsets=None):
+    """
+    Return (starts, durations) for each genotype: starts are update born values (clamped at 0), and each
+    genotype lasts until the next genotype in its lineage starts (the last genotype lasts until max_update).
+    """
+    starts = np.maximum(np.asarray(update_born, dtype=np.int64), 0)
+    if lineage_offsets is None: lineage_offsets = single_lineage_offsets(len(starts))
+    lineage_offsets = np.asarray(lineage_offsets, dtype=np.int64)
+    ends = np.empty(len(starts), dtype=np.int64)
+    ends[:-1] = starts[1:]
+    # (the last genotype of each non-empty lineage)
+    lineage_ends = lineage_offsets[1:][np.diff(lineage_offsets) > 0] - 1
+    ends[lineage_ends] = max_update
+    return starts, ends - starts
+
+def compress_sequence(codes, starts, durations, lineage_offsets=None):
+    """
+    Run-length compress sequence(s): merge consecutive entries (within a lineage) with the same state code.
+
+    Returns (codes, starts, durations, lineage_offsets) for the compressed sequence(s), where each entry
+    starts where its first merged entry started and lasts for the sum of the merged entries' durations.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    durations = np.asarray(durations, dtype=np.int64)
+    if lineage_offsets is None: lineage_offsets = single_lineage_offsets(len(codes))
+    lineage_offsets = np.asarray(lineage_offsets, dtype=np.int64)
+    lineage = lineage_ids(len(codes), lineage_offsets)
+    is_run_start = np.ones(len(codes), dtype=bool)
+    is_run_start[1:] = (codes[1:] != codes[:-1]) | (lineage[1:] != lineage[:-1])
+    run_starts = np.flatnonzero(is_run_start)
+    run_durations = np.add.reduceat(durations, run_starts) if len(run_starts) else np.zeros(0, dtype=np.int64)
+    runs_per_lineage = np.bincount(lineage[run_starts], minlength=len(lineage_offsets) - 1)
+    return (
+        codes[run_starts],
+        starts[run_starts],
+        run_durations,
+        np.concatenate([[0], np.cumsum(runs_per_lineage)]).astype(np.int64)
+    )
+
+def unique_state_counts(codes, lineage_offsets=None):
+    """
+    Return the number of distinct state codes in each lineage's sequence.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    if lineage_offsets is None: lineage_offsets = single_lineage_offsets(len(codes))
+    num_lineages = len(lineage_offsets) - 1
+    lineage = lineage_ids(len(codes), lineage_offsets)
+    if len(codes) == 0: return np.zeros(num_lineages, dtype=np.int64)
+    pairs = np.unique(lineage * (codes.max() + 1) + codes)
+    return np.bincount(pairs // (codes.max() + 1), minlength=num_lineages)
+
+sequence_bundle_version = 1
+sequence_bundle_fields = ["state", "start", "duration"]
+
+def write_sequence_bundle(path, states, replicates, sequences):
+    """
+    Save state sequences as a JSON manifest (path, e.g., lineage_sequences.json) and one binary data file
+    per sequence (e.g., lineage_sequences.phen.bin).
+
+    - states: state table (state names, indexed by code)
+    - replicates: list of {field: value} dictionaries (one per replicate/lineage)
+    - sequences: {name: (codes, starts, durations, lineage_offsets)} (e.g., "phen" and "geno" sequences)
+
+    The manifest lists, for each sequence, its data file, its per-replicate offsets, and the byte offset
+    and length of each of its arrays (state, start, duration) in the data file.
+    """
+    path_base = os.path.splitext(path)[0]
+    manifest = {
+        "version": sequence_bundle_version,
+        "states": [str(state) for state in states],
+        "replicates": replicates,
+        "sequences": {}
+    }
+    for name, (codes, starts, durations, lineage_offsets) in sequences.items():
+        data_path = f"{path_base}.{name}.bin"
+        arrays = {}
+        offset = 0
+        with open(data_path, "wb") as fp:
+            for field, values in zip(sequence_bundle_fields, [codes, starts, durations]):
+                data = np.asarray(values, dtype="<i4").tobytes()
+                fp.write(data)
+                arrays[field] = {"offset": offset, "length": len(values)}
+                offset += len(data)
+        manifest["sequences"][name] = {
+            "data_file": os.path.basename(data_path),
+            "offsets": np.asarray(lineage_offsets, dtype=np.int64).tolist(),
+            "arrays": arrays
+        }
+    with open(path, "w") as fp:
+        json.dump(manifest, fp, separators=(",", ":"))
+
+def read_sequence_bundle(path, names=None):
+    """
+    Read sequences saved by write_sequence_bundle. Returns (manifest, {name: (codes, starts, durations,
+    lineage_offsets)}) for each sequence in names (default: all of them).
+    """
+    with open(path, "r") as fp:
+        manifest = json.load(fp)
+    sequences = {}
+    for name, info in manifest["sequences"].items():
+        if names != None and not name in names: continue
+        data_path = os.path.join(os.path.dirname(path), info["data_file"])
+        arrays = [
+            np.fromfile(
+                data_path,
+                dtype="<i4",
+                count=info["arrays"][field]["length"],
+                offset=info["arrays"][field]["offset"]
+            ).astype(np.int64)
+            for field in sequence_bundle_fields
+        ]
+        sequences[name] = (arrays[0], arrays[1], arrays[2], np.array(info["offsets"], dtype=np.int64))
+    return manifest, sequences
+
+def slice_sequence(codes, starts, durations, lineage_offsets, min_update, max_update):
+    """
+    Return (codes, starts, durations, lineage_offsets) for the entries of sequence(s) that overlap the
+    update range [min_update, max_update] (entries are kept whole).
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    durations = np.asarray(durations, dtype=np.int64)
+    lineage_offsets = np.asarray(lineage_offsets, dtype=np.int64)
+    keep = (starts <= max_update) & (starts + durations >= min_update)
+    lineage = lineage_ids(len(codes), lineage_offsets)
+    kept_per_lineage = np.bincount(lineage[keep], minlength=len(lineage_offsets) - 1)
+    return (
+        codes[keep],
+        starts[keep],
+        durations[keep],
+        np.concatenate([[0], np.cumsum(kept_per_lineage)]).astype(np.int64)
+    )
+
+def state_occupancy(codes, starts, durations, num_states, edges):
+    """
+    Return a (num_states, len(edges) - 1) array with the total time (e.g., replicate-updates) spent in each
+    state during each time bin [edges[i], edges[i + 1]), summed over every entry of the sequence(s).
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = starts + np.asarray(durations, dtype=np.int64)
+    edges = np.asarray(edges, dtype=np.int64)
+    span = int(max(edges.max(initial=0), ends.max(initial=0))) + 1
+    state_keys = np.arange(num_states, dtype=np.int64).reshape(-1, 1) * span
+    def time_before(times):
+        # For each state and edge t: sum over the state's entries of max(t - time, 0)
+        keys = codes * span + times
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        prefix = np.concatenate([[0], np.cumsum(times[order])])
+        first = np.searchsorted(sorted_keys, state_keys, side="left")
+        last = np.searchsorted(sorted_keys, state_keys + edges.reshape(1, -1), side="left")
+        return edges.reshape(1, -1) * (last - first) - (prefix[last] - prefix[first])
+    # Time spent in each state before each edge.
+    cumulative = time_before(starts) - time_before(ends)
+    return np.diff(cumulative, axis=1)
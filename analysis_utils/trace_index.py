@@ -0,0 +1,153 @@
+'''
+Persistent binary index of parsed execution traces.
+
+Each run's traces (e.g., its even and odd environment traces) are parsed once (traces.read_trace) and
+saved together as a single binary record. Later analyses memory-map the record (once; its arrays are views
+of the mapping) instead of re-parsing trace text. A record stores, for each trace:
+- sites: executed site sequence
+- opcodes: executed instruction sequence (indices into instructions)
+- site_counts: number of executions of each site (indexed by site)
+- instructions: instruction names
+
+Record layout: the magic string, the header length (little-endian uint64), a JSON header (source file
+fingerprints, instruction names, and each array's dtype/shape/offset), then each array's raw data
+(64-byte aligned). The record is rebuilt whenever a source trace changes (size or modification time).
+'''
+
+import json, os, struct
+import numpy as np
+
+from .traces import read_trace
+from .run_manifest import file_fingerprint
+
+record_magic = b"AVTRIDX1"
+record_version = 1
+alignment = 64
+record_arrays = ["sites", "opcodes", "site_counts"]
+
+def site_counts(sites):
+    return np.bincount(sites).astype(np.uint32)
+
+def aligned(offset):
+    return (offset + alignment - 1) // alignment * alignment
+
+def write_trace_index(index_path, traces, sources):
+    """
+    Save traces ({name: {sites, opcodes, site_counts, instructions}}) as a record at index_path, along
+    with the fingerprints of their source files (sources: {name: path}).
+    """
+    header = {
+        "version": record_version,
+        "sources": {name: file_fingerprint(path) for name, path in sources.items()},
+        "traces": {}
+    }
+    # Lay out array data (offsets are relative to the start of the data section).
+    offset = 0
+    for name, trace in traces.items():
+        arrays = {}
+        for array_name in record_arrays:
+            array = np.ascontiguousarray(trace[array_name])
+            arrays[array_name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset = aligned(offset + array.nbytes)
+        header["traces"][name] = {"instructions": list(trace["instructions"]), "arrays": arrays}
+    header_bytes = json.dumps(header).encode()
+    data_start = aligned(len(record_magic) + 8 + len(header_bytes))
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fp:
+        fp.write(record_magic)
+        fp.write(struct.pack("<Q", len(header_bytes)))
+        fp.write(header_bytes)
+        for name, trace in traces.items():
+            for array_name in record_arrays:
+                fp.seek(data_start + header["traces"][name]["arrays"][array_name]["offset"])
+                fp.write(np.ascontiguousarray(trace[array_name]).tobytes())
+        fp.truncate(data_start + offset)
+    os.replace(tmp_path, index_path)
+
+def read_trace_index_header(index_path):
+    """
+    Return (header, data_start) for the record at index_path, or None if it isn't a valid record.
+    """
+    try:
+        with open(index_path, "rb") as fp:
+            if fp.read(len(record_magic)) != record_magic: return None
+            header_length = struct.unpack("<Q", fp.read(8))[0]
+            header = json.loads(fp.read(header_length).decode())
+    except (OSError, ValueError, struct.error):
+        return None
+    if header.get("version") != record_version: return None
+    return header, aligned(len(record_magic) + 8 + header_length)
+
+def map_trace_index(index_path, header, data_start):
+    """
+    Return {name: {sites, opcodes, site_counts, instructions}} with arrays memory-mapped from the record.
+
+    The record's data section is mapped once and every array is a view of that mapping, so a record holds
+    a single open file handle. The mapping (and its file handle) stays open for as long as any of the
+    returned arrays is referenced; copy the arrays you need (np.array) to keep them past the record.
+    """
+    data_size = os.path.getsize(index_path) - data_start
+    # (an empty data section can't be memory-mapped; every array in it is empty)
+    data = np.zeros(0, dtype=np.uint8) if data_size <= 0 else np.memmap(
+        index_path,
+        dtype=np.uint8,
+        mode="r",
+        offset=data_start,
+        shape=(data_size,)
+    )
+    traces = {}
+    for name, info in header["traces"].items():
+        trace = {"instructions": info["instructions"]}
+        for array_name, array_info in info["arrays"].items():
+            dtype = np.dtype(array_info["dtype"])
+            shape = tuple(array_info["shape"])
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            offset = array_info["offset"]
+            trace[array_name] = data[offset:offset + nbytes].view(dtype).reshape(shape)
+        traces[name] = trace
+    return traces
+
+def parse_index_trace(path):
+    """
+    Parse a single trace into the form stored in a record ({sites, opcodes, site_counts, instructions}).
+    """
+    trace = read_trace(path)
+    trace["site_counts"] = site_counts(trace["sites"])
+    return trace
+
+def open_trace_index(index_path, sources):
+    """
+    Return the memory-mapped traces in the record at index_path if it is up to date with sources
+    ({name: path}), or None if it needs to be (re)built.
+    """
+    record = read_trace_index_header(index_path)
+    if record == None: return None
+    header, data_start = record
+    expected = {name: file_fingerprint(path) for name, path in sources.items()}
+    if header["sources"] != expected: return None
+    return map_trace_index(index_path, header, data_start)
+
+def save_trace_index(index_path, traces, sources):
+    """
+    Save parsed traces as the record at index_path, returning them memory-mapped from the record (or as
+    given, if the record can't be written).
+    """
+    try:
+        write_trace_index(index_path, traces, sources)
+    except OSError:
+        # Read-only data directory; just use the parsed traces.
+        return traces
+    header, data_start = read_trace_index_header(index_path)
+    return map_trace_index(index_path, header, data_start)
+
+def load_trace_index(index_path, sources, rebuild=False):
+    """
+    Return {name: {sites, opcodes, site_counts, instructions}} for each trace in sources ({name: path}).
+
+    Arrays are memory-mapped from the record at index_path if it is up to date; otherwise the traces are
+    parsed and the record is (re)built first.
+    """
+    traces = None if rebuild else open_trace_index(index_path, sources)
+    if traces != None: return traces
+    traces = {name: parse_index_trace(path) for name, path in sources.items()}
+    return save_trace_index(index_path, traces, sources)
@@ -0,0 +1,86 @@
+'''
+Readers for Avida execution traces (analyze mode TRACE output).
+
+A trace is a sequence of states, each starting with a "---------------------------" line, e.g.,
+
+    ---------------------------
+    U:-1
+    12 IP:5 (h-alloc)
+    AX:... (registers, heads, stacks, memory, phenotype, buffers)
+
+The final state is the organism's final status (ending with "# Final Memory: ..." for organisms that
+produce offspring), not an executed instruction.
+'''
+
+import re
+import numpy as np
+
+# A separator line (tolerating trailing whitespace and CRLF line endings).
+state_separator = re.compile(rb"^-{27}[ \t]*\r?\n", re.M)
+final_memory_marker = b"# Final Memory"
+
+default_block_size = 16 * 1024 * 1024
+
+def smallest_uint_dtype(max_value, dtypes):
+    for dtype in dtypes:
+        if max_value <= np.iinfo(dtype).max: return dtype
+    return np.uint64
+
+def read_trace(path, block_size=default_block_size):
+    """
+    Stream an execution trace, returning the executed site (instruction pointer) and instruction of each
+    executed state, in order:
+    - sites: unsigned int array (uint16 unless the genome is too long)
+    - opcodes: unsigned int array of indices into instructions (uint8 unless there are too many)
+    - instructions: instruction names, in order of first execution
+
+    The file is read in blocks and split into states on the separator lines (matched as whole lines); only
+    each state's IP line is parsed, and reading stops at "# Final Memory".
+    """
+    sites = []
+    opcodes = []
+    instruction_codes = {}
+    # Text of the state still being read (or, before the first separator, of the file's preamble).
+    pending = b""
+    in_state = False
+    done = False
+    with open(path, "rb") as trace_fp:
+        while not done:
+            block = trace_fp.read(block_size)
+            done = block == b""
+            search_from = max(len(pending) - len(final_memory_marker), 0)
+            pending += block
+            final_memory = pending.find(final_memory_marker, search_from)
+            if final_memory != -1:
+                pending = pending[:final_memory]
+                done = True
+            # (a separator at the very end of the file may lack its line break)
+            if done: pending += b"\n"
+            # A separator cut off at the end of the block stays in the last piece and is matched once
+            # the rest of its line is read.
+            states = state_separator.split(pending)
+            # The last piece is a state still being read (or, once done, the final status).
+            pending = states.pop()
+            if not in_state and len(states):
+                states = states[1:]
+                in_state = True
+            for state in states:
+                # e.g., "12 IP:5 (h-alloc)"
+                ip = state.find(b"IP:")
+                if ip == -1:
+                    print(f"Trace state without an instruction pointer ({path})!")
+                    exit(-1)
+                line_end = state.find(b"\n", ip)
+                site_end = state.find(b" ", ip, line_end)
+                sites.append(int(state[ip + 3:site_end]))
+                instruction = state[site_end + 2:state.rfind(b")", site_end, line_end)]
+                opcode = instruction_codes.get(instruction)
+                if opcode == None:
+                    opcode = len(instruction_codes)
+                    instruction_codes[instruction] = opcode
+                opcodes.append(opcode)
+    return {
+        "sites": np.array(sites, dtype=smallest_uint_dtype(max(sites, default=0), [np.uint16, np.uint32])),
+        "opcodes": np.array(opcodes, dtype=smallest_uint_dtype(len(instruction_codes) - 1, [np.uint8, np.uint16])),
+        "instructions": [instruction.decode() for instruction in instruction_codes]
+    }
@@ -3,6 +3,11 @@ Aggregate data
 '''
 
 import argparse, os, sys, errno, subprocess, csv
+from collections import deque
+
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.avida_io import read_avida_dat_file, iter_avida_dat_file
 
 run_identifier = "RUN_"
 
@@ -33,42 +38,6 @@ def extract_params_cmd_log(path):
     cfg = {param.split(" ")[0]:param.split(" ")[1] for param in params}
     return cfg
 
-def read_avida_dat_file(path):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
 def simple_match_coeff(a, b):
     if len(a) != len(b):
         print(f"Length mismatch! {a} {b}")
@@ -113,23 +82,23 @@ def main():
         ############################################################
 
         # Extract time information
-        time_data = read_avida_dat_file(os.path.join(run_path, "data", "time.dat"))
+        final_time_data = deque(iter_avida_dat_file(os.path.join(run_path, "data", "time.dat"), patch_logic3=False), maxlen=1)[0]
 
         # Extract environment information.
-        final_dom_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.dat"))[0]
-        final_dom_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "final_dominant.dat"))[0]
-        final_dom_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "final_dominant.dat"))[0]
+        final_dom_env_all = next(iter_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.dat"), patch_logic3=False))
+        final_dom_env_odd = next(iter_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "final_dominant.dat"), patch_logic3=False))
+        final_dom_env_even = next(iter_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "final_dominant.dat"), patch_logic3=False))
 
-        lineage_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "lineage_tasks.dat"))
-        lineage_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "lineage_tasks.dat"))
-        lineage_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "lineage_tasks.dat"))
+        lineage_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "lineage_tasks.dat"), patch_logic3=False)
+        lineage_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "lineage_tasks.dat"), patch_logic3=False)
+        lineage_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "lineage_tasks.dat"), patch_logic3=False)
         if len({len(lineage_env_all), len(lineage_env_even), len(lineage_env_odd)}) != 1:
             print("lineage length mismatch!")
             exit(-1)
 
         info = {}
         info["genome_length"] = final_dom_env_all["genome_length"]
-        info["average_generation"] = time_data[-1]["average_generation"]
+        info["average_generation"] = final_time_data["average_generation"]
 
         info["phenotype_even"] = "".join([final_dom_env_even[trait] for trait in phenotypic_traits])
         info["phenotype_odd"] = "".join([final_dom_env_odd[trait] for trait in phenotypic_traits])
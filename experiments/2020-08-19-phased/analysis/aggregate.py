@@ -4,6 +4,10 @@ Aggregate data
 
 import argparse, os, sys, errno, subprocess, csv
 
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.avida_io import read_avida_dat_file, iter_avida_dat_file
+
 run_identifier = "RUN_"
 
 phenotypic_traits = ["not","nand","and","ornot","or","andnot","nor","xor","equals"]
@@ -33,42 +37,6 @@ def extract_params_cmd_log(path):
     cfg = {param.split(" ")[0]:param.split(" ")[1] for param in params}
     return cfg
 
-def read_avida_dat_file(path):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
 def simple_match_coeff(a, b):
     if len(a) != len(b):
         print(f"Length mismatch! {a} {b}")
@@ -114,14 +82,21 @@ def main():
         ############################################################
 
         # Extract time information
-        time_data = read_avida_dat_file(os.path.join(run_path, "data", "time.dat"))
-        tasks_data = read_avida_dat_file(os.path.join(run_path, "data", "tasks.dat"))
+        # - keep the line at the end of phase 0 (update 200000) and the final line (end of phase 1)
+        phase_lines = {}
+        for data_name in ["time", "tasks"]:
+            phase_0_line = None
+            final_line = None
+            for line in iter_avida_dat_file(os.path.join(run_path, "data", f"{data_name}.dat"), patch_logic3=False):
+                if phase_0_line == None and line["update"] == "200000": phase_0_line = line
+                final_line = line
+            phase_lines[data_name] = {"phase_0": phase_0_line, "phase_1": final_line}
 
         # Extract environment information.
 
-        doms_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.dat"))
-        doms_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "final_dominant.dat"))
-        doms_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "final_dominant.dat"))
+        doms_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.dat"), patch_logic3=False)
+        doms_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "final_dominant.dat"), patch_logic3=False)
+        doms_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "final_dominant.dat"), patch_logic3=False)
         # sort genotypes by update born
         doms_env_all.sort(key=lambda x: int(x["update_born"]))
         doms_env_odd.sort(key=lambda x: int(x["update_born"]))
@@ -135,11 +110,11 @@ def main():
 
         # okay, this is all totally hacked... should think this through more for future experiments.
         # - maybe don't put both phases in the same final_dominant.gen file.
-        info["phase_1_average_generation"] = time_data[-1]["average_generation"]
-        info["phase_0_average_generation"] = [time_data[i]["average_generation"] for i in range(len(time_data)) if time_data[i]["update"] == "200000"][0]
+        info["phase_1_average_generation"] = phase_lines["time"]["phase_1"]["average_generation"]
+        info["phase_0_average_generation"] = phase_lines["time"]["phase_0"]["average_generation"]
 
-        info["phase_1_pop_equals"] = int(tasks_data[-1]["equals"]) > 0
-        info["phase_0_pop_equals"] = int([tasks_data[i]["equals"] for i in range(len(tasks_data)) if tasks_data[i]["update"] == "200000"][0]) > 0
+        info["phase_1_pop_equals"] = int(phase_lines["tasks"]["phase_1"]["equals"]) > 0
+        info["phase_0_pop_equals"] = int(phase_lines["tasks"]["phase_0"]["equals"]) > 0
 
         # Collect info on dominant genotypes for both phases.
         for phase_i in range(len(doms_env_all)):
@@ -180,9 +155,9 @@ def main():
             info[f"phase_{phase_i}_match_score_all"] = match_score_all
             info[f"phase_{phase_i}_match_score_odd_even"] = match_score_odd_even
 
-        lineage_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "lineage_tasks.dat"))
-        lineage_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "lineage_tasks.dat"))
-        lineage_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "lineage_tasks.dat"))
+        lineage_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "lineage_tasks.dat"), patch_logic3=False)
+        lineage_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "lineage_tasks.dat"), patch_logic3=False)
+        lineage_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "lineage_tasks.dat"), patch_logic3=False)
         if len({len(lineage_env_all), len(lineage_env_even), len(lineage_env_odd)}) != 1:
             print("lineage length mismatch!")
             exit(-1)
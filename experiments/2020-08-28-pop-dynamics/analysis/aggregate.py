@@ -4,6 +4,10 @@ Aggregate data
 
 import argparse, os, sys, errno, subprocess, csv
 
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.avida_io import read_avida_dat_file, iter_avida_dat_file
+
 run_identifier = "RUN_"
 
 phenotypic_traits = ["not","nand","and","ornot","or","andnot"]
@@ -33,42 +37,6 @@ def extract_params_cmd_log(path):
     cfg = {param.split(" ")[0]:param.split(" ")[1] for param in params}
     return cfg
 
-def read_avida_dat_file(path):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
 def simple_match_coeff(a, b):
     if len(a) != len(b):
         print(f"Length mismatch! {a} {b}")
@@ -203,16 +171,15 @@ def main():
 
         ############################################################
         # Extract time information
-        time_data = read_avida_dat_file(os.path.join(run_path, "data", "time.dat"))
         # average generation
-        summary_info["average_generation"] = [line["average_generation"] for line in time_data if int(line["update"]) == update][0]
+        summary_info["average_generation"] = next(line["average_generation"] for line in iter_avida_dat_file(os.path.join(run_path, "data", "time.dat"), patch_logic3=False) if int(line["update"]) == update)
         ############################################################
 
         ############################################################
         # Extract environment-specific final dominant information.
-        dom_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.dat"))
-        dom_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "final_dominant.dat"))
-        dom_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "final_dominant.dat"))
+        dom_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.dat"), patch_logic3=False)
+        dom_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "final_dominant.dat"), patch_logic3=False)
+        dom_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "final_dominant.dat"), patch_logic3=False)
         # (each of these files should only have one genotype in them)
 
         if len(dom_env_all) != 1 and len(dom_env_even) != 1 and len(dom_env_odd) != 1:
@@ -255,7 +222,7 @@ def main():
         ############################################################
         # Extract mutation accumulation data from lineage
         # - mutation information will be the same for all lineage data files.
-        lineage_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "lineage_tasks.dat"))
+        lineage_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "lineage_tasks.dat"), patch_logic3=False)
         summary_info["lineage_length_genotypes"] = len(lineage_env_all)
         sub_mut_cnt = 0
         ins_mut_cnt = 0
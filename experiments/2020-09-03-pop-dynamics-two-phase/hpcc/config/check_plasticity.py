@@ -8,45 +8,41 @@ odd_profile =  "010101000"
 all_profile =  "111111000"
 
 # Borrowed from Alex :^)
-def read_avida_dat_file(path):
-    content = None
+def iter_avida_dat_file(path):
+    """
+    Lazily read an Avida .dat file, yielding one {field: value} dictionary per data line.
+    """
     with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
+        # Find the legend table, and extract a field from each of its lines
+        fields = []
+        in_legend = False
+        for line in fp:
+            line = line.strip()
+            if not in_legend:
+                if line == "# Legend:":         # Handles analyze mode detail files.
+                    in_legend = True
+                    continue
+                elif "#  1:" in line:           # Handles time.dat file.
+                    in_legend = True
+                else:
+                    continue
+            if line == "": break
+            fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
+        # The rest of the file is data
+        for line in fp:
+            line = line.strip()
+            if line == "": continue
+            data_line = line.split(" ")
+            if len(data_line) != len(fields):
+                print("data fields mismatch!")
+                print(fields)
+                print(data_line)
+                exit(-1)
+            yield {field:value for field,value in zip(fields, data_line)}
 
 if __name__ == '__main__': 
-    env_even = read_avida_dat_file('data/analysis/env_even/final_dominant.dat')[0]
-    env_odd = read_avida_dat_file('data/analysis/env_odd/final_dominant.dat')[0]
+    env_even = next(iter_avida_dat_file('data/analysis/env_even/final_dominant.dat'))
+    env_odd = next(iter_avida_dat_file('data/analysis/env_odd/final_dominant.dat'))
     phenotype_even = "".join([env_even[trait] for trait in phenotypic_traits])
     phenotype_odd = "".join([env_odd[trait] for trait in phenotypic_traits])
     is_plastic = True
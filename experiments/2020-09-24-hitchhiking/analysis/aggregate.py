@@ -4,6 +4,10 @@ Aggregate data
 
 import argparse, os, sys, errno, subprocess, csv
 
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.avida_io import read_avida_dat_file, iter_avida_dat_file
+
 run_identifier = "RUN_"
 
 primary_traits = ["not","nand","and","ornot","or","andnot"]
@@ -80,46 +84,6 @@ def extract_params_cmd_log(path):
     cfg["avida_cfg"] = avida_cfg
     return cfg
 
-def read_avida_dat_file(path):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        # patch 3-input logic tasks because avida file format is nonsense
-        if "Logic 3" in line:
-            line = line.split("(")[0]
-
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
 def simple_match_coeff(a, b):
     if len(a) != len(b):
         print(f"Length mismatch! {a} {b}")
@@ -201,28 +165,16 @@ def main():
 
         ############################################################
         # Extract time information
-        time_data = read_avida_dat_file(os.path.join(run_path, "data", "time.dat"))
         # task_data = read_avida_dat_file(os.path.join(run_path, "data", "tasks.dat"))
         # average generation
-        summary_info["average_generation"] = [line["average_generation"] for line in time_data if int(line["update"]) == update][0]
+        summary_info["average_generation"] = next(line["average_generation"] for line in iter_avida_dat_file(os.path.join(run_path, "data", "time.dat")) if int(line["update"]) == update)
 
         # Extract instruction data
-        instruction_data = read_avida_dat_file(os.path.join(run_path, "data", "instruction.dat"))
-
-        focal_instruction_data = [line for line in instruction_data if line["update"] == str(update)]
-        assert(len(focal_instruction_data) == 1)
-        focal_instruction_data = focal_instruction_data[0]
-        for instr in instructions_of_interest:
-            if not instr in focal_instruction_data:
-                summary_info[f"pop_inst_count_{instr}"] = "0"
-            else:
-                summary_info[f"pop_inst_count_{instr}"] = focal_instruction_data[instr]
-        ############################################################
-
-        ############################################################
-        # Extract instructions over time
+        # - one pass over instruction.dat: counts at the focal update, and counts over time
+        focal_instruction_data = []
         instr_ot_lines = []
-        for line in instruction_data:
+        for line in iter_avida_dat_file(os.path.join(run_path, "data", "instruction.dat")):
+            if line["update"] == str(update): focal_instruction_data.append(line)
             instr_info = {}
             instr_info["chg_env"] = chg_env
             instr_info["env_cond"] = env_cond
@@ -239,6 +191,18 @@ def main():
             elif instr_over_time_header != fields:
                 print("Header mismatch!")
             instr_ot_lines.append(",".join([str(instr_info[field]) for field in fields]))
+
+        assert(len(focal_instruction_data) == 1)
+        focal_instruction_data = focal_instruction_data[0]
+        for instr in instructions_of_interest:
+            if not instr in focal_instruction_data:
+                summary_info[f"pop_inst_count_{instr}"] = "0"
+            else:
+                summary_info[f"pop_inst_count_{instr}"] = focal_instruction_data[instr]
+        ############################################################
+
+        ############################################################
+        # Write instructions over time
         with open(os.path.join(dump_dir, "instructions_ot.csv"), "a") as fp:
             if instr_over_time_write_header:
                 instr_over_time_write_header = False
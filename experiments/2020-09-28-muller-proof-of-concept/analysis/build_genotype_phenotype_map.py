@@ -5,6 +5,10 @@ generate a genotype to phenotype lookup table that can be used by extract_muller
 
 import argparse, os, copy, errno, csv, subprocess, sys, itertools
 
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.avida_io import read_avida_dat_file, iter_avida_dat_file
+
 primary_traits = ["not","nand","and","ornot","or","andnot"]
 
 def mkdir_p(path):
@@ -18,46 +22,6 @@ def mkdir_p(path):
             pass
         else: raise
 
-def read_avida_dat_file(path):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        # patch 3-input logic tasks because avida file format is nonsense
-        if "Logic 3" in line:
-            line = line.split("(")[0]
-
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
 def extract_params_cmd_log(path):
     content = None
     with open(path, "r") as fp:
@@ -101,26 +65,25 @@ def main():
     fields = []
     if chg_env:
         fields = ["sequence","phenotype_even","phenotype_odd","phenotype"]
-        seqs_env_even = read_avida_dat_file(env_even_dat_path)
-        seqs_env_odd = read_avida_dat_file(env_odd_dat_path)
-        # Number of genotypes across files must be the same.
-        assert(len(seqs_env_even) == len(seqs_env_odd))
-
         # init sequences with even phenotype information
-        sequences = {
-                        seq_even["genome_sequence"]:
-                        {
-                            "sequence": seq_even["genome_sequence"],
-                            "phenotype_even": "".join([seq_even[trait] for trait in primary_traits]),
-                            "phenotype_odd": None,
-                        }
-                        for seq_even in seqs_env_even
-                    }
+        num_seqs_env_even = 0
+        sequences = {}
+        for seq_even in iter_avida_dat_file(env_even_dat_path):
+            num_seqs_env_even += 1
+            sequences[seq_even["genome_sequence"]] = {
+                "sequence": seq_even["genome_sequence"],
+                "phenotype_even": "".join([seq_even[trait] for trait in primary_traits]),
+                "phenotype_odd": None,
+            }
 
         # add odd phenotypes in
-        for seq_odd in seqs_env_odd:
+        num_seqs_env_odd = 0
+        for seq_odd in iter_avida_dat_file(env_odd_dat_path):
+            num_seqs_env_odd += 1
             sequences[seq_odd["genome_sequence"]]["phenotype_odd"] = "".join([seq_odd[trait] for trait in primary_traits])
             sequences[seq_odd["genome_sequence"]]["phenotype"] = "[" + sequences[seq_odd["genome_sequence"]]["phenotype_even"] + sequences[seq_odd["genome_sequence"]]["phenotype_odd"] + "]"
+        # Number of genotypes across files must be the same.
+        assert(num_seqs_env_even == num_seqs_env_odd)
 
     else:
         seqs_env_all = read_avida_dat_file(env_all_dat_path)
@@ -3,68 +3,54 @@ This script is adapted from https://github.com/emilydolson/interpreting_the_tape
 """
 
 import pandas as pd
+import numpy as np
 import argparse
 import os
-import copy
+import sys
 
-class Node():
-    def __init__(self, id, parent="", seq="", phen=""):
-        self.id = id
-        self.parent = parent
-        self.children = []
-        self.seq = copy.deepcopy(seq)
-        self.phenotype = phen
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.phylogeny import Phylogeny, ValueTable, SnapshotPopulations, compress_by_phenotype
 
-    def Print(self):
-        print(f"id: {self.id}; parent: {self.parent}; children: {self.children}; seq: {self.seq}; phenotype: {self.phenotype}")
-
-
-def lookup_phenotype(row, genotype_bank):
-    if row["sequence"] in genotype_bank.index:
-       return genotype_bank.loc[row["sequence"], "phenotype"]
-    else:
-        return "NONE"
-
-def compress_phylogeny(root, nodes):
+def read_snapshot(snapshot_path, genotype_bank):
+    """
+    Read a phylogeny snapshot as whole columns: taxon ids, parent ids (-1 for the root), num_orgs,
+    sequences (as codes into sequence_values), and bank_row (each taxon's row in the genotype bank, or -1
+    for sequences not in the bank).
+    """
+    df = pd.read_csv(snapshot_path, usecols=["id", "ancestor_list", "num_orgs", "sequence"])
+    ancestors = df["ancestor_list"].str.strip("[] ")
+    assert(not ancestors.str.contains(",").any())
+    parents = ancestors.replace("NONE", "-1").astype(np.int64)
+    sequence_codes, sequence_values = pd.factorize(df["sequence"])
+    return {
+        "id": df["id"].to_numpy(dtype=np.int64),
+        "parent": parents.to_numpy(),
+        "num_orgs": df["num_orgs"].to_numpy(),
+        "sequence": sequence_codes,
+        "sequence_values": list(sequence_values),
+        # Join every taxon's sequence against the genotype bank at once.
+        "bank_row": genotype_bank.index.get_indexer(df["sequence"])
+    }
+
+def compress_phylogeny(phylogeny):
     """
     Compress phylogeny by phenotype.
+
+    Returns (adj_file, new_ids), where new_ids gives each taxon's compressed id (-1 for taxa not descended
+    from the root). Empty phenotypes are filled in from parents (in phylogeny).
     """
-    new_id_map = {}
-    next_id = 1
-    nodes[root].new_id = 0
-    new_id_map[root] = 0
-    frontier = nodes[root].children
-
-    # adj_file = pd.DataFrame({"Identity":[], "Parent":[]})
-    adj_file_contents = {"Identity":[], "Parent":[]}
-
-    while frontier:
-        #print("fontier:", frontier)
-        new_frontier = []
-
-        for n in frontier:
-            if nodes[n].phenotype == "":
-                #print(nodes[nodes[n].parent].phenotype)
-                nodes[n].phenotype = nodes[nodes[n].parent].phenotype
-
-            if nodes[n].phenotype == nodes[nodes[n].parent].phenotype:
-                nodes[n].new_id = nodes[nodes[n].parent].new_id
-            else:
-                # print(nodes[n].phenotype, nodes[nodes[n].parent].phenotype)
-                nodes[n].new_id = next_id
-                # adj_file = adj_file.append({"Identity":next_id, "Parent":nodes[nodes[n].parent].new_id}, ignore_index=True)
-                adj_file_contents["Identity"].append(next_id)
-                adj_file_contents["Parent"].append(nodes[nodes[n].parent].new_id)
-                next_id += 1
-
-            new_id_map[nodes[n].id] = nodes[n].new_id
-            new_frontier.extend(nodes[n].children)
-            #print("children:", nodes[n].children, frontier, len(frontier))
-
-        frontier = new_frontier
-
-    adj_file = pd.DataFrame(adj_file_contents)
-    return adj_file, new_id_map
+    new_ids, phenotypes, compressed_parents = compress_by_phenotype(
+        phylogeny.parents(),
+        phylogeny.phenotypes(),
+        phylogeny.breadth_first_order()
+    )
+    phylogeny.phenotype[:phylogeny.num_taxa] = phenotypes
+    adj_file = pd.DataFrame({
+        "Identity": np.arange(1, len(compressed_parents)),
+        "Parent": compressed_parents[1:]
+    })
+    return adj_file, new_ids
 
 def main():
     parser = argparse.ArgumentParser(description="Standards phylogeny file to ggmuller input files converter.")
@@ -84,16 +70,19 @@ def main():
         pop_file_name = "pop_info.csv"
 
 
-    # adj_file = adj_file.astype(dtype={"Identity":"object","Parent":"object"})
-    # pop_file = pd.DataFrame({"Identity":[], "Population":[], "Time":[]})
-    pop_file_contents = {"Identity":[], "Population":[], "Time":[]}
+    # Taxon populations in each snapshot (grouped by compressed taxon once the phylogeny is compressed)
+    populations = SnapshotPopulations()
 
     genotype_bank_path = os.path.join(args.run_dir, f"phylogeny-snapshot-genotype-phenotype-table.csv")
     genotype_bank = ""
     genotype_bank = pd.read_csv(genotype_bank_path, index_col="sequence", na_filter=False)
 
-    nodes = {}
-    root = ""
+    # Sequences and phenotypes are stored in the phylogeny as interned ids.
+    phylogeny = Phylogeny()
+    sequence_table = ValueTable()
+    phenotype_table = ValueTable()
+    # Phenotype id of each genotype bank row (and, last, of "NONE": sequences not in the bank)
+    bank_phenotypes = phenotype_table.intern(list(genotype_bank["phenotype"]) + ["NONE"])
 
     snapshot_files = [fname for fname in os.listdir(args.run_dir) if "phylogeny-snapshot-" in fname and ".csv" in fname and len(fname.split("-")) == 3]
     snapshot_files.sort(key = lambda x: int(x.split(".")[-2].split("-")[-1]))
@@ -113,58 +102,30 @@ def main():
             print("  skip file")
             continue
 
-        df = pd.read_csv(snapshot_path)
-
-        # Loop over each taxon on the phylogeny
-        for i, row in df.iterrows():
-            ancestors = row["ancestor_list"].strip("[] ").split(",")
-            assert(len(ancestors) == 1)
-            if ancestors[0] == "NONE":
-                parent = -1
-            else:
-                parent = int(ancestors[0])
-
-            phen = lookup_phenotype(row, genotype_bank)
-
-            if row["id"] in nodes:
-                nodes[row["id"]].parent = parent
-                nodes[row["id"]].seq = row["sequence"]
-                nodes[row["id"]].phenotype = phen
-            else:
-                nodes[row["id"]] = Node(row["id"], parent, row["sequence"], phen)
-
-            if parent == -1:
-                root = row["id"]
-            elif parent in nodes:
-                if row["id"] not in nodes[parent].children:
-                    nodes[parent].children.append(row["id"])
-            else:
-                nodes[parent] = Node(parent)
-                nodes[parent].children.append(row["id"])
-
-            pop_file_contents["Identity"].append(row["id"])
-            pop_file_contents["Population"].append(row["num_orgs"])
-            pop_file_contents["Time"].append(time)
-            # pop_file = pop_file.append({"Identity":row["id"], "Population":row["num_orgs"], "Time":time}, ignore_index=True)
-
-
-    # # for node in nodes:
-    # #     print("====")
-    # #     print(f"{node}:")
-    # #     nodes[node].Print()
-
-    pop_file = pd.DataFrame(pop_file_contents)
-    adj_file, new_id_map = compress_phylogeny(root, nodes)
-
-    phenotypes = []
-    for i,row in pop_file.iterrows():
-        phenotypes.append(nodes[row["Identity"]].phenotype)
-
-    pop_file["Phenotype"] = phenotypes
-
-    pop_file["Identity"] = pop_file["Identity"].map(new_id_map)
-    pop_file = pop_file.groupby(["Identity", "Phenotype", "Time"]).sum()
-    pop_file = pop_file.reset_index()
+        snapshot = read_snapshot(snapshot_path, genotype_bank)
+
+        # Add (or update) each taxon on the phylogeny
+        phylogeny.add_taxa(
+            snapshot["id"],
+            snapshot["parent"],
+            sequence_table.intern(snapshot["sequence_values"])[snapshot["sequence"]],
+            bank_phenotypes[snapshot["bank_row"]]
+        )
+        populations.add_snapshot(time, phylogeny.indices(snapshot["id"]), snapshot["num_orgs"])
+
+    adj_file, new_ids = compress_phylogeny(phylogeny)
+
+    # Total population of each compressed taxon (and its phenotype, shared by all of its taxa) per snapshot
+    reached = new_ids != -1
+    compressed_phenotypes = np.zeros(len(adj_file) + 1, dtype=np.int32)
+    compressed_phenotypes[new_ids[reached]] = phylogeny.phenotypes()[reached]
+    identities, snapshots, population = populations.populations(new_ids)
+    pop_file = pd.DataFrame({
+        "Identity": identities,
+        "Phenotype": phenotype_table.lookup(compressed_phenotypes[identities]),
+        "Time": np.array(populations.times, dtype=object)[snapshots],
+        "Population": population
+    })
 
     pop_file.to_csv(pop_file_name, index=False)
     adj_file.to_csv(adj_file_name, index=False)
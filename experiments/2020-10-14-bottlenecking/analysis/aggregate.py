@@ -4,6 +4,10 @@ Aggregate data
 
 import argparse, os, sys, errno, subprocess, csv
 
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.avida_io import read_avida_dat_file, iter_avida_dat_file
+
 run_identifier = "RUN_"
 
 primary_traits = ["not","nand","and","ornot","or","andnot"]
@@ -39,46 +43,6 @@ def extract_params_cmd_log(path):
     cfg = {param.split(" ")[0]:param.split(" ")[1] for param in params}
     return cfg
 
-def read_avida_dat_file(path):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        # patch 3-input logic tasks because avida file format is nonsense
-        if "Logic 3" in line:
-            line = line.split("(")[0]
-
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
 def simple_match_coeff(a, b):
     if len(a) != len(b):
         print(f"Length mismatch! {a} {b}")
@@ -175,18 +139,14 @@ def main():
 
         ############################################################
         # Extract time information
-        time_data = read_avida_dat_file(os.path.join(run_path, "data", "time.dat"))
-        task_data = read_avida_dat_file(os.path.join(run_path, "data", "tasks.dat"))
         # average generation
-        summary_info["average_generation"] = [line["average_generation"] for line in time_data if int(line["update"]) == update][0]
-
-        final_tasks_data = task_data[-1]
-        if (final_tasks_data["update"] != str(update)):
-            print(f"Final tasks update {final_tasks_data['update']} does not match requested analysis update {update}")
-            exit(-1)
+        summary_info["average_generation"] = next(line["average_generation"] for line in iter_avida_dat_file(os.path.join(run_path, "data", "time.dat")) if int(line["update"]) == update)
 
+        # (one pass over tasks.dat: tasks discovered at any point, and the final line)
+        final_tasks_data = None
         final_discovered_tasks = {proportion:set([]) for proportion in extra_trait_thresholds}
-        for line in task_data:
+        for line in iter_avida_dat_file(os.path.join(run_path, "data", "tasks.dat")):
+            final_tasks_data = line
             for trait in extra_traits:
                 if not trait in line: continue
                 for proportion in extra_trait_thresholds:
@@ -194,6 +154,10 @@ def main():
                     if int(line[trait]) >= threshold:
                         final_discovered_tasks[proportion].add(trait)
 
+        if (final_tasks_data["update"] != str(update)):
+            print(f"Final tasks update {final_tasks_data['update']} does not match requested analysis update {update}")
+            exit(-1)
+
         for proportion in extra_trait_thresholds:
             threshold = extra_trait_thresholds[proportion]
             summary_info[f"pop_extra_tasks_{proportion}"] = sum([int(int(final_tasks_data[trait]) > threshold) for trait in extra_traits if trait in final_tasks_data])
@@ -4,6 +4,10 @@ Aggregate data
 
 import argparse, os, sys, errno, subprocess, csv
 
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.avida_io import read_avida_dat_file, iter_avida_dat_file, read_csv
+
 run_identifier = "RUN_"
 
 primary_traits = ["not","nand","and","ornot","or","andnot"]
@@ -57,55 +61,6 @@ def extract_params_cmd_log(path):
     cfg = {param.split(" ")[0]:param.split(" ")[1] for param in params}
     return cfg
 
-def read_avida_dat_file(path):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        # patch 3-input logic tasks because avida file format is nonsense
-        if "Logic 3" in line:
-            line = line.split("(")[0]
-
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
-def read_csv(file_path):
-    content = None
-    with open(file_path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    header = content[0].split(",")
-    content = content[1:]
-    lines = [{header[i]: l[i] for i in range(len(header))} for l in csv.reader(content, quotechar='"', delimiter=',', quoting=csv.QUOTE_ALL, skipinitialspace=True)]
-    return lines
-
 def simple_match_coeff(a, b):
     if len(a) != len(b):
         print(f"Length mismatch! {a} {b}")
@@ -236,13 +191,20 @@ def main():
 
         ############################################################
         # Extract time.dat data
-        time_data = read_avida_dat_file(os.path.join(run_path, "data", "time.dat"))
         # Summery information
         # - average generation
-        summary_info["time_average_generation"] = [line["average_generation"] for line in time_data if int(line["update"]) == update][0]
-
         # Time series information
-        time_data_ts = {line["update"]: {field: line[field] for field in time_data_time_series_fields} for line in time_data if keep_line(int(line["update"]))}
+        # (both collected in one pass over time.dat)
+        average_generation = None
+        time_data_ts = {}
+        for line in iter_avida_dat_file(os.path.join(run_path, "data", "time.dat")):
+            if average_generation == None and int(line["update"]) == update: average_generation = line["average_generation"]
+            if keep_line(int(line["update"])):
+                time_data_ts[line["update"]] = {field: line[field] for field in time_data_time_series_fields}
+        if average_generation == None:
+            print(f"Update {update} not found in time.dat")
+            exit(-1)
+        summary_info["time_average_generation"] = average_generation
 
         # Check time data ts updates against previous time series updates.
         time_data_ts_updates = set(time_data_ts.keys())
@@ -254,7 +216,6 @@ def main():
         for u in time_series_updates:
             for field in time_data_ts[u]: time_series_info[u]["time_" + field] = time_data_ts[u][field]
 
-        time_data = None # release time_data
         time_data_ts = None
         ############################################################
 
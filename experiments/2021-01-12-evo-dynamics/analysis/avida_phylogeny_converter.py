@@ -14,53 +14,17 @@ file.
 Currently assumes Avida defaults in .spop fields.
 """
 
-import argparse, os, copy
+import argparse, os, copy, sys
 import pandas as pd
 
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.avida_io import iter_avida_dat_file
+
 VALID_OUT_FORMATS = ["csv", "json"]
 AVIDA_SET_FIELDS = ["parents", "cells", "gest_offset", "lineage"]
 AVIDA_SET_DELIM = ","
 
-def read_avida_dat_file(path):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        # patch 3-input logic tasks because avida file format is nonsense
-        if "Logic 3" in line:
-            line = line.split("(")[0]
-
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
 def Convert_AvidaSpop_To_StdPhylogeny(input_fpath, output_fpath=None, output_format="csv", minimal_output=False):
     """Convert Avida .spop file (default population output file for Avida) to ALife
        standard phylogeny format.
@@ -95,9 +59,9 @@ def Convert_AvidaSpop_To_StdPhylogeny(input_fpath, output_fpath=None, output_for
     output_fpath = output_fpath if (output_fpath != None) else input_fpath.replace(".spop", "_standard-phylogeny.{}".format(output_format))
 
     # -- surgery to get this to work on output of analyze mode genotype detail file --
-    dat_file_contents = read_avida_dat_file(input_fpath)
-    avida_data = {field:[] for field in dat_file_contents[0].keys()}
-    for line in dat_file_contents:
+    avida_data = None
+    for line in iter_avida_dat_file(input_fpath):
+        if avida_data == None: avida_data = {field:[] for field in line.keys()}
         for field in line:
             avida_data[field].append(line[field])
 
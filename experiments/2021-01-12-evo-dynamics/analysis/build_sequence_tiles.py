@@ -0,0 +1,205 @@
+'''
+Build pre-sliced lineage sequence tiles for the state-sequence visualization.
+
+Reads the compact phenotype sequences written by collect_state_sequences.py (--compact), and writes (to the
+dump directory):
+- tiles.json: tile index (state table, update range, and each condition's replicates and tile files)
+- per condition, chunk of replicates, and update slice (plus the full update range): the entries of each of
+  the chunk's replicates' phenotype sequences that overlap the slice
+- per condition, chunk of replicates, and bin width (zoom level): time (updates) each of the chunk's replicates
+  spent in each state during each time bin (sparse: only nonzero replicate/bin/state triples are listed)
+
+The visualization then only fetches the tiles for the replicates and update range(s) it draws, using the
+occupancy tiles instead of the sequences when zoomed out past a bin width.
+'''
+
+import argparse, os, errno, json, sys
+import numpy as np
+
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.state_sequences import read_sequence_bundle, lineage_ids, slice_sequence, state_occupancy
+
+tile_index_version = 3
+
+def mkdir_p(path):
+    try:
+        os.makedirs(path)
+    except OSError as exc: # Python >2.5
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else: raise
+
+def parse_ranges(ranges):
+    """
+    Parse update ranges given as comma-separated min:max pairs (e.g., 0:500,97500:102500).
+    """
+    parsed = []
+    for update_range in ranges.split(","):
+        bounds = update_range.split(":")
+        if len(bounds) != 2 or int(bounds[0]) > int(bounds[1]):
+            print(f"Invalid update range: {update_range}")
+            exit(-1)
+        parsed.append({"min": int(bounds[0]), "max": int(bounds[1])})
+    return parsed
+
+def select_lineages(codes, starts, durations, lineage_offsets, lineages):
+    """
+    Return (codes, starts, durations, lineage_offsets) for just the given lineages (in increasing order).
+    """
+    keep = np.isin(lineage_ids(len(codes), lineage_offsets), lineages)
+    lengths = np.diff(lineage_offsets)[lineages]
+    return codes[keep], starts[keep], durations[keep], np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+def replicate_occupancy(codes, starts, durations, lineage_offsets, edges):
+    """
+    Return (offsets, bins, states, values): the time each lineage spent in each state during each time bin
+    (edges as in state_sequences.state_occupancy), listing only nonzero lineage/bin/state triples, sorted by
+    lineage, bin, then state. offsets gives the start of each lineage's triples (followed by the total).
+    """
+    lineage = lineage_ids(len(codes), lineage_offsets)
+    num_lineages = len(lineage_offsets) - 1
+    # Only track the (lineage, state) pairs that occur, rather than every state for every lineage.
+    span = int(codes.max(initial=0)) + 1
+    pairs, pair_ids = np.unique(lineage * span + codes, return_inverse=True)
+    occupancy = state_occupancy(pair_ids, starts, durations, len(pairs), edges)
+    pair_ids, bins = np.nonzero(occupancy)
+    values = occupancy[pair_ids, bins]
+    pair_lineages, pair_states = pairs[pair_ids] // span, pairs[pair_ids] % span
+    order = np.lexsort((pair_states, bins, pair_lineages))
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(pair_lineages, minlength=num_lineages))]).astype(np.int64)
+    return offsets, bins[order], pair_states[order], values[order]
+
+def write_tile(path, tile):
+    with open(path, "w") as fp:
+        json.dump(tile, fp, separators=(",", ":"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Lineage sequence tile builder.")
+    parser.add_argument("--sequences", type=str, help="Compact lineage sequences (lineage_sequences.json) written by collect_state_sequences.py --compact")
+    parser.add_argument("--dump", type=str, help="Where to dump tiles?", default="tiles")
+    parser.add_argument("--slices", type=str, help="Update ranges to pre-slice (min:max,...)", default="0:500,97500:102500,195000:200000")
+    parser.add_argument("--replicates_per_tile", type=int, help="How many replicates (of a condition) go in each tile?", default=10)
+    parser.add_argument("--bin_widths", type=str, help="Time bin widths (zoom levels) for state occupancy tiles", default="100,1000,10000")
+
+    args = parser.parse_args()
+    slices = parse_ranges(args.slices)
+    bin_widths = sorted(set(int(width) for width in args.bin_widths.split(",")))
+    dump_dir = args.dump
+
+    if args.sequences == None or not os.path.exists(args.sequences):
+        print("Unable to find lineage sequences")
+        exit(-1)
+    if any(width <= 0 for width in bin_widths):
+        print("Bin widths must be positive")
+        exit(-1)
+    if args.replicates_per_tile <= 0:
+        print("Replicates per tile must be positive")
+        exit(-1)
+
+    mkdir_p(dump_dir)
+
+    manifest, sequences = read_sequence_bundle(args.sequences, names={"phen"})
+    codes, starts, durations, lineage_offsets = sequences["phen"]
+    replicates = manifest["replicates"]
+    full_range = {
+        "min": int(starts.min(initial=0)),
+        "max": int((starts + durations).max(initial=0))
+    }
+
+    # Group replicates by condition (environment and reaction sensors), in order of first appearance.
+    condition_replicates = {}
+    for rep_i, info in enumerate(replicates):
+        condition = (info["environment"], info["DISABLE_REACTION_SENSORS"])
+        if not condition in condition_replicates: condition_replicates[condition] = []
+        condition_replicates[condition].append(rep_i)
+    print(f"Found {len(replicates)} replicates in {len(condition_replicates)} conditions")
+
+    tile_index = {
+        "version": tile_index_version,
+        "states": manifest["states"],
+        "full_update_range": full_range,
+        "bin_widths": bin_widths,
+        "conditions": []
+    }
+    for (environment, disable_sensors), rep_ids in condition_replicates.items():
+        condition_name = f"{environment}__sensors-{'off' if disable_sensors == '1' else 'on'}"
+        print(f"Building tiles: {condition_name}")
+        condition_seq = select_lineages(codes, starts, durations, lineage_offsets, np.array(rep_ids, dtype=np.int64))
+
+        # Tiles are built for each chunk of replicates (so the visualization only fetches the replicates it draws).
+        sequence_tiles = []
+        occupancy_tiles = []
+        for first_rep in range(0, len(rep_ids), args.replicates_per_tile):
+            chunk_reps = np.arange(first_rep, min(first_rep + args.replicates_per_tile, len(rep_ids)), dtype=np.int64)
+            chunk_seq = select_lineages(*condition_seq, chunk_reps)
+            ############################################################
+            # Sequence tiles: the entries overlapping each slice (and the full update range)
+            for update_range in [full_range] + slices:
+                tile_codes, tile_starts, tile_durations, tile_offsets = slice_sequence(
+                    *chunk_seq,
+                    update_range["min"],
+                    update_range["max"]
+                )
+                tile_file = f"{condition_name}.seq.{update_range['min']}-{update_range['max']}.r{first_rep}.json"
+                write_tile(
+                    os.path.join(dump_dir, tile_file),
+                    {
+                        "min": update_range["min"],
+                        "max": update_range["max"],
+                        "first_replicate": first_rep,
+                        "offsets": tile_offsets.tolist(),
+                        "state": tile_codes.tolist(),
+                        "start": tile_starts.tolist(),
+                        "duration": tile_durations.tolist()
+                    }
+                )
+                sequence_tiles.append({
+                    "min": update_range["min"],
+                    "max": update_range["max"],
+                    "first_replicate": first_rep,
+                    "num_replicates": len(chunk_reps),
+                    "file": tile_file
+                })
+            ############################################################
+
+            ############################################################
+            # Occupancy tiles: time each replicate spent in each state per time bin, one tile per zoom level
+            for bin_width in bin_widths:
+                edges = np.append(np.arange(full_range["min"], full_range["max"], bin_width), full_range["max"])
+                tile_offsets, tile_bins, tile_states, tile_values = replicate_occupancy(*chunk_seq, edges)
+                tile_file = f"{condition_name}.occupancy.{bin_width}.r{first_rep}.json"
+                write_tile(
+                    os.path.join(dump_dir, tile_file),
+                    {
+                        "bin_width": bin_width,
+                        "min": full_range["min"],
+                        "max": full_range["max"],
+                        "first_replicate": first_rep,
+                        "offsets": tile_offsets.tolist(),
+                        "bin": tile_bins.tolist(),
+                        "state": tile_states.tolist(),
+                        "value": tile_values.tolist()
+                    }
+                )
+                occupancy_tiles.append({
+                    "bin_width": bin_width,
+                    "first_replicate": first_rep,
+                    "num_replicates": len(chunk_reps),
+                    "file": tile_file
+                })
+            ############################################################
+
+        tile_index["conditions"].append({
+            "environment": environment,
+            "DISABLE_REACTION_SENSORS": disable_sensors,
+            "replicates": [replicates[rep_i] for rep_i in rep_ids],
+            "sequence_tiles": sequence_tiles,
+            "occupancy_tiles": occupancy_tiles
+        })
+
+    with open(os.path.join(dump_dir, "tiles.json"), "w") as fp:
+        json.dump(tile_index, fp, separators=(",", ":"))
+
+if __name__ == "__main__":
+    main()
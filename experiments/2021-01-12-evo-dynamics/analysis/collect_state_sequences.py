@@ -5,6 +5,14 @@ NOTE: only collects sequences from conditions with a changing environment
 '''
 
 import argparse, os, copy, errno, csv, subprocess, sys, statistics
+import numpy as np
+
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils import parse_cache
+from analysis_utils.avida_io import read_avida_dat_file
+from analysis_utils.phenotype import num_words, pack_phenotypes, phenotype_strings
+from analysis_utils.state_sequences import encode_states, genotype_sequence_timing, compress_sequence, unique_state_counts, write_sequence_bundle
 
 run_identifier = "RUN_"
 
@@ -32,59 +40,16 @@ def extract_params_cmd_log(path):
     cfg = {param.split(" ")[0]:param.split(" ")[1] for param in params}
     return cfg
 
-def read_avida_dat_file(path):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        # patch 3-input logic tasks because avida file format is nonsense
-        if "Logic 3" in line:
-            line = line.split("(")[0]
-
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
-def simple_match_coeff(a, b):
-    if len(a) != len(b):
-        print(f"Length mismatch! {a} {b}")
-        exit(-1)
-    return sum(ai==bi for ai,bi in zip(a,b))
-
 def main():
     parser = argparse.ArgumentParser(description="Data aggregation script.")
     parser.add_argument("--data_dir", type=str, help="Where is the base output directory for runs?")
     parser.add_argument("--dump", type=str, help="Where to dump this?", default=".")
     parser.add_argument("--max_update", type=int, help="Total updates experiment ran for")
+    parser.add_argument("--compact", action="store_true", help="Also write sequences in compact form (lineage_sequences.json + .bin) for the state-sequence visualization")
+    parser.add_argument("--cache", action="store_true", help="Cache parsed data files on disk to speed up re-runs (see analysis_utils/parse_cache.py)")
 
     args = parser.parse_args()
+    if args.cache: parse_cache.configure_cache(enabled=True)
 
     data_dir = args.data_dir
     dump_dir = args.dump
@@ -100,8 +65,11 @@ def main():
     run_dirs = [run_dir for run_dir in os.listdir(data_dir) if run_identifier in run_dir]
     print(f"Found {len(run_dirs)} run directories")
 
-    content_header = None
-    content_lines = []
+    # Read every run's dominant lineage, then build all of the runs' sequences at once.
+    run_sequence_info = [] # state_sequence_info for each run we collect sequences from
+    lineage_lengths = []
+    lineage_update_born = []
+    lineage_states = []
     for run_dir in run_dirs:
         run_path = os.path.join(data_dir, run_dir)
         # Skip over (but make note of) incomplete runs.
@@ -147,105 +115,63 @@ def main():
             print("lineage isn't ordered")
             exit(-1)
 
-        # Extract phenotype sequence
-        genotype_seq_states = []
-        genotype_seq_starts = []
-        genotype_seq_durations = []
-        genotype_seq_mutations_from_parent = []
-        genotype_seq_mutations_from_ancestor = []
-        genotype_seq_state_cnt = 0
-
-        muts_from_ancestor = 0
-        for i in range(0, len(lineage_env_all)):
-            # Compute mutations from parent
-            muts_from_parent = lineage_env_all[i]["mutations_from_parent"].split(",")
-            sub_mut_from_parent_cnt = 0
-            ins_mut_from_parent_cnt = 0
-            dels_mut_from_parent_cnt = 0
-            for mut in muts_from_parent:
-                if (len(mut) == 0): continue
-                if (mut[0] == "M"): sub_mut_from_parent_cnt += 1
-                elif (mut[0] == "I"): ins_mut_from_parent_cnt += 1
-                elif (mut[0] == "D"): dels_mut_from_parent_cnt += 1
-                else: print("Unknown mutation type (" + str(mut) + ")!")
-            total_muts_from_parent = sub_mut_from_parent_cnt + ins_mut_from_parent_cnt + dels_mut_from_parent_cnt
-            muts_from_ancestor += total_muts_from_parent
-
-            # Grab phenotype information from current genotype
-            info_env_even = lineage_env_even[i]
-            info_env_odd = lineage_env_odd[i]
-            info_env_all = lineage_env_all[i]
-            # Compute phenotype information
-            phenotype_even = "".join([info_env_even[trait] for trait in traits])
-            phenotype_odd = "".join([info_env_odd[trait] for trait in traits])
-            phenotype_all = "".join([info_env_all[trait] for trait in traits])
-            plastic_even_odd = phenotype_even != phenotype_odd
-            phenotype_even_odd = phenotype_even + phenotype_odd
-            match_score_even = simple_match_coeff(phenotype_even, even_profile)
-            match_score_odd = simple_match_coeff(phenotype_odd, odd_profile)
-            match_score_all = simple_match_coeff(phenotype_all, all_profile)
-            match_score_even_odd = match_score_even + match_score_odd
-            optimal_plastic = match_score_even == len(even_profile) and match_score_odd == len(odd_profile)
-
-            state = phenotype_even_odd
-            if i > 0:
-                if genotype_seq_states[-1] != state:
-                    genotype_seq_state_cnt += 1
-            start = int(lineage_env_all[i]["update_born"])
-            if start < 0: start = 0 # Clamp start update at 0 for sanity
-            # update previous duration
-            if i: genotype_seq_durations.append(start - genotype_seq_starts[-1])
-            # update current start
-            genotype_seq_starts.append(start)
-            # update current state
-            genotype_seq_states.append(state)
-            # update current mutation accumulation information
-            genotype_seq_mutations_from_parent.append(total_muts_from_parent)
-            genotype_seq_mutations_from_ancestor.append(muts_from_ancestor)
-        genotype_seq_durations.append(int(max_update) - genotype_seq_starts[-1])
-
-        genotype_seq_unique_state_cnt = len(set(genotype_seq_states))
-        genotype_seq_length = len(genotype_seq_states)
+        # Phenotype (state) of every genotype along the lineage: its (packed) even and odd phenotypes
+        lineage_states.append(
+            np.concatenate([pack_phenotypes(lineage_env_even, traits), pack_phenotypes(lineage_env_odd, traits)], axis=1)
+        )
+        lineage_update_born.append(np.array(updates, dtype=np.int64))
+        lineage_lengths.append(len(updates))
+        run_sequence_info.append(state_sequence_info)
+        ############################################################
 
-        # Compress genotype sequence into a phenotype sequence
-        phenotype_seq_states = []
-        phenotype_seq_starts = []
-        phenotype_seq_durations = []
-        for i in range(0, len(genotype_seq_states)):
-            # If we're at the first state, just set start, states, and duration from source.
-            if i == 0:
-                phenotype_seq_states.append(genotype_seq_states[0])
-                phenotype_seq_starts.append(genotype_seq_starts[0])
-                phenotype_seq_durations.append(genotype_seq_durations[0])
-                continue
-            # Is this state the same as the previous state? Or, are we different?
-            if genotype_seq_states[i] == phenotype_seq_states[-1]:
-                # Same!
-                # Increment duration
-                phenotype_seq_durations[-1] += genotype_seq_durations[i]
-                continue
-            else:
-                # Different!
-                phenotype_seq_states.append(genotype_seq_states[i])
-                phenotype_seq_starts.append(genotype_seq_starts[i])
-                phenotype_seq_durations.append(genotype_seq_durations[i])
-        phenotype_seq_unique_state_cnt = len(set(phenotype_seq_states))
-        phenotype_seq_length = len(phenotype_seq_states)
+    ############################################################
+    # Build genotype sequences, then compress them into phenotype sequences (every run at once).
+    lineage_offsets = np.concatenate([[0], np.cumsum(lineage_lengths, dtype=np.int64)])
+    state_words = 2 * num_words(len(traits))
+    states = np.concatenate([np.zeros((0, state_words), dtype=np.uint64)] + lineage_states)
+    genotype_seq_codes, state_table = encode_states(states)
+    genotype_seq_starts, genotype_seq_durations = genotype_sequence_timing(
+        np.concatenate([np.zeros(0, dtype=np.int64)] + lineage_update_born),
+        int(max_update),
+        lineage_offsets
+    )
+    phenotype_seq_codes, phenotype_seq_starts, phenotype_seq_durations, phenotype_offsets = compress_sequence(
+        genotype_seq_codes,
+        genotype_seq_starts,
+        genotype_seq_durations,
+        lineage_offsets
+    )
+    genotype_seq_unique_state_cnts = unique_state_counts(genotype_seq_codes, lineage_offsets)
+    phenotype_seq_unique_state_cnts = unique_state_counts(phenotype_seq_codes, phenotype_offsets)
+    # State strings (even phenotype + odd phenotype), converted once per distinct state for output
+    half = state_words // 2
+    state_strings = [
+        even + odd
+        for even, odd in zip(
+            phenotype_strings(state_table[:, :half], len(traits)),
+            phenotype_strings(state_table[:, half:], len(traits))
+        )
+    ]
+    ############################################################
 
-        state_sequence_info["phen_seq_by_geno_state"] = f'"{",".join(genotype_seq_states)}"'
-        state_sequence_info["phen_seq_by_geno_start"] = f'"{",".join(map(str, genotype_seq_starts))}"'
-        state_sequence_info["phen_seq_by_geno_duration"] = f'"{",".join(map(str, genotype_seq_durations))}"'
+    content_header = None
+    content_lines = []
+    for run_i, state_sequence_info in enumerate(run_sequence_info):
+        geno = slice(lineage_offsets[run_i], lineage_offsets[run_i + 1])
+        phen = slice(phenotype_offsets[run_i], phenotype_offsets[run_i + 1])
 
-        state_sequence_info["phen_seq_by_phen_state"] = f'"{",".join(phenotype_seq_states)}"'
-        state_sequence_info["phen_seq_by_phen_start"] = f'"{",".join(map(str, phenotype_seq_starts))}"'
-        state_sequence_info["phen_seq_by_phen_duration"] = f'"{",".join(map(str, phenotype_seq_durations))}"'
+        state_sequence_info["phen_seq_by_geno_state"] = f'"{",".join([state_strings[code] for code in genotype_seq_codes[geno].tolist()])}"'
+        state_sequence_info["phen_seq_by_geno_start"] = f'"{",".join(map(str, genotype_seq_starts[geno].tolist()))}"'
+        state_sequence_info["phen_seq_by_geno_duration"] = f'"{",".join(map(str, genotype_seq_durations[geno].tolist()))}"'
 
-        state_sequence_info["genotype_seq_unique_state_cnt"] = genotype_seq_unique_state_cnt
-        state_sequence_info["genotype_seq_length"] = genotype_seq_length
-        state_sequence_info["phenotype_seq_unique_state_cnt"] = phenotype_seq_unique_state_cnt
-        state_sequence_info["phenotype_seq_length"] = phenotype_seq_length
+        state_sequence_info["phen_seq_by_phen_state"] = f'"{",".join([state_strings[code] for code in phenotype_seq_codes[phen].tolist()])}"'
+        state_sequence_info["phen_seq_by_phen_start"] = f'"{",".join(map(str, phenotype_seq_starts[phen].tolist()))}"'
+        state_sequence_info["phen_seq_by_phen_duration"] = f'"{",".join(map(str, phenotype_seq_durations[phen].tolist()))}"'
 
-        ############################################################
+        state_sequence_info["genotype_seq_unique_state_cnt"] = int(genotype_seq_unique_state_cnts[run_i])
+        state_sequence_info["genotype_seq_length"] = int(lineage_lengths[run_i])
+        state_sequence_info["phenotype_seq_unique_state_cnt"] = int(phenotype_seq_unique_state_cnts[run_i])
+        state_sequence_info["phenotype_seq_length"] = int(phenotype_offsets[run_i + 1] - phenotype_offsets[run_i])
 
         ############################################################
         # Setup output
@@ -260,6 +186,25 @@ def main():
         content_lines.append(",".join(content_line))
         ############################################################
 
+    # Write out sequences in compact form: dictionary-encoded states and integer arrays per replicate
+    if args.compact:
+        sequence_fields = {
+            "phen_seq_by_geno_state", "phen_seq_by_geno_start", "phen_seq_by_geno_duration",
+            "phen_seq_by_phen_state", "phen_seq_by_phen_start", "phen_seq_by_phen_duration"
+        }
+        write_sequence_bundle(
+            os.path.join(dump_dir, "lineage_sequences.json"),
+            state_strings,
+            [
+                {field: str(info[field]) for field in sorted(info.keys()) if not field in sequence_fields}
+                for info in run_sequence_info
+            ],
+            {
+                "phen": (phenotype_seq_codes, phenotype_seq_starts, phenotype_seq_durations, phenotype_offsets),
+                "geno": (genotype_seq_codes, genotype_seq_starts, genotype_seq_durations, lineage_offsets)
+            }
+        )
+
     # Write out sequences to file
     with open(os.path.join(dump_dir, "lineage_sequences.csv"), "w") as fp:
         fp.write(content_header + "\n")
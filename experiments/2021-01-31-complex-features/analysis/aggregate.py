@@ -4,6 +4,11 @@ Aggregate data
 
 import argparse, os, sys, errno, subprocess, csv
 
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.avida_io import read_avida_dat_file, iter_avida_dat_file, lookup_avida_dat_rows, read_csv
+from analysis_utils.mutations import parse_mutations_from_parent
+
 run_identifier = "RUN_"
 
 primary_traits = ["not","nand","and","ornot","or","andnot"]
@@ -41,63 +46,6 @@ def extract_params_cmd_log(path):
     cfg = {param.split(" ")[0]:param.split(" ")[1] for param in params}
     return cfg
 
-def read_avida_dat_file(path, backfill_missing_fields=False):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        # patch 3-input logic tasks because avida file format is nonsense
-        if "Logic 3" in line:
-            line = line.split("(")[0]
-
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) > len(fields):
-            print("found more items than there are fields!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        elif backfill_missing_fields:
-            num_backfill = len(fields) - len(data_line)
-            for _ in range(num_backfill): data_line.append("")
-        elif len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
-def read_csv(file_path):
-    content = None
-    with open(file_path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    header = content[0].split(",")
-    content = content[1:]
-    lines = [{header[i]: l[i] for i in range(len(header))} for l in csv.reader(content, quotechar='"', delimiter=',', quoting=csv.QUOTE_ALL, skipinitialspace=True)]
-    return lines
-
 def simple_match_coeff(a, b):
     if len(a) != len(b):
         print(f"Length mismatch! {a} {b}")
@@ -226,13 +174,20 @@ def main():
 
         ############################################################
         # Extract time.dat data
-        time_data = read_avida_dat_file(os.path.join(run_path, "data", "time.dat"))
         # Summery information
         # - average generation
-        summary_info["time_average_generation"] = [line["average_generation"] for line in time_data if int(line["update"]) == update][0]
-
         # Time series information
-        time_data_ts = {line["update"]: {field: line[field] for field in time_data_time_series_fields} for line in time_data if keep_line(int(line["update"]))}
+        # (both collected in one pass over time.dat)
+        average_generation = None
+        time_data_ts = {}
+        for line in iter_avida_dat_file(os.path.join(run_path, "data", "time.dat")):
+            if average_generation == None and int(line["update"]) == update: average_generation = line["average_generation"]
+            if keep_line(int(line["update"])):
+                time_data_ts[line["update"]] = {field: line[field] for field in time_data_time_series_fields}
+        if average_generation == None:
+            print(f"Update {update} not found in time.dat")
+            exit(-1)
+        summary_info["time_average_generation"] = average_generation
 
         # Grab the set of updates we have for our time series to check against other time series data for consistency
         time_series_updates = set(time_data_ts.keys())
@@ -243,15 +198,26 @@ def main():
         for u in time_series_updates:
             for field in time_data_ts[u]: time_series_info[u]["time_" + field] = time_data_ts[u][field]
 
-        time_data = None # release time_data
         time_data_ts = None
         ############################################################
 
         ############################################################
         # Extract tasks.dat data
-        task_data = read_avida_dat_file(os.path.join(run_path, "data", "tasks.dat"))
-        # Extract summary info
-        final_tasks_data = task_data[-1]
+        # Extract summary and time series information (one pass over tasks.dat)
+        final_tasks_data = None
+        final_discovered_tasks = {proportion:set([]) for proportion in extra_trait_thresholds}
+        task_data_ts = {}
+        for line in iter_avida_dat_file(os.path.join(run_path, "data", "tasks.dat")):
+            final_tasks_data = line
+            for trait in extra_traits:
+                if not trait in line: continue
+                for proportion in extra_trait_thresholds:
+                    threshold = extra_trait_thresholds[proportion]
+                    if int(line[trait]) >= threshold:
+                        final_discovered_tasks[proportion].add(trait)
+            if keep_line(int(line["update"])):
+                task_data_ts[line["update"]] = {field: line[field] for field in extra_traits}
+
         if (final_tasks_data["update"] != str(update)):
             print(f"Final tasks update {final_tasks_data['update']} does not match requested analysis update {update}")
             exit(-1)
@@ -261,22 +227,12 @@ def main():
             if task in final_tasks_data: tasks_found.add(task)
         print(f"  Found {len(tasks_found)} / {len(extra_traits)} possible tasks in tasks.dat")
 
-        final_discovered_tasks = {proportion:set([]) for proportion in extra_trait_thresholds}
-        for line in task_data:
-            for trait in extra_traits:
-                if not trait in line: continue
-                for proportion in extra_trait_thresholds:
-                    threshold = extra_trait_thresholds[proportion]
-                    if int(line[trait]) >= threshold:
-                        final_discovered_tasks[proportion].add(trait)
-
         for proportion in extra_trait_thresholds:
             threshold = extra_trait_thresholds[proportion]
             summary_info[f"final_pop_extra_tasks_{proportion}"] = sum([int(int(final_tasks_data[trait]) > threshold) for trait in extra_traits if trait in final_tasks_data])
             summary_info[f"discovered_extra_tasks_{proportion}"] = len(final_discovered_tasks[proportion])
 
         # Extract time series information
-        task_data_ts = {line["update"]: {field: line[field] for field in extra_traits} for line in task_data if keep_line(int(line["update"]))}
         for u in time_series_updates:
             task_counts = {proportion: set([]) for proportion in extra_trait_thresholds}
             for task in task_data_ts[u]:
@@ -287,7 +243,6 @@ def main():
             for proportion in extra_trait_thresholds:
                 time_series_info[u][f"task_count_{proportion}"] = len(task_counts[proportion])
 
-        task_data = None
         task_data_ts = None
         ############################################################
 
@@ -295,17 +250,17 @@ def main():
         # Extract .spop file info
         # - What are the unique keys shared across analyze mode output/.spop file?
         #   - tuple(sequence, update born)
-        spop_data = read_avida_dat_file(os.path.join(run_path, "data", f"detail-{update}.spop"), True)
-        # each entry is indexed off of update born and genome sequence so we can easily lookup spop
-        # info when grabbing data from analyze mode files.
-        spop_lookup_table = {
-            tuple([line["update_born"], line["genome_sequence"]]):line
-            for line in spop_data
-        }
+        # We only need a few fields for a few genotypes, so only tokenize the columns we need and stop
+        # reading the .spop file once we find the genotype we're looking for.
+        spop_path = os.path.join(run_path, "data", f"detail-{update}.spop")
         def spop_lookup(update_born, sequence, field):
-            return spop_lookup_table[tuple([update_born, sequence])][field]
-
-        spop_data = None
+            spop_rows = lookup_avida_dat_rows(
+                spop_path,
+                fields = [field],
+                key_fields = ["update_born", "genome_sequence"],
+                keys = [(update_born, sequence)]
+            )
+            return spop_rows[(update_born, sequence)][field]
         ############################################################
 
         ############################################################
@@ -374,9 +329,11 @@ def main():
         lineage_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "lineage_tasks.dat"))
 
         summary_info["dominant_lineage_length_genotypes"] = len(lineage_env_all)
-        sub_mut_cnt = 0
-        ins_mut_cnt = 0
-        dels_mut_cnt = 0
+        # (mutation information for every ancestor, parsed in one pass)
+        lineage_muts = parse_mutations_from_parent([line["mutations_from_parent"] for line in lineage_env_all])
+        sub_mut_cnt = int(lineage_muts["substitutions"].sum())
+        ins_mut_cnt = int(lineage_muts["insertions"].sum())
+        dels_mut_cnt = int(lineage_muts["deletions"].sum())
         lineage_tasks_ot = [set([]) for _ in range(len(lineage_env_all))]
         # primary_task_profiles_ot = [None for _ in range(len(lineage_env_all))]
         primary_task_profiles_ot = [{"odd": None, "even": None, "const": None, "aggregate": None} for _ in range(len(lineage_env_all))]
@@ -385,15 +342,6 @@ def main():
             ancestor_info = {}
             ancestor_info["update"] = lineage_env_all[i]["update_born"]
 
-            # collect mutation information for this ancestor
-            muts_from_parent = lineage_env_all[i]["mutations_from_parent"].split(",")
-            for mut in muts_from_parent:
-                if (len(mut) == 0): continue
-                if (mut[0] == "M"): sub_mut_cnt += 1
-                elif (mut[0] == "I"): ins_mut_cnt += 1
-                elif (mut[0] == "D"): dels_mut_cnt += 1
-                else: print("Unknown mutation type (" + str(mut) + ")!")
-
             # collect extra task information for this ancestor
             for trait in extra_traits:
                 even_expressed = int(lineage_env_even[i][trait]) > 0
@@ -2,9 +2,17 @@
 Summarize information from execution traces.
 '''
 
-import argparse, os, sys, errno, subprocess, csv, re
+import argparse, os, sys, errno, subprocess, csv, multiprocessing
+import numpy as np
+
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.trace_index import open_trace_index, save_trace_index, parse_index_trace
+from analysis_utils.execution import execution_mask, nop_sites, execution_architecture
 
 run_identifier = "RUN_"
+trace_index_name = "trace_index.bin"
+trace_envs = ["even", "odd"]
 
 def mkdir_p(path):
     """
@@ -34,39 +42,13 @@ def genome_from_genfile(genome_file):
         sequence = [line.strip() for line in gen_fp if (line.strip() != "") and (not "#" in line)]
     return sequence
 
-def extract_site_sequence(trace_file):
+def find_trace_path(run_path, env):
     """
-    Given a file pointer to an execution trace produced by avida's analyze mode,
-     return the site usage (list where index represents the site and the value represents executions at that site)
+    Return the path to the (first) execution trace in the run's analysis output for env.
     """
-    execution_states = []
-    execution_site_sequence = []
-    execution_inst_sequence = []
-    # Step 1: chunk the trace
-    with open(trace_file, "r") as trace_fp:
-        current_state = -1
-        for line in trace_fp:
-            if "---------------------------" in line:
-                current_state += 1
-                execution_states.append("")
-            else:
-                execution_states[current_state] += line
-    # Step 2: extract site execution sequence
-    for si in range(0, len(execution_states) - 1):
-        state = execution_states[si]
-        if "# Final Memory" in state:
-            # print ("Multiple runs in trace!?")
-            break
-        # get instruction head location
-        m = re.search(pattern = "IP:(\d+)", string = state)
-        instr_head = int(m.group(1))
-        # get current instruction
-        m = re.search(pattern = "IP:\d+\s\((.*)\)\n", string = state)
-        current_instruction = str(m.group(1))
-        # store our findings
-        execution_site_sequence.append(int(instr_head))
-        execution_inst_sequence.append(current_instruction)
-    return {"sites": execution_site_sequence, "instructions": execution_inst_sequence}
+    trace_dir = os.path.join(run_path, "data", "analysis", f"env_{env}", "trace")
+    trace_fname = [fname for fname in os.listdir(trace_dir) if ".trace" in fname][0]
+    return os.path.join(trace_dir, trace_fname)
 
 # sites toggled on in a but not in b
 # def get_chunk_sizes(sites):
@@ -85,14 +67,67 @@ def extract_site_sequence(trace_file):
 #             chunk_sizes.append(1)
 #     return chunk_sizes
 
+def read_run_settings(run_path):
+    """
+    Return summary information from the run's configuration (cmd.log), or None if we don't analyze the
+    run's traces (reaction sensors disabled).
+    """
+    summary_info = {} # Hold summary information about run. (one entry per run)
+    cmd_log_path = os.path.join(run_path, "cmd.log")
+    cmd_params = extract_params_cmd_log(cmd_log_path)
+    # Infer environmental change and change rate from events file
+    chg_env = "chg" in cmd_params["EVENT_FILE"]
+    env_cond = cmd_params["EVENT_FILE"].replace("events_", "").split("_phase")[0].lower()
+    phase = "1" if "phase-one" in cmd_params["EVENT_FILE"] else "2"
+
+    events_info = cmd_params["EVENT_FILE"].strip("events_").strip(".cfg").split("_")
+    events_info = {param.split("-")[0]:param.split("-")[1] for param in events_info}
+    change_rate = int(events_info["rate"].strip("u"))
+
+    summary_info["chg_env"] = chg_env
+    summary_info["environment"] = env_cond
+    summary_info["phase"] = phase
+    summary_info["change_rate"] = change_rate
+
+    if cmd_params["DISABLE_REACTION_SENSORS"] == "1": return None
+
+    for field in cmd_params:
+        summary_info[field] = cmd_params[field]
+    return summary_info
+
+def describe_failure(exc):
+    if isinstance(exc, SystemExit): return "parse error (see output above)"
+    return f"{type(exc).__name__}: {exc}"
+
+def parse_trace_worker(trace_path):
+    """
+    Process pool wrapper for parse_index_trace. Returns (trace, None), or (None, failure description).
+    """
+    try:
+        return parse_index_trace(trace_path), None
+    except (Exception, SystemExit) as exc:
+        # Our parsing functions report problems and exit. In a worker process that would kill the worker
+        # (and hang the pool), so report the failure back to the main process instead.
+        return None, describe_failure(exc)
+
+def trace_site_counts(traces):
+    """
+    Return an in-memory copy of each environment's per-site execution counts, so we don't keep every run's
+    trace index mapped (and its file open) for the whole collection.
+    """
+    return {env: np.array(traces[env]["site_counts"]) for env in trace_envs}
+
 def main():
     parser = argparse.ArgumentParser(description="Run submission script.")
     parser.add_argument("--data_dir", type=str, help="Where is the base output directory for each run?")
     parser.add_argument("--dump", type=str, help="Where to dump this?", default=".")
+    parser.add_argument("--rebuild_trace_index", action="store_true", help="Re-parse traces even if each run's trace index is up to date")
+    parser.add_argument("--workers", type=int, default=1, help="How many worker processes should we use to parse traces?")
 
     args = parser.parse_args()
     data_dir = args.data_dir
     dump_dir = args.dump
+    workers = args.workers
 
     if not os.path.exists(data_dir):
         print("Unable to find data directory.")
@@ -104,104 +139,95 @@ def main():
     run_dirs = [run_dir for run_dir in os.listdir(data_dir) if run_identifier in run_dir]
     print(f"Found {len(run_dirs)} run directories.")
 
-    summary_header = None
-    summary_content_lines = []
-    for run_dir in run_dirs:
-        run_path = os.path.join(data_dir, run_dir)
+    failed_runs = [] # (run path, failure description) for each run we couldn't process
+
+    ############################################################
+    # Find each run's traces, and which runs need their traces (re)parsed.
+    runs = [] # (run path, summary info, trace sources, site counts or None if the traces need parsing)
+    for run_path in [os.path.join(data_dir, run_dir) for run_dir in sorted(run_dirs)]:
         # Skip over (but make note of) incomplete runs.
         if not os.path.exists(os.path.join(run_path, 'data', 'analysis')):
             print('Skipping: ', run_path)
             continue
-
-        summary_info = {} # Hold summary information about run. (one entry per run)
+        try:
+            summary_info = read_run_settings(run_path)
+            if summary_info == None: continue
+            # ENV-A (even), ENV-B (odd)
+            trace_sources = {env: find_trace_path(run_path, env) for env in trace_envs}
+            index_path = os.path.join(run_path, "data", "analysis", trace_index_name)
+            trace_data = None if args.rebuild_trace_index else open_trace_index(index_path, trace_sources)
+            site_counts = None if trace_data == None else trace_site_counts(trace_data)
+            trace_data = None # release the mapping
+        except (Exception, SystemExit) as exc:
+            failed_runs.append((run_path, describe_failure(exc)))
+            continue
+        runs.append((run_path, summary_info, trace_sources, site_counts))
+    ############################################################
+
+    ############################################################
+    # Parse traces that aren't indexed yet: every environment's trace for every such run is a separate
+    # task (in parallel if we have multiple workers). Results come back in task order.
+    parse_tasks = [
+        trace_sources[env]
+        for run_path, summary_info, trace_sources, site_counts in runs if site_counts == None
+        for env in trace_envs
+    ]
+    print(f"Parsing {len(parse_tasks)} traces ({len(runs) - len(parse_tasks) // len(trace_envs)} runs already indexed).")
+    pool = None
+    if workers > 1 and len(parse_tasks):
+        pool = multiprocessing.Pool(workers)
+        parse_results = pool.imap(parse_trace_worker, parse_tasks)
+    else:
+        parse_results = map(parse_trace_worker, parse_tasks)
+    ############################################################
+
+    analyzed_runs = [] # (run path, summary info, genome sequence, site counts) for each run we analyze
+    # (runs are handled in run directory order, whatever order their traces finish parsing in)
+    for run_path, summary_info, trace_sources, site_counts in runs:
         print(f"Processing: {run_path}")
-
-        ############################################################
-        # Extract commandline configuration settings (from cmd.log file)
-        cmd_log_path = os.path.join(run_path, "cmd.log")
-        cmd_params = extract_params_cmd_log(cmd_log_path)
-        # Infer environmental change and change rate from events file
-        chg_env = "chg" in cmd_params["EVENT_FILE"]
-        env_cond = cmd_params["EVENT_FILE"].replace("events_", "").split("_phase")[0].lower()
-        phase = "1" if "phase-one" in cmd_params["EVENT_FILE"] else "2"
-
-        events_info = cmd_params["EVENT_FILE"].strip("events_").strip(".cfg").split("_")
-        events_info = {param.split("-")[0]:param.split("-")[1] for param in events_info}
-        change_rate = int(events_info["rate"].strip("u"))
-
-        summary_info["chg_env"] = chg_env
-        summary_info["environment"] = env_cond
-        summary_info["phase"] = phase
-        summary_info["change_rate"] = change_rate
-
-        if cmd_params["DISABLE_REACTION_SENSORS"] == "1": continue
-
-        for field in cmd_params:
-            summary_info[field] = cmd_params[field]
-
-        ############################################################
-
+        index_path = os.path.join(run_path, "data", "analysis", trace_index_name)
+        if site_counts == None:
+            parsed = {env: next(parse_results) for env in trace_envs}
+            failures = [f"{env} trace: {failure}" for env, (trace, failure) in parsed.items() if failure != None]
+            if len(failures):
+                failed_runs.append((run_path, "; ".join(failures)))
+                continue
+            site_counts = trace_site_counts(save_trace_index(index_path, {env: parsed[env][0] for env in trace_envs}, trace_sources))
         ############################################################
         # Load genome file
         genome_path = os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.gen")
-        genome_sequence = genome_from_genfile(genome_path)
+        try:
+            genome_sequence = genome_from_genfile(genome_path)
+        except OSError as exc:
+            failed_runs.append((run_path, describe_failure(exc)))
+            continue
         ############################################################
+        analyzed_runs.append((run_path, summary_info, genome_sequence, site_counts))
+
+    ############################################################
+    # Which sites are toggled (executed in some, but not all, environments)? Analyze every run at once.
+    # (a run's sites go up to its genome length, or to the largest site executed past the end of its genome)
+    genome_lengths = [len(genome_sequence) for run_path, summary_info, genome_sequence, site_counts in analyzed_runs]
+    run_executed = [
+        execution_mask([site_counts[env] for env in trace_envs], len(genome_sequence))
+        for run_path, summary_info, genome_sequence, site_counts in analyzed_runs
+    ]
+    site_offsets = np.concatenate([[0], np.cumsum([mask.shape[1] for mask in run_executed], dtype=np.int64)])
+    executed = np.concatenate([np.zeros((len(trace_envs), 0), dtype=bool)] + run_executed, axis=1)
+    nops = np.concatenate(
+        [np.zeros(0, dtype=bool)] + [
+            np.pad(nop_sites(genome_sequence), (0, mask.shape[1] - len(genome_sequence)))
+            for (run_path, summary_info, genome_sequence, site_counts), mask in zip(analyzed_runs, run_executed)
+        ]
+    )
+    architecture = execution_architecture(executed, nops, site_offsets, genome_lengths)
+    ############################################################
 
-        ############################################################
-        # Extract trace data for env-a an env-b
-        # ENV-A (even)
-        env_a_trace_path = os.path.join(run_path, "data", "analysis", "env_even", "trace") # even
-        # get file name
-        trace_a_fname = [fname for fname in os.listdir(env_a_trace_path) if ".trace" in fname][0]
-        # Append to path
-        env_a_trace_path = os.path.join(env_a_trace_path, trace_a_fname)
-        # ENV-B (odd)
-        env_b_trace_path = os.path.join(run_path, "data", "analysis", "env_odd", "trace") # odd
-        # get file name
-        trace_b_fname = [fname for fname in os.listdir(env_b_trace_path) if ".trace" in fname][0]
-        # Append to path
-        env_b_trace_path = os.path.join(env_b_trace_path, trace_b_fname)
-
-        # parse trace data
-        env_a_trace_data = extract_site_sequence(env_a_trace_path)
-        env_b_trace_data = extract_site_sequence(env_b_trace_path)
-
-        sites_executed_env_a = set(env_a_trace_data["sites"])
-        sites_executed_env_b = set(env_b_trace_data["sites"])
-
-        # Which sites are toggled based on environmental context?
-        toggled_sites = sites_executed_env_a ^ sites_executed_env_b
-        num_toggled_sites = len(toggled_sites)
-        summary_info["dominant_num_toggled_sites"] = num_toggled_sites
-
-        # Which instructions are executed?
-        env_a_execution = [i in sites_executed_env_a for i in range(len(genome_sequence))]
-        env_b_execution = [i in sites_executed_env_b for i in range(len(genome_sequence))]
-        toggled_execution = [env_a_execution[i] ^ env_b_execution[i] for i in range(len(genome_sequence))]
-        # which sites are unexecuted nops? (we don't want these to break up/count toward chunk size)
-        unexecuted_nops = [ (not (env_a_execution[i] or env_b_execution[i])) and "nop-" in genome_sequence[i] for i in range(len(genome_sequence))]
-
-        chunk_sizes = []
-        cur_chunk_size = 0
-        in_chunk = False
-        for site_i in range(len(genome_sequence)):
-            toggled = toggled_execution[site_i]
-            unexecuted_nop = unexecuted_nops[site_i]
-            # we don't care about unexecuted nops
-            if unexecuted_nop: continue
-            if toggled and not in_chunk:
-                in_chunk = True
-                cur_chunk_size = 1
-            elif toggled and in_chunk:
-                cur_chunk_size += 1
-            elif not toggled and in_chunk:
-                chunk_sizes.append(cur_chunk_size)
-                in_chunk = False
-                cur_chunk_size = 0
-        if cur_chunk_size: chunk_sizes.append(cur_chunk_size)
-
-        summary_info["dominant_toggled_chunk_sizes"] = ";".join(map(str, chunk_sizes))
-        ############################################################
+    summary_header = None
+    summary_content_lines = []
+    for run_i, (run_path, summary_info, genome_sequence, site_counts) in enumerate(analyzed_runs):
+        summary_info["dominant_num_toggled_sites"] = int(architecture["num_toggled"][run_i])
+        summary_info["dominant_toggled_chunk_sizes"] = ";".join(map(str, architecture["chunk_lengths"][run_i].tolist()))
 
         ############################################################
         # Add summary_info to aggregate content
@@ -216,6 +242,16 @@ def main():
         summary_content_lines.append(",".join(summary_line))
         ############################################################
 
+    if pool != None:
+        pool.close()
+        pool.join()
+
+    # Report (but don't stop for) runs we couldn't process.
+    if len(failed_runs):
+        print(f"Failed to process {len(failed_runs)} runs:")
+        for run_path, failure in sorted(failed_runs):
+            print(f"  {run_path}: {failure}")
+
     # write out aggregate data
     if summary_header == None: return
     with open(os.path.join(dump_dir, "trace_summary.csv"), "w") as fp:
@@ -224,4 +260,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -3,6 +3,15 @@ Aggregate data
 '''
 
 import argparse, os, sys, errno, subprocess, csv, statistics
+import numpy as np
+
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils.avida_io import read_avida_dat_file, lookup_avida_dat_rows, read_csv
+from analysis_utils.lineage_steps import environment_indices, increase_step_counts
+from analysis_utils.columnar import load_avida_dat_columns, value_at_update, update_range_slice
+from analysis_utils.mutations import parse_mutations_from_parent
+from analysis_utils.env_schedule import load_run_schedule
 
 run_identifier = "RUN_"
 
@@ -16,6 +25,12 @@ all_profile = "111111"
 max_pop_size = 3600
 
 env_order = ["even", "odd"]
+# Environments by the reactions they reward (used to replay a run's events file).
+environment_rewards = {
+    "even": {"NOT", "AND", "OR"},
+    "odd": {"NAND", "ORN", "ANDN"},
+    "all": {"NOT", "NAND", "AND", "ORN", "OR", "ANDN"}
+}
 
 time_data_time_series_fields = ["average_generation"]
 instruction_data_time_series_fields = ["poison"]
@@ -31,20 +46,6 @@ def mkdir_p(path):
             pass
         else: raise
 
-def build_env_lookup(period_length, max_update):
-    lookup = ["all" for i in range(0, max_update+1)]
-    if period_length == 0:
-        return lookup
-    u = 0
-    env_i = 0
-    while u < len(lookup):
-        for pi in range(period_length):
-            if u >= len(lookup): break
-            lookup[u] = env_order[env_i]
-            u+=1
-        env_i = (env_i + 1) % len(env_order)
-    return lookup
-
 def extract_params_cmd_log(path):
     content = None
     with open(path, "r") as fp:
@@ -54,63 +55,6 @@ def extract_params_cmd_log(path):
     cfg = {param.split(" ")[0]:param.split(" ")[1] for param in params}
     return cfg
 
-def read_avida_dat_file(path, backfill_missing_fields=False):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        # patch 3-input logic tasks because avida file format is nonsense
-        if "Logic 3" in line:
-            line = line.split("(")[0]
-
-        fields.append( line.split(":")[-1].strip().lower().replace("#", "").strip().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) > len(fields):
-            print("found more items than there are fields!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        elif backfill_missing_fields:
-            num_backfill = len(fields) - len(data_line)
-            for _ in range(num_backfill): data_line.append("")
-        elif len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
-def read_csv(file_path):
-    content = None
-    with open(file_path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    header = content[0].split(",")
-    content = content[1:]
-    lines = [{header[i]: l[i] for i in range(len(header))} for l in csv.reader(content, quotechar='"', delimiter=',', quoting=csv.QUOTE_ALL, skipinitialspace=True)]
-    return lines
-
 def simple_match_coeff(a, b):
     if len(a) != len(b):
         print(f"Length mismatch! {a} {b}")
@@ -190,7 +134,14 @@ def main():
         events_info = {param.split("-")[0]:param.split("-")[1] for param in events_info}
         change_rate = int(events_info["rate"].strip("u"))
 
-        environment_lookup = build_env_lookup(period_length = change_rate, max_update = update)
+        environment_schedule = load_run_schedule(
+            run_path,
+            cmd_params["EVENT_FILE"],
+            environments = environment_rewards,
+            change_rate = change_rate,
+            max_update = update,
+            env_order = env_order
+        )
 
         summary_info["chg_env"] = chg_env
         summary_info["environment"] = env_cond
@@ -246,13 +197,17 @@ def main():
 
         ############################################################
         # Extract time.dat data
-        time_data = read_avida_dat_file(os.path.join(run_path, "data", "time.dat"))
+        time_data = load_avida_dat_columns(os.path.join(run_path, "data", "time.dat"), strip_hash=True)
         # Summery information
         # - average generation
-        summary_info["time_average_generation"] = [line["average_generation"] for line in time_data if int(line["update"]) == update][0]
+        summary_info["time_average_generation"] = value_at_update(time_data, "average_generation", update)
 
         # Time series information
-        time_data_ts = {line["update"]: {field: line[field] for field in time_data_time_series_fields} for line in time_data if keep_line(int(line["update"]))}
+        ts_rows = update_range_slice(time_data, time_series_range[0], time_series_range[1])
+        time_data_ts = {str(u): {} for u in time_data["update"][ts_rows].tolist()}
+        for field in time_data_time_series_fields:
+            for u, value in zip(time_data["update"][ts_rows].tolist(), time_data[field][ts_rows].tolist()):
+                time_data_ts[str(u)][field] = value
 
         # Grab the set of updates we have for our time series to check against other time series data for consistency
         time_series_updates = set(time_data_ts.keys())
@@ -269,13 +224,20 @@ def main():
 
         ############################################################
         # Extract instruction.dat data
-        instruction_data = read_avida_dat_file(os.path.join(run_path, "data", "instruction.dat"))
+        instruction_data = load_avida_dat_columns(
+            os.path.join(run_path, "data", "instruction.dat"),
+            fields = ["update"] + instruction_data_time_series_fields,
+            strip_hash = True
+        )
         # Summary information
-        instruction_summary_data = [line for line in instruction_data if int(line["update"]) == update][0]
-        summary_info["final_population_poison"] = instruction_summary_data["poison"]
+        summary_info["final_population_poison"] = value_at_update(instruction_data, "poison", update)
         # Extract information over time
         # Time series information
-        instruction_data_ts = {line["update"]: {field: line[field] for field in instruction_data_time_series_fields} for line in instruction_data if keep_line(int(line["update"]))}
+        ts_rows = update_range_slice(instruction_data, time_series_range[0], time_series_range[1])
+        instruction_data_ts = {str(u): {} for u in instruction_data["update"][ts_rows].tolist()}
+        for field in instruction_data_time_series_fields:
+            for u, value in zip(instruction_data["update"][ts_rows].tolist(), instruction_data[field][ts_rows].tolist()):
+                instruction_data_ts[str(u)][field] = value
         for u in time_series_updates:
             for field in instruction_data_ts[u]: time_series_info[u]["inst_" + field] = instruction_data_ts[u][field]
         ############################################################
@@ -284,24 +246,25 @@ def main():
         # Extract .spop file info
         # - What are the unique keys shared across analyze mode output/.spop file?
         #   - tuple(sequence, update born)
-        spop_data = read_avida_dat_file(os.path.join(run_path, "data", f"detail-{update}.spop"), True)
-        # each entry is indexed off of update born and genome sequence so we can easily lookup spop
-        # info when grabbing data from analyze mode files.
-        spop_lookup_table = {
-            tuple([line["update_born"], line["genome_sequence"]]):line
-            for line in spop_data
-        }
+        # We only need a few fields for a few genotypes, so only tokenize the columns we need and stop
+        # reading the .spop file once we find the genotype we're looking for.
+        spop_path = os.path.join(run_path, "data", f"detail-{update}.spop")
         def spop_lookup(update_born, sequence, field):
-            return spop_lookup_table[tuple([update_born, sequence])][field]
-
-        spop_data = None
+            spop_rows = lookup_avida_dat_rows(
+                spop_path,
+                fields = [field],
+                key_fields = ["update_born", "genome_sequence"],
+                keys = [(update_born, sequence)],
+                strip_hash = True
+            )
+            return spop_rows[(update_born, sequence)][field]
         ############################################################
 
         ############################################################
         # Extract environment-specific final dominant information.
-        dom_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.dat"))
-        dom_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "final_dominant.dat"))
-        dom_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "final_dominant.dat"))
+        dom_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.dat"), strip_hash=True)
+        dom_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "final_dominant.dat"), strip_hash=True)
+        dom_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "final_dominant.dat"), strip_hash=True)
         # (each of these files should only have one genotype in them)
 
         if len(dom_env_all) != 1 and len(dom_env_even) != 1 and len(dom_env_odd) != 1:
@@ -358,14 +321,16 @@ def main():
         ############################################################
         # Extract mutation accumulation data from dominant lineage
         # - mutation information will be the same for all lineage data files.
-        lineage_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "lineage_tasks.dat"))
-        lineage_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "lineage_tasks.dat"))
-        lineage_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "lineage_tasks.dat"))
+        lineage_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "lineage_tasks.dat"), strip_hash=True)
+        lineage_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "lineage_tasks.dat"), strip_hash=True)
+        lineage_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "lineage_tasks.dat"), strip_hash=True)
 
         summary_info["dominant_lineage_length_genotypes"] = len(lineage_env_all)
-        sub_mut_cnt = 0
-        ins_mut_cnt = 0
-        dels_mut_cnt = 0
+        # (mutation information for every ancestor, parsed in one pass)
+        lineage_muts = parse_mutations_from_parent([line["mutations_from_parent"] for line in lineage_env_all])
+        sub_mut_cnt = int(lineage_muts["substitutions"].sum())
+        ins_mut_cnt = int(lineage_muts["insertions"].sum())
+        dels_mut_cnt = int(lineage_muts["deletions"].sum())
         lineage_times_poison_executed = 0
         primary_task_profiles_ot = [None for _ in range(len(lineage_env_all))]
         lineage_hitchhiking_linkage_info_chain = [{"times_poison_executed": 0, "odd_times_poison_executed": 0, "even_times_poison_executed": 0, "const_times_poison_executed": 0} for _ in range(len(lineage_env_all))]
@@ -373,15 +338,6 @@ def main():
             ancestor_info = {}
             ancestor_info["update"] = lineage_env_all[i]["update_born"]
 
-            # collect mutation information for this ancestor
-            muts_from_parent = lineage_env_all[i]["mutations_from_parent"].split(",")
-            for mut in muts_from_parent:
-                if (len(mut) == 0): continue
-                if (mut[0] == "M"): sub_mut_cnt += 1
-                elif (mut[0] == "I"): ins_mut_cnt += 1
-                elif (mut[0] == "D"): dels_mut_cnt += 1
-                else: print("Unknown mutation type (" + str(mut) + ")!")
-
             # Collect instruction information for this ancestor
             times_poison_executed = 0
             if chg_env:
@@ -419,43 +375,40 @@ def main():
         summary_info["dominant_lineage_times_poison_executed"] = lineage_times_poison_executed
 
         # analyze lineage task profiles
-        task_profile_volatility = 0
-        num_times_hitchhike_inst_exec_increases = 0
-        num_times_hitchhike_inst_exec_increases_with_primary_trait_change = 0
-        num_times_hitchhike_inst_exec_increases_in_unexpressed_phenotype = 0
-        num_times_hitchhike_inst_exec_increases_in_expressed_phenotype = 0
-        for i in range(len(primary_task_profiles_ot)):
-            ##### Task profile volatility
-            if i:
-                update_born = int(lineage_env_all[i]["update_born"])
-                current_profile = primary_task_profiles_ot[i]
-                previous_traits = primary_task_profiles_ot[i-1]
-                task_profile_volatility += int(current_profile != previous_traits)
-
-                current_hitchhiking_info = lineage_hitchhiking_linkage_info_chain[i]
-                previous_hitchhiking_info = lineage_hitchhiking_linkage_info_chain[i-1]
-                hitchhiking_inst_exec_increased = current_hitchhiking_info["times_poison_executed"] > previous_hitchhiking_info["times_poison_executed"]
-                if chg_env:
-                    cur_env = environment_lookup[update_born]
-                    alt_env = "odd" if cur_env == "even" else "even"
-
-                    expressed_hitchhiking_inst_exec_increased = (current_hitchhiking_info[f"{cur_env}_times_poison_executed"] > previous_hitchhiking_info[f"{cur_env}_times_poison_executed"]) and not (current_hitchhiking_info[f"{alt_env}_times_poison_executed"] > previous_hitchhiking_info[f"{alt_env}_times_poison_executed"])
-                    unexpressed_hitchiking_inst_exec_increased = (current_hitchhiking_info[f"{alt_env}_times_poison_executed"] > previous_hitchhiking_info[f"{alt_env}_times_poison_executed"]) and not (current_hitchhiking_info[f"{cur_env}_times_poison_executed"] > previous_hitchhiking_info[f"{cur_env}_times_poison_executed"])
-
-                    num_times_hitchhike_inst_exec_increases_in_expressed_phenotype += int(expressed_hitchhiking_inst_exec_increased)
-                    num_times_hitchhike_inst_exec_increases_in_unexpressed_phenotype += int(unexpressed_hitchiking_inst_exec_increased)
-                else:
-                    const_hitchhiking_inst_exec_increased = current_hitchhiking_info["const_times_poison_executed"] > previous_hitchhiking_info["const_times_poison_executed"]
-                    num_times_hitchhike_inst_exec_increases_in_expressed_phenotype += int(const_hitchhiking_inst_exec_increased)
-
-                num_times_hitchhike_inst_exec_increases += int(hitchhiking_inst_exec_increased)
-                if current_profile != previous_traits: num_times_hitchhike_inst_exec_increases_with_primary_trait_change += int(hitchhiking_inst_exec_increased)
+        ##### Task profile volatility
+        task_profiles = np.array(primary_task_profiles_ot)
+        task_profile_changed = np.concatenate([[False], task_profiles[1:] != task_profiles[:-1]])
+        task_profile_volatility = int(np.count_nonzero(task_profile_changed))
+
+        ##### Hitchhiking instruction execution along the lineage
+        # - in a changing environment, the expressed phenotype is the one for the environment the genotype
+        #   was born into (the other environment's phenotype is unexpressed).
+        times_poison_executed = np.array([info["times_poison_executed"] for info in lineage_hitchhiking_linkage_info_chain])
+        if chg_env:
+            env_times_poison_executed = np.array([
+                [info[f"{env}_times_poison_executed"] for info in lineage_hitchhiking_linkage_info_chain]
+                for env in env_order
+            ])
+            lineage_update_born = np.array([int(line["update_born"]) for line in lineage_env_all], dtype=np.int64)
+            expressed_env = environment_indices(environment_schedule, lineage_update_born, env_order)
+            unexpressed_env = np.where(expressed_env >= 0, 1 - expressed_env, -1)
+        else:
+            env_times_poison_executed = np.array([[info["const_times_poison_executed"] for info in lineage_hitchhiking_linkage_info_chain]])
+            expressed_env = np.zeros(len(lineage_env_all), dtype=np.int64)
+            unexpressed_env = np.full(len(lineage_env_all), -1, dtype=np.int64)
+        hitchhike_inst_exec = increase_step_counts(
+            values=env_times_poison_executed,
+            combined=times_poison_executed,
+            expressed=expressed_env,
+            unexpressed=unexpressed_env,
+            aggregate_changed=task_profile_changed
+        )
 
         summary_info["dominant_lineage_trait_volatility"] = task_profile_volatility
-        summary_info["dominant_lineage_num_times_hitchhike_inst_exec_increases"] = num_times_hitchhike_inst_exec_increases
-        summary_info["dominant_lineage_num_times_hitchhike_inst_exec_increases_with_primary_trait_change"] = num_times_hitchhike_inst_exec_increases_with_primary_trait_change
-        summary_info["dominant_lineage_num_times_hitchhike_inst_exec_increases_in_unexpressed_phenotype"] = num_times_hitchhike_inst_exec_increases_in_unexpressed_phenotype
-        summary_info["dominant_lineage_num_times_hitchhike_inst_exec_increases_in_expressed_phenotype"] = num_times_hitchhike_inst_exec_increases_in_expressed_phenotype
+        summary_info["dominant_lineage_num_times_hitchhike_inst_exec_increases"] = hitchhike_inst_exec["increases"]
+        summary_info["dominant_lineage_num_times_hitchhike_inst_exec_increases_with_primary_trait_change"] = hitchhike_inst_exec["increases_with_aggregate_change"]
+        summary_info["dominant_lineage_num_times_hitchhike_inst_exec_increases_in_unexpressed_phenotype"] = hitchhike_inst_exec["increases_in_unexpressed"]
+        summary_info["dominant_lineage_num_times_hitchhike_inst_exec_increases_in_expressed_phenotype"] = hitchhike_inst_exec["increases_in_expressed"]
 
         lineage_env_all = None
         lineage_env_odd = None
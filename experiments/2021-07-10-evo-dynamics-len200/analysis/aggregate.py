@@ -2,7 +2,21 @@
 Aggregate data
 '''
 
-import argparse, os, sys, errno, subprocess, csv
+import argparse, os, sys, errno, subprocess, csv, functools, multiprocessing
+import numpy as np
+
+# Shared analysis utilities live at the root of this repository.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from analysis_utils import parse_cache
+from analysis_utils.avida_io import read_avida_dat_file, lookup_avida_dat_rows
+from analysis_utils.run_manifest import RunManifest
+from analysis_utils.output import CSVStreamWriter, FeatherWriter
+from analysis_utils.csv_index import read_csv_at_update, read_csv_update_range_columns
+from analysis_utils.columnar import load_avida_dat_columns, value_at_update, update_range_slice, join_time_series
+from analysis_utils.phenotype import pack_phenotypes, match_scores, phenotypes_differ, phenotype_strings
+from analysis_utils.lineage_steps import environment_indices, mutation_step_counts
+from analysis_utils.mutations import parse_mutations_from_parent
+from analysis_utils.env_schedule import load_run_schedule
 
 run_identifier = "RUN_"
 
@@ -14,9 +28,26 @@ odd_profile = "010101"
 all_profile = "111111"
 
 env_order = ["even", "odd"]
+# Environments by the reactions they reward (used to replay a run's events file).
+environment_rewards = {
+    "even": {"NOT", "AND", "OR"},
+    "odd": {"NAND", "ORN", "ANDN"},
+    "all": {"NOT", "NAND", "AND", "ORN", "OR", "ANDN"}
+}
 
 max_pop_size = 3600
 
+# Low-cardinality string fields to dictionary-encode in feather output (R reads them as factors).
+feather_dictionary_fields = [
+    "environment",
+    "DISABLE_REACTION_SENSORS",
+    "EVENT_FILE",
+    "dominant_phenotype_even",
+    "dominant_phenotype_odd",
+    "dominant_phenotype_all",
+    "dominant_phenotype_task_order"
+]
+
 # because we want smaller file sizes, only keep fields that we want to look at
 phylodiversity_time_series_fields = [
     "mean_evolutionary_distinctiveness",
@@ -50,20 +81,6 @@ def mkdir_p(path):
             pass
         else: raise
 
-def build_env_lookup(period_length, max_update):
-    lookup = ["all" for i in range(0, max_update+1)]
-    if period_length == 0:
-        return lookup
-    u = 0
-    env_i = 0
-    while u < len(lookup):
-        for pi in range(period_length):
-            if u >= len(lookup): break
-            lookup[u] = env_order[env_i]
-            u+=1
-        env_i = (env_i + 1) % len(env_order)
-    return lookup
-
 def extract_params_cmd_log(path):
     content = None
     with open(path, "r") as fp:
@@ -73,68 +90,305 @@ def extract_params_cmd_log(path):
     cfg = {param.split(" ")[0]:param.split(" ")[1] for param in params}
     return cfg
 
-def read_avida_dat_file(path, backfill_missing_fields=False):
-    content = None
-    with open(path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    legend_start = 0
-    legend_end = 0
-    # Where does the legend table start?
-    for line_i in range(0, len(content)):
-        line = content[line_i].strip()
-        if line == "# Legend:":         # Handles analyze mode detail files.
-            legend_start = line_i + 1
-            break
-        if "#  1:" in line:             # Handles time.dat file.
-            legend_start = line_i
-            break
-    # For each line in legend table, extract field
-    fields = []
-    for line_i in range(legend_start, len(content)):
-        line = content[line_i].strip()
-        if line == "":
-            legend_end = line_i
-            break
-        # patch 3-input logic tasks because avida file format is nonsense
-        if "Logic 3" in line:
-            line = line.split("(")[0]
-
-        fields.append( line.split(":")[-1].strip().lower().replace(" ", "_") )
-    data = []
-    for line_i in range(legend_end, len(content)):
-        line = content[line_i].strip()
-        if line == "": continue
-        data_line = line.split(" ")
-        if len(data_line) > len(fields):
-            print("found more items than there are fields!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        elif backfill_missing_fields:
-            num_backfill = len(fields) - len(data_line)
-            for _ in range(num_backfill): data_line.append("")
-        elif len(data_line) != len(fields):
-            print("data fields mismatch!")
-            print(fields)
-            print(data_line)
-            exit(-1)
-        data.append({field:value for field,value in zip(fields, data_line)})
-    return data
-
-def read_csv(file_path):
-    content = None
-    with open(file_path, "r") as fp:
-        content = fp.read().strip().split("\n")
-    header = content[0].split(",")
-    content = content[1:]
-    lines = [{header[i]: l[i] for i in range(len(header))} for l in csv.reader(content, quotechar='"', delimiter=',', quoting=csv.QUOTE_ALL, skipinitialspace=True)]
-    return lines
-
-def simple_match_coeff(a, b):
-    if len(a) != len(b):
-        print(f"Length mismatch! {a} {b}")
+def run_input_files(update):
+    """
+    Return the list of input files (relative to a run directory) that process_run reads.
+    """
+    input_files = [
+        "cmd.log",
+        os.path.join("data", "lineage.csv"),
+        os.path.join("data", "phylodiversity.csv"),
+        os.path.join("data", "dominant.csv"),
+        os.path.join("data", "time.dat"),
+        os.path.join("data", f"detail-{update}.spop")
+    ]
+    for env in ["all", "odd", "even"]:
+        input_files.append(os.path.join("data", "analysis", f"env_{env}", "final_dominant.dat"))
+        input_files.append(os.path.join("data", "analysis", f"env_{env}", "lineage_tasks.dat"))
+    return input_files
+
+def process_run(run_path, update, time_series_range):
+    """
+    Extract summary and time series information from a single run directory.
+
+    Returns (summary_info, time_series_info) or None if the run is incomplete.
+    time_series_info is a {field: numpy array} table with one row per time series update.
+    """
+    # Skip over (but make note of) incomplete runs.
+    if not os.path.exists(os.path.join(run_path, 'data', 'analysis')):
+        print('Skipping: ', run_path)
+        return None
+
+    summary_info = {} # Hold summary information about run. (one entry per run)
+    time_series_sources = [] # (name, columns, field prefix) for each time series source (joined at the end)
+    print(f"Processing: {run_path}")
+
+    ############################################################
+    # Extract commandline configuration settings (from cmd.log file)
+    cmd_log_path = os.path.join(run_path, "cmd.log")
+    cmd_params = extract_params_cmd_log(cmd_log_path)
+    # Infer environmental change and change rate from events file
+    chg_env = "chg" in cmd_params["EVENT_FILE"]
+    env_cond = cmd_params["EVENT_FILE"].replace("events_", "").split("_phase")[0].lower()
+    phase = "1" if "phase-one" in cmd_params["EVENT_FILE"] else "2"
+
+    events_info = cmd_params["EVENT_FILE"].strip("events_").strip(".cfg").split("_")
+    events_info = {param.split("-")[0]:param.split("-")[1] for param in events_info}
+    change_rate = int(events_info["rate"].strip("u"))
+
+    environment_schedule = load_run_schedule(
+        run_path,
+        cmd_params["EVENT_FILE"],
+        environments = environment_rewards,
+        change_rate = change_rate,
+        max_update = update,
+        env_order = env_order
+    )
+
+    summary_info["chg_env"] = chg_env
+    summary_info["environment"] = env_cond
+    summary_info["update"] = update
+    summary_info["phase"] = phase
+    summary_info["change_rate"] = change_rate
+
+    for field in cmd_params:
+        summary_info[field] = cmd_params[field]
+    ############################################################
+
+    ############################################################
+    # Extract lineage file data
+    lineage_path = os.path.join(run_path, "data", "lineage.csv")
+    # Extract summary info (for specified update)
+    lineage_summary_data = read_csv_at_update(lineage_path, update)
+    for field in lineage_summary_data:
+        if field == "update": continue
+        summary_info["lineage_"+field] = lineage_summary_data[field]
+
+    # Extract time series info
+    # Only read lines that fall within specified time series range.
+    # The lineage time series' updates are checked against other time series data for consistency.
+    # TODO - is there anything we want from this file?
+    lineage_data_ts = read_csv_update_range_columns(lineage_path, time_series_range[0], time_series_range[1], fields=[])
+    time_series_sources.append(("lineage", lineage_data_ts, "lineage_"))
+
+    # done with lineage data
+    lineage_summary_data = None
+    ############################################################
+
+    ############################################################
+    # Extract phylodiversity time series data
+    phylodiversity_path = os.path.join(run_path, "data", "phylodiversity.csv")
+    # Extract summary info
+    phylo_summary_data = read_csv_at_update(phylodiversity_path, update)
+    for field in phylo_summary_data:
+        if field == "update": continue
+        summary_info["phylo_"+field] = phylo_summary_data[field]
+
+    # Extract time series info
+    phylo_data_ts = read_csv_update_range_columns(
+        phylodiversity_path,
+        time_series_range[0],
+        time_series_range[1],
+        fields=phylodiversity_time_series_fields
+    )
+    time_series_sources.append(("phylo", phylo_data_ts, "phylo_"))
+    # done with phylodiversity data
+    phylo_summary_data = None
+    ############################################################
+
+    ############################################################
+    # Extract information from dominant.csv
+    dominant_path = os.path.join(run_path, "data", "dominant.csv")
+    dominant_summary_data = read_csv_at_update(dominant_path, update)
+
+    summary_info["dominant_lineage_length_taxa"] = dominant_summary_data["dominant_lineage_length"]
+    summary_info["dominant_lineage_deleterious_steps"] = dominant_summary_data["dominant_deleterious_steps"]
+    summary_info["dominant_lineage_phenotypic_volatility"] = dominant_summary_data["dominant_phenotypic_volatility"]
+    summary_info["dominant_lineage_unique_phenotypes"] = dominant_summary_data["dominant_unique_phenotypes"]
+    ############################################################
+
+    ############################################################
+    # Extract time.dat data
+    time_data = load_avida_dat_columns(os.path.join(run_path, "data", "time.dat"))
+    # Summery information
+    # - average generation
+    summary_info["time_average_generation"] = value_at_update(time_data, "average_generation", update)
+
+    # Time series information
+    ts_rows = update_range_slice(time_data, time_series_range[0], time_series_range[1])
+    time_data_ts = {field: time_data[field][ts_rows] for field in ["update"] + time_data_time_series_fields}
+    time_series_sources.append(("time", time_data_ts, "time_"))
+
+    time_data = None # release time_data
+    ############################################################
+
+    ############################################################
+    # Join time series data (checks that every source has the same time series updates)
+    time_series_info = join_time_series(time_series_sources)
+    time_series_sources = None
+    ############################################################
+
+    ############################################################
+    # Extract .spop file info
+    # - What are the unique keys shared across analyze mode output/.spop file?
+    #   - tuple(sequence, update born)
+    # We only need a few fields for a few genotypes, so only tokenize the columns we need and stop
+    # reading the .spop file once we find the genotype we're looking for.
+    spop_path = os.path.join(run_path, "data", f"detail-{update}.spop")
+    def spop_lookup(update_born, sequence, field):
+        spop_rows = lookup_avida_dat_rows(
+            spop_path,
+            fields = [field],
+            key_fields = ["update_born", "genome_sequence"],
+            keys = [(update_born, sequence)]
+        )
+        return spop_rows[(update_born, sequence)][field]
+    ############################################################
+
+    ############################################################
+    # Extract environment-specific final dominant information.
+    dom_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.dat"))
+    dom_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "final_dominant.dat"))
+    dom_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "final_dominant.dat"))
+    # (each of these files should only have one genotype in them)
+
+    if len(dom_env_all) != 1 and len(dom_env_even) != 1 and len(dom_env_odd) != 1:
+        print("Unexpected number of genotypes in final_dominant data files.")
         exit(-1)
-    return sum(ai==bi for ai,bi in zip(a,b))
+
+    dom_env_all = dom_env_all[0]
+    dom_env_odd = dom_env_odd[0]
+    dom_env_even = dom_env_even[0]
+
+    # Collect dominant genotype data.
+    summary_info["dominant_genome_length"] = dom_env_all["genome_length"]
+
+    summary_info["dominant_generation_born"] = spop_lookup(
+        update_born=dom_env_all["update_born"],
+        sequence=dom_env_all["genome_sequence"],
+        field="generation_born"
+    )
+
+    dom_phenotypes = pack_phenotypes([dom_env_even, dom_env_odd, dom_env_all], primary_traits)
+    phenotype_even, phenotype_odd, phenotype_all = phenotype_strings(dom_phenotypes, len(primary_traits))
+    phenotype_task_order = ";".join(primary_traits)
+
+    plastic_odd_even = phenotype_even != phenotype_odd
+
+    match_score_even = int(match_scores(dom_phenotypes[0], even_profile, len(primary_traits)))
+    match_score_odd = int(match_scores(dom_phenotypes[1], odd_profile, len(primary_traits)))
+    match_score_all = int(match_scores(dom_phenotypes[2], all_profile, len(primary_traits)))
+    match_score_odd_even = match_score_even + match_score_odd
+
+    optimal_plastic = match_score_even == len(even_profile) and match_score_odd == len(odd_profile)
+
+    summary_info["dominant_phenotype_even"] = phenotype_even
+    summary_info["dominant_phenotype_odd"] = phenotype_odd
+    summary_info["dominant_phenotype_all"] = phenotype_all
+    summary_info["dominant_phenotype_task_order"] = phenotype_task_order
+    summary_info["dominant_plastic_odd_even"] = plastic_odd_even
+    summary_info["dominant_match_score_even"] = match_score_even
+    summary_info["dominant_match_score_odd"] = match_score_odd
+    summary_info["dominant_match_score_all"] = match_score_all
+    summary_info["dominant_match_score_odd_even"] = match_score_odd_even
+    summary_info["dominant_optimal_plastic"] = optimal_plastic
+    ############################################################
+
+    ############################################################
+    # Extract mutation accumulation data from dominant lineage
+    # - mutation information will be the same for all lineage data files.
+    lineage_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "lineage_tasks.dat"))
+    lineage_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "lineage_tasks.dat"))
+    lineage_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "lineage_tasks.dat"))
+
+    summary_info["dominant_lineage_length_genotypes"] = len(lineage_env_all)
+    lineage_muts = parse_mutations_from_parent([line["mutations_from_parent"] for line in lineage_env_all])
+    sub_mut_cnt = int(lineage_muts["substitutions"].sum())
+    ins_mut_cnt = int(lineage_muts["insertions"].sum())
+    dels_mut_cnt = int(lineage_muts["deletions"].sum())
+    # (number of mutations_from_parent entries for each genotype; "(none)" counts as an entry)
+    lineage_muts_from_parent = lineage_muts["tokens"]
+
+    # Bit-packed phenotypes (and match scores) for every ancestor along the lineage
+    lineage_phenotypes = {
+        "even": pack_phenotypes(lineage_env_even, primary_traits),
+        "odd": pack_phenotypes(lineage_env_odd, primary_traits),
+        "const": pack_phenotypes(lineage_env_all, primary_traits)
+    }
+    lineage_match_scores = {
+        "even": match_scores(lineage_phenotypes["even"], even_profile, len(primary_traits)),
+        "odd": match_scores(lineage_phenotypes["odd"], odd_profile, len(primary_traits)),
+        "const": match_scores(lineage_phenotypes["const"], all_profile, len(primary_traits))
+    }
+    # The aggregate phenotype is the even and odd phenotypes in a changing environment.
+    if chg_env:
+        lineage_phenotypes["aggregate"] = np.concatenate([lineage_phenotypes["even"], lineage_phenotypes["odd"]], axis=1)
+    else:
+        lineage_phenotypes["aggregate"] = lineage_phenotypes["const"]
+
+    # save summary info about mutation accumulation
+    total_muts = sub_mut_cnt + ins_mut_cnt + dels_mut_cnt
+    summary_info["dominant_lineage_substitution_mut_cnt"] = sub_mut_cnt
+    summary_info["dominant_lineage_insertion_mut_cnt"] = ins_mut_cnt
+    summary_info["dominant_lineage_deletion_mut_cnt"] = dels_mut_cnt
+    summary_info["dominant_lineage_total_mut_cnt"] = total_muts
+    # analyze lineage task profiles
+    ##### Task profile volatility
+    aggregate_changes = phenotypes_differ(lineage_phenotypes["aggregate"][1:], lineage_phenotypes["aggregate"][:-1])
+    task_profile_volatility = int(np.count_nonzero(aggregate_changes))
+
+    summary_info["dominant_lineage_trait_volatility"] = task_profile_volatility
+
+    # analyze mutation outcomes
+    # - in a changing environment, the expressed phenotype is the one for the environment the genotype was
+    #   born into (the other environment's phenotype is unexpressed).
+    lineage_update_born = np.array([int(line["update_born"]) for line in lineage_env_all], dtype=np.int64)
+    if chg_env:
+        env_phenotypes = np.stack([lineage_phenotypes[env] for env in env_order])
+        env_match_scores = np.stack([lineage_match_scores[env] for env in env_order])
+        expressed_env = environment_indices(environment_schedule, lineage_update_born, env_order)
+        unexpressed_env = np.where(expressed_env >= 0, 1 - expressed_env, -1)
+    else:
+        env_phenotypes = lineage_phenotypes["const"][np.newaxis]
+        env_match_scores = lineage_match_scores["const"][np.newaxis]
+        expressed_env = np.zeros(len(lineage_env_all), dtype=np.int64)
+        unexpressed_env = np.full(len(lineage_env_all), -1, dtype=np.int64)
+    mut_steps = mutation_step_counts(
+        muts_from_parent=lineage_muts_from_parent,
+        aggregate=lineage_phenotypes["aggregate"],
+        phenotypes=env_phenotypes,
+        match_scores=env_match_scores,
+        expressed=expressed_env,
+        unexpressed=unexpressed_env
+    )
+
+    summary_info["dominant_lineage_num_mut_steps_that_change_aggregate_phenotype"] = mut_steps["change_aggregate"]
+    summary_info["dominant_lineage_num_mut_steps_that_change_unexpressed_phenotype"] = mut_steps["change_unexpressed"]
+    summary_info["dominant_lineage_num_mut_steps_that_change_expressed_phenotype"] = mut_steps["change_expressed"]
+    summary_info["dominant_lineage_num_mut_steps"] = mut_steps["num_mut_steps"]
+
+    summary_info["dominant_lineage_num_mut_steps_that_change_unexpressed_phenotype_deleterious"] = mut_steps["unexpressed_deleterious"]
+    summary_info["dominant_lineage_num_mut_steps_that_change_unexpressed_phenotype_beneficial"] = mut_steps["unexpressed_beneficial"]
+    summary_info["dominant_lineage_num_mut_steps_that_change_expressed_phenotype_deleterious"] = mut_steps["expressed_deleterious"]
+    summary_info["dominant_lineage_num_mut_steps_that_change_expressed_phenotype_beneficial"] = mut_steps["expressed_beneficial"]
+
+    lineage_env_all = None
+    lineage_env_odd = None
+    lineage_env_even = None
+    ############################################################
+
+    return summary_info, time_series_info
+
+def process_run_worker(run_path, update, time_series_range):
+    """
+    Process pool wrapper for process_run.
+    """
+    try:
+        return process_run(run_path, update, time_series_range)
+    except SystemExit:
+        # Our parsing functions report problems and exit. In a worker process that would kill the worker
+        # (and hang the pool) rather than stop aggregation, so report the failure back to the main process.
+        return "failed"
 
 def main():
     parser = argparse.ArgumentParser(description="Run submission script.")
@@ -142,12 +396,22 @@ def main():
     parser.add_argument("--dump", type=str, help="Where to dump this?", default=".")
     parser.add_argument("--update", type=int, help="Update to pull data for?")
     parser.add_argument("--time_series_range", type=int, help="The range (in updates) to collect time series data?", nargs=2)
+    parser.add_argument("--workers", type=int, default=1, help="How many worker processes should we use to process runs?")
+    parser.add_argument("--incremental", action="store_true", help="Only process new or changed runs (using the manifest in the dump directory), reusing results for other runs")
+    parser.add_argument("--gzip", action="store_true", help="Write gzip-compressed output (.csv.gz)")
+    parser.add_argument("--feather", action="store_true", help="Also write output as Arrow/Feather (.feather) files (requires pyarrow)")
+    parser.add_argument("--cache", action="store_true", help="Cache parsed data files on disk to speed up re-runs (see analysis_utils/parse_cache.py)")
 
     args = parser.parse_args()
+    if args.cache: parse_cache.configure_cache(enabled=True)
     data_dir = args.data_dir
     dump_dir = args.dump
     update = args.update
     time_series_range = args.time_series_range
+    workers = args.workers
+    incremental = args.incremental
+    compress_output = args.gzip
+    write_feather = args.feather
 
     if not os.path.exists(data_dir):
         print("Unable to find data directory.")
@@ -159,392 +423,96 @@ def main():
     run_dirs = [run_dir for run_dir in os.listdir(data_dir) if run_identifier in run_dir]
     print(f"Found {len(run_dirs)} run directories.")
 
-    time_series_content = []
-    time_series_header = None
-    time_series_fpath = os.path.join(dump_dir, f"time_series_u{time_series_range[0]}-u{time_series_range[1]}.csv")
-    with open(time_series_fpath, "w") as fp:
-        fp.write("")
-
-    # For each run directory:
-    # - get id, get command line configuration settings
-    summary_header = None
-    summary_content_lines = []
-    for run_dir in run_dirs:
-        run_path = os.path.join(data_dir, run_dir)
-        # Skip over (but make note of) incomplete runs.
-        if not os.path.exists(os.path.join(run_path, 'data', 'analysis')):
-            print('Skipping: ', run_path)
-            continue
-
-        summary_info = {} # Hold summary information about run. (one entry per run)
-        time_series_info = {}
-        print(f"Processing: {run_path}")
-
-        ############################################################
-        # Extract commandline configuration settings (from cmd.log file)
-        cmd_log_path = os.path.join(run_path, "cmd.log")
-        cmd_params = extract_params_cmd_log(cmd_log_path)
-        # Infer environmental change and change rate from events file
-        chg_env = "chg" in cmd_params["EVENT_FILE"]
-        env_cond = cmd_params["EVENT_FILE"].replace("events_", "").split("_phase")[0].lower()
-        phase = "1" if "phase-one" in cmd_params["EVENT_FILE"] else "2"
-
-        events_info = cmd_params["EVENT_FILE"].strip("events_").strip(".cfg").split("_")
-        events_info = {param.split("-")[0]:param.split("-")[1] for param in events_info}
-        change_rate = int(events_info["rate"].strip("u"))
-
-        environment_lookup = build_env_lookup(period_length = change_rate, max_update = update)
-
-        summary_info["chg_env"] = chg_env
-        summary_info["environment"] = env_cond
-        summary_info["update"] = update
-        summary_info["phase"] = phase
-        summary_info["change_rate"] = change_rate
-
-        for field in cmd_params:
-            summary_info[field] = cmd_params[field]
-        ############################################################
-
-        ############################################################
-        # Extract lineage file data
-        lineage_path = os.path.join(run_path, "data", "lineage.csv")
-        lineage_data = read_csv(lineage_path)
-        # Extract summary info (for specified update)
-        lineage_summary_data = [line for line in lineage_data if int(line["update"]) == update][0]
-        for field in lineage_summary_data:
-            if field == "update": continue
-            summary_info["lineage_"+field] = lineage_summary_data[field]
-
-        # Extract time series info
-        # Only keep lines that fall within specified time series range.
-        def keep_line(u): return u <= time_series_range[1] and u >= time_series_range[0]
-        lineage_data = {line["update"]: line for line in lineage_data if keep_line(int(line["update"])) }
-        # Grab the set of updates we have for our time series to check against other time series data for consistency
-        time_series_updates = set(lineage_data.keys())
-        # initialize info dictionary for each  time series update
-        for u in time_series_updates: time_series_info[u] = {}
-
-        # TODO - is there anything we want from this file?
-        # done with lineage data
-        lineage_data = None
-        lineage_summary_data = None
-        ############################################################
-
-        ############################################################
-        # Extract phylodiversity time series data
-        phylodiversity_path = os.path.join(run_path, "data", "phylodiversity.csv")
-        phylodiversity_data = read_csv(phylodiversity_path)
-        # Extract summary info
-        phylo_summary_data = [line for line in phylodiversity_data if int(line["update"]) == update][0]
-        for field in phylo_summary_data:
-            if field == "update": continue
-            summary_info["phylo_"+field] = phylo_summary_data[field]
-
-        # Extract time series info
-        phylo_data_ts = {line["update"]: {field: line[field] for field in phylodiversity_time_series_fields} for line in phylodiversity_data if keep_line(int(line["update"]))}
-        phylo_data_ts_updates = set(phylo_data_ts.keys())
-        if time_series_updates != phylo_data_ts_updates:
-            print("Time series resolution mismatch (phylo)!")
-            exit(-1)
-        for u in time_series_updates:
-            for field in phylo_data_ts[u]: time_series_info[u]["phylo_"+field] = phylo_data_ts[u][field]
-        # done with phylodiversity data
-        phylodiversity_data = None
-        phylo_summary_data = None
-        ############################################################
-
-        ############################################################
-        # Extract information from dominant.csv
-        dominant_path = os.path.join(run_path, "data", "dominant.csv")
-        dominant_data = read_csv(dominant_path)
-        dominant_summary_data = [line for line in dominant_data if int(line["update"]) == update][0]
-
-        summary_info["dominant_lineage_length_taxa"] = dominant_summary_data["dominant_lineage_length"]
-        summary_info["dominant_lineage_deleterious_steps"] = dominant_summary_data["dominant_deleterious_steps"]
-        summary_info["dominant_lineage_phenotypic_volatility"] = dominant_summary_data["dominant_phenotypic_volatility"]
-        summary_info["dominant_lineage_unique_phenotypes"] = dominant_summary_data["dominant_unique_phenotypes"]
-        ############################################################
-
-        ############################################################
-        # Extract time.dat data
-        time_data = read_avida_dat_file(os.path.join(run_path, "data", "time.dat"))
-        # Summery information
-        # - average generation
-        summary_info["time_average_generation"] = [line["average_generation"] for line in time_data if int(line["update"]) == update][0]
-
-        # Time series information
-        time_data_ts = {line["update"]: {field: line[field] for field in time_data_time_series_fields} for line in time_data if keep_line(int(line["update"]))}
-
-        # Check time data ts updates against previous time series updates.
-        time_data_ts_updates = set(time_data_ts.keys())
-        if time_series_updates != time_data_ts_updates:
-            print("Time series resolution mismatch (time)!")
-            exit(-1)
-
-        # Store time data time series info
-        for u in time_series_updates:
-            for field in time_data_ts[u]: time_series_info[u]["time_" + field] = time_data_ts[u][field]
-
-        time_data = None # release time_data
-        time_data_ts = None
-        ############################################################
-
-        ############################################################
-        # Extract .spop file info
-        # - What are the unique keys shared across analyze mode output/.spop file?
-        #   - tuple(sequence, update born)
-        spop_data = read_avida_dat_file(os.path.join(run_path, "data", f"detail-{update}.spop"), True)
-        # each entry is indexed off of update born and genome sequence so we can easily lookup spop
-        # info when grabbing data from analyze mode files.
-        spop_lookup_table = {
-            tuple([line["update_born"], line["genome_sequence"]]):line
-            for line in spop_data
+    # Stream output rows as runs are processed.
+    out_ext = ".csv.gz" if compress_output else ".csv"
+    time_series_fname = f"time_series_u{time_series_range[0]}-u{time_series_range[1]}"
+    time_series_writers = [CSVStreamWriter(os.path.join(dump_dir, time_series_fname + out_ext), compress=compress_output)]
+    summary_writers = [CSVStreamWriter(os.path.join(dump_dir, f"aggregate{out_ext}"), compress=compress_output, flush_rows=True)]
+    if write_feather:
+        time_series_writers.append(FeatherWriter(os.path.join(dump_dir, f"{time_series_fname}.feather"), dictionary_fields=feather_dictionary_fields))
+        summary_writers.append(FeatherWriter(os.path.join(dump_dir, "aggregate.feather"), dictionary_fields=feather_dictionary_fields))
+    # If aggregating incrementally, only (re)process runs that are new or whose input files have changed.
+    run_paths = [os.path.join(data_dir, run_dir) for run_dir in sorted(run_dirs)]
+    stale_run_paths = run_paths
+    manifest = None
+    if incremental:
+        manifest = RunManifest(
+            dump_dir,
+            "aggregate",
+            {"update": update, "time_series_range": time_series_range, "time_series_format": "columns"}
+        )
+        run_inputs = {
+            run_path: manifest.fingerprint(run_path, run_input_files(update))
+            for run_path in run_paths
         }
-        def spop_lookup(update_born, sequence, field):
-            return spop_lookup_table[tuple([update_born, sequence])][field]
-
-        spop_data = None
-        ############################################################
-
-        ############################################################
-        # Extract environment-specific final dominant information.
-        dom_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "final_dominant.dat"))
-        dom_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "final_dominant.dat"))
-        dom_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "final_dominant.dat"))
-        # (each of these files should only have one genotype in them)
-
-        if len(dom_env_all) != 1 and len(dom_env_even) != 1 and len(dom_env_odd) != 1:
-            print("Unexpected number of genotypes in final_dominant data files.")
-            exit(-1)
-
-        dom_env_all = dom_env_all[0]
-        dom_env_odd = dom_env_odd[0]
-        dom_env_even = dom_env_even[0]
-
-        # Collect dominant genotype data.
-        summary_info["dominant_genome_length"] = dom_env_all["genome_length"]
-
-        summary_info["dominant_generation_born"] = spop_lookup(
-            update_born=dom_env_all["update_born"],
-            sequence=dom_env_all["genome_sequence"],
-            field="generation_born"
+        stale_run_paths = [
+            run_path for run_path in run_paths
+            if not manifest.is_current(os.path.basename(run_path), run_inputs[run_path])
+        ]
+        print(f"Reusing {len(run_paths) - len(stale_run_paths)} previously processed runs.")
+    stale_run_set = set(stale_run_paths)
+
+    # Process runs (in parallel if we have multiple workers), handling results in run directory order.
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(
+            workers,
+            initializer=parse_cache.configure_cache,
+            initargs=(parse_cache.cache_enabled(),)
         )
-
-        phenotype_even = "".join([dom_env_even[trait] for trait in primary_traits])
-        phenotype_odd = "".join([dom_env_odd[trait] for trait in primary_traits])
-        phenotype_all = "".join([dom_env_all[trait] for trait in primary_traits])
-        phenotype_task_order = ";".join(primary_traits)
-
-        plastic_odd_even = phenotype_even != phenotype_odd
-
-        match_score_even = simple_match_coeff(phenotype_even, even_profile)
-        match_score_odd = simple_match_coeff(phenotype_odd, odd_profile)
-        match_score_all = simple_match_coeff(phenotype_all, all_profile)
-        match_score_odd_even = match_score_even + match_score_odd
-
-        optimal_plastic = match_score_even == len(even_profile) and match_score_odd == len(odd_profile)
-
-        summary_info["dominant_phenotype_even"] = phenotype_even
-        summary_info["dominant_phenotype_odd"] = phenotype_odd
-        summary_info["dominant_phenotype_all"] = phenotype_all
-        summary_info["dominant_phenotype_task_order"] = phenotype_task_order
-        summary_info["dominant_plastic_odd_even"] = plastic_odd_even
-        summary_info["dominant_match_score_even"] = match_score_even
-        summary_info["dominant_match_score_odd"] = match_score_odd
-        summary_info["dominant_match_score_all"] = match_score_all
-        summary_info["dominant_match_score_odd_even"] = match_score_odd_even
-        summary_info["dominant_optimal_plastic"] = optimal_plastic
-        ############################################################
-
-        ############################################################
-        # Extract mutation accumulation data from dominant lineage
-        # - mutation information will be the same for all lineage data files.
-        lineage_env_all = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_all", "lineage_tasks.dat"))
-        lineage_env_odd = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_odd", "lineage_tasks.dat"))
-        lineage_env_even = read_avida_dat_file(os.path.join(run_path, "data", "analysis", "env_even", "lineage_tasks.dat"))
-
-        summary_info["dominant_lineage_length_genotypes"] = len(lineage_env_all)
-        sub_mut_cnt = 0
-        ins_mut_cnt = 0
-        dels_mut_cnt = 0
-        # primary_task_profiles_ot = [None for _ in range(len(lineage_env_all))]
-        primary_task_profiles_ot = [{
-            "muts_from_parent": None,
-            "odd": None,
-            "even": None,
-            "const": None,
-            "aggregate": None,
-            "odd-match-score": None,
-            "even-match-score": None,
-            "const-match-score": None
-        } for _ in range(len(lineage_env_all))]
-
-        for i in range(len(lineage_env_all)):
-            muts_from_parent = lineage_env_all[i]["mutations_from_parent"].split(",")
-            for mut in muts_from_parent:
-                if (len(mut) == 0): continue
-                if (mut[0] == "M"): sub_mut_cnt += 1
-                elif (mut[0] == "I"): ins_mut_cnt += 1
-                elif (mut[0] == "D"): dels_mut_cnt += 1
-                else: print("Unknown mutation type (" + str(mut) + ")!")
-
-            ancestor_phenotype_even = "".join([lineage_env_even[i][trait] for trait in primary_traits])
-            ancestor_phenotype_odd = "".join([lineage_env_odd[i][trait] for trait in primary_traits])
-            ancestor_phenotype_const = "".join([lineage_env_all[i][trait] for trait in primary_traits])
-
-            ancestor_match_score_even = simple_match_coeff(ancestor_phenotype_even, even_profile)
-            ancestor_match_score_odd = simple_match_coeff(ancestor_phenotype_odd, odd_profile)
-            ancestor_match_score_all = simple_match_coeff(ancestor_phenotype_const, all_profile)
-
-            primary_task_profiles_ot[i]["even"] = ancestor_phenotype_even
-            primary_task_profiles_ot[i]["odd"] = ancestor_phenotype_odd
-            primary_task_profiles_ot[i]["const"] = ancestor_phenotype_const
-            primary_task_profiles_ot[i]["muts_from_parent"] = len(muts_from_parent)
-
-            primary_task_profiles_ot[i]["even-match-score"] = ancestor_match_score_even
-            primary_task_profiles_ot[i]["odd-match-score"] = ancestor_match_score_odd
-            primary_task_profiles_ot[i]["const-match-score"] = ancestor_match_score_all
-
-            if chg_env:
-                primary_task_profiles_ot[i]["aggregate"] = ancestor_phenotype_even + ancestor_phenotype_odd
-            else:
-                primary_task_profiles_ot[i]["aggregate"] = ancestor_phenotype_const
-
-        # save summary info about mutation accumulation
-        total_muts = sub_mut_cnt + ins_mut_cnt + dels_mut_cnt
-        summary_info["dominant_lineage_substitution_mut_cnt"] = sub_mut_cnt
-        summary_info["dominant_lineage_insertion_mut_cnt"] = ins_mut_cnt
-        summary_info["dominant_lineage_deletion_mut_cnt"] = dels_mut_cnt
-        summary_info["dominant_lineage_total_mut_cnt"] = total_muts
-        # analyze lineage task profiles
-        task_profile_volatility = 0
-        for i in range(len(primary_task_profiles_ot)):
-            ##### Task profile volatility
-            if i:
-                current_profile = primary_task_profiles_ot[i]["aggregate"]
-                previous_traits = primary_task_profiles_ot[i-1]["aggregate"]
-                task_profile_volatility += int(current_profile != previous_traits)
-
-        summary_info["dominant_lineage_trait_volatility"] = task_profile_volatility
-
-        # analyze mutation outcomes
-        num_muts_that_change_aggregate_phenotype = 0
-        num_muts_that_change_unexpressed_phenotype = 0
-        num_muts_that_change_unexpressed_phenotype_deleterious = 0
-        num_muts_that_change_unexpressed_phenotype_beneficial = 0
-        num_muts_that_change_expressed_phenotype = 0
-        num_muts_that_change_expressed_phenotype_deleterious = 0
-        num_muts_that_change_expressed_phenotype_beneficial = 0
-        num_mut_steps = 0
-        for i in range(len(primary_task_profiles_ot)):
-            if not i: continue
-            update_born = int(lineage_env_all[i]["update_born"])
-            mutated = primary_task_profiles_ot[i]["muts_from_parent"] > 0
-            if not mutated: continue
-            prev_profile = primary_task_profiles_ot[i-1]
-            cur_profile = primary_task_profiles_ot[i]
-            num_mut_steps += 1
-            # Did this mutation change the aggregate phenotype?
-            change_agg = prev_profile["aggregate"] != cur_profile["aggregate"]
-            if chg_env:
-                cur_env = environment_lookup[update_born]
-                alt_env = "odd" if cur_env == "even" else "even"
-                # Did this mutation change the unexpressed phenotype?
-                change_unexpressed = prev_profile[alt_env] != cur_profile[alt_env]
-                # Did this mutation change the expressed phenotype?
-                change_expressed = prev_profile[cur_env] != cur_profile[cur_env]
-                # Did this mutation make the unexpressed phenotype better or worse?
-                if change_unexpressed:
-                    # deleterious mutation for unexpressed phenotype?
-                    num_muts_that_change_unexpressed_phenotype_deleterious += int(
-                        prev_profile[f"{alt_env}-match-score"] > cur_profile[f"{alt_env}-match-score"]
-                    )
-                    num_muts_that_change_unexpressed_phenotype_beneficial += int(
-                        prev_profile[f"{alt_env}-match-score"] < cur_profile[f"{alt_env}-match-score"]
-                    )
-                if change_expressed:
-                    num_muts_that_change_expressed_phenotype_deleterious += int(
-                        prev_profile[f"{cur_env}-match-score"] > cur_profile[f"{cur_env}-match-score"]
-                    )
-                    num_muts_that_change_expressed_phenotype_beneficial += int(
-                        prev_profile[f"{cur_env}-match-score"] > cur_profile[f"{cur_env}-match-score"]
-                    )
-
-            else:
-                # Did this mutation change the unexpressed phenotype?
-                change_unexpressed = False
-                # Did this mutation change the expressed phenotype?
-                change_expressed = prev_profile["const"] != cur_profile["const"]
-
-            num_muts_that_change_aggregate_phenotype += int(change_agg)
-            num_muts_that_change_unexpressed_phenotype += int(change_unexpressed)
-            num_muts_that_change_expressed_phenotype += int(change_expressed)
-
-        summary_info["dominant_lineage_num_mut_steps_that_change_aggregate_phenotype"] = num_muts_that_change_aggregate_phenotype
-        summary_info["dominant_lineage_num_mut_steps_that_change_unexpressed_phenotype"] = num_muts_that_change_unexpressed_phenotype
-        summary_info["dominant_lineage_num_mut_steps_that_change_expressed_phenotype"] = num_muts_that_change_expressed_phenotype
-        summary_info["dominant_lineage_num_mut_steps"] = num_mut_steps
-
-        summary_info["dominant_lineage_num_mut_steps_that_change_unexpressed_phenotype_deleterious"] = num_muts_that_change_unexpressed_phenotype_deleterious
-        summary_info["dominant_lineage_num_mut_steps_that_change_unexpressed_phenotype_beneficial"] = num_muts_that_change_unexpressed_phenotype_beneficial
-        summary_info["dominant_lineage_num_mut_steps_that_change_expressed_phenotype_deleterious"] = num_muts_that_change_expressed_phenotype_deleterious
-        summary_info["dominant_lineage_num_mut_steps_that_change_expressed_phenotype_beneficial"] = num_muts_that_change_expressed_phenotype_beneficial
-
-        lineage_env_all = None
-        lineage_env_odd = None
-        lineage_env_even = None
-        ############################################################
+        stale_run_results = pool.imap(
+            functools.partial(process_run_worker, update=update, time_series_range=time_series_range),
+            stale_run_paths
+        )
+    else:
+        stale_run_results = (process_run(run_path, update, time_series_range) for run_path in stale_run_paths)
+
+    for run_path in run_paths:
+        run_key = os.path.basename(run_path)
+        if not run_path in stale_run_set:
+            run_record = manifest.load_record(run_key)
+            run_result = (run_record["summary_info"], run_record["time_series_info"])
+        else:
+            run_result = next(stale_run_results)
+            if run_result == "failed":
+                print("Failed to process run!")
+                pool.terminate()
+                exit(-1)
+            if run_result != None and manifest != None:
+                manifest.save_record(
+                    run_key,
+                    run_inputs[run_path],
+                    {
+                        "summary_info": run_result[0],
+                        "time_series_info": {field: values.tolist() for field, values in run_result[1].items()}
+                    }
+                )
+        # Skip incomplete runs.
+        if run_result == None: continue
+        summary_info, time_series_info = run_result
 
         ############################################################
         # Output time series data for this run
-        # Add extra fields
-        for u in time_series_info:
-            time_series_info[u]["update"] = u # Make sure that update is a field on every line
-            time_series_info[u]["RANDOM_SEED"] = summary_info["RANDOM_SEED"]
-            time_series_info[u]["DISABLE_REACTION_SENSORS"] = summary_info["DISABLE_REACTION_SENSORS"]
-            time_series_info[u]["chg_env"] = summary_info["chg_env"]
-            time_series_info[u]["environment"] = summary_info["environment"]
-
-        time_series_fields = list(time_series_info[str(time_series_range[0])].keys())
-        time_series_fields.sort()
-        write_header = False
-        if time_series_header == None:
-            write_header = True
-            time_series_header = ",".join(time_series_fields)
-        elif time_series_header != ",".join(time_series_fields):
-            print("Time series header mismatch!")
-            exit(-1)
-        time_series_content = []
-        update_order = list(map(int, time_series_info.keys()))
-        update_order.sort()
-        for u in update_order:
-            time_series_content.append(",".join([str(time_series_info[str(u)][field]) for field in time_series_fields]))
-        with open(time_series_fpath, "a") as fp:
-            if write_header: fp.write(time_series_header)
-            fp.write("\n")
-            fp.write("\n".join(time_series_content))
-        time_series_content = []
+        # Add extra fields (time series rows are already ordered by update)
+        num_time_series_rows = len(time_series_info["update"])
+        for field in ["RANDOM_SEED", "DISABLE_REACTION_SENSORS", "chg_env", "environment"]:
+            time_series_info[field] = [summary_info[field]] * num_time_series_rows
+
+        # (the writer checks that every row matches the time series header)
+        for writer in time_series_writers: writer.write_columns(time_series_info)
         ############################################################
 
         ############################################################
         # Add summary_info to aggregate content
-        summary_fields = list(summary_info.keys())
-        summary_fields.sort()
-        if summary_header == None:
-            summary_header = summary_fields
-        elif summary_header != summary_fields:
-            print("Header mismatch!")
-            exit(-1)
-        summary_line = [str(summary_info[field]) for field in summary_fields]
-        summary_content_lines.append(",".join(summary_line))
+        # (the writer checks that every row matches the summary header)
+        for writer in summary_writers: writer.write_row(summary_info)
         ############################################################
 
-    # write out aggregate data
-    with open(os.path.join(dump_dir, "aggregate.csv"), "w") as fp:
-        out_content = ",".join(summary_header) + "\n" + "\n".join(summary_content_lines)
-        fp.write(out_content)
-
+    if pool != None:
+        pool.close()
+        pool.join()
 
+    for writer in time_series_writers + summary_writers: writer.close()
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,11 @@
 var vis_config = {
+  // "tiles": pre-sliced sequence tiles (tiles.json + tile files), written by build_sequence_tiles.py
+  // "compact": lineage_sequences.json (+ per-sequence .bin files), written by collect_state_sequences.py --compact
+  // "csv": lineage_sequences.csv
+  data_format: "tiles",
   data_file_path: "../experiments/2021-01-12-evo-dynamics/analysis/data/lineage_sequences.csv",
+  compact_data_file_path: "../experiments/2021-01-12-evo-dynamics/analysis/data/lineage_sequences.json",
+  tile_index_path: "../experiments/2021-01-12-evo-dynamics/analysis/data/tiles/tiles.json",
 
   num_tasks: 6,
   tasks: ["not","nand","and","ornot","or","andnot"],
@@ -44,6 +50,15 @@ var IsSliced = function() {
   return $("#slice-toggle").prop("checked");
 }
 
+// How far are we zoomed out? The vertical height of each 'update' is tick_height / zoom.
+var GetZoom = function() {
+  return +$("#zoom-select").val();
+}
+
+var GetTickHeight = function() {
+  return vis_config.tick_height / GetZoom();
+}
+
 // What is the width of the parent element for the visualization?
 // We'll use this value to dynamically size the visualization.
 var GetVisParentWidth = function() {
@@ -73,14 +88,191 @@ var GenEnvSequence = function(states, interval, end) {
 var LineageStateSequenceDataAccessor = function(row) {
   // header information:
   // COPY_MUT_PROB,DISABLE_REACTION_SENSORS,ENVIRONMENT_FILE,EVENT_FILE,PHYLOGENY_SNAPSHOT_RES,RANDOM_SEED,REACTION_SENSORS_NEUTRAL,SYSTEMATICS_RES,chg_env,environment,genotype_seq_length,genotype_seq_unique_state_cnt,max_update,phase,phen_seq_by_geno_duration,phen_seq_by_geno_start,phen_seq_by_geno_state,phen_seq_by_phen_duration,phen_seq_by_phen_start,phen_seq_by_phen_state,phenotype_seq_length,phenotype_seq_unique_state_cnt
+  return BuildLineageEntry(
+    row,
+    row.phen_seq_by_phen_state.split(","),
+    row.phen_seq_by_phen_start.split(","),
+    row.phen_seq_by_phen_duration.split(",")
+  );
+}
+
+// Load lineage state sequence data in compact form: a JSON manifest (state table, replicate information, and
+// per-replicate offsets into each sequence) plus a binary file of (little-endian) int32 arrays per sequence.
+// Only the phenotype sequences are fetched.
+var LoadCompactLineageSequences = function(manifest_path) {
+  const data_dir = manifest_path.substring(0, manifest_path.lastIndexOf("/") + 1);
+  return d3.json(manifest_path).then(function(manifest) {
+    const phen = manifest.sequences.phen;
+    return d3.buffer(data_dir + phen.data_file).then(function(buffer) {
+      const GetArray = function(field) {
+        return new Int32Array(buffer, phen.arrays[field].offset, phen.arrays[field].length);
+      };
+      const states = GetArray("state");
+      const starts = GetArray("start");
+      const durations = GetArray("duration");
+      return manifest.replicates.map(function(info, rep_i) {
+        const begin = phen.offsets[rep_i];
+        const end = phen.offsets[rep_i + 1];
+        return BuildLineageEntry(
+          info,
+          Array.from(states.subarray(begin, end), function(code) { return manifest.states[code]; }),
+          starts.subarray(begin, end),
+          durations.subarray(begin, end)
+        );
+      });
+    });
+  });
+}
+
+// Load lineage state sequence data from pre-sliced tiles, fetching only the tiles needed to draw update_ranges
+// (the sliced update ranges, or null for the full update range) for replicates that pass the data filter.
+// When zoomed out to at least one occupancy tile bin width per pixel (updates_per_pixel), replicates are loaded
+// from the widest such occupancy tiles instead of from their full sequences (see LoadOccupancyEntries).
+// Tiles are cached, so switching between views only fetches each tile once.
+var tile_cache = {};
+var FetchTile = function(path) {
+  if (!(path in tile_cache)) {
+    tile_cache[path] = d3.json(path);
+  }
+  return tile_cache[path];
+}
+
+// Find the tile (in a condition's tile list) that matches and holds the replicate's entries.
+var FindReplicateTile = function(tiles, rep_i, matches) {
+  return tiles.find(
+    function(t) {
+      return matches(t) && t.first_replicate <= rep_i && rep_i < t.first_replicate + t.num_replicates;
+    }
+  );
+}
+
+var LoadSequenceTiles = function(index_path, update_ranges, updates_per_pixel) {
+  const tile_dir = index_path.substring(0, index_path.lastIndexOf("/") + 1);
+  return FetchTile(index_path).then(function(index) {
+    const ranges = (update_ranges == null) ? [index.full_update_range] : update_ranges;
+    const bin_width = index.bin_widths.filter(function(width) { return width <= updates_per_pixel; }).pop();
+    // Find the replicates that pass the data filter (by their index within their condition), and the tile(s)
+    // holding each replicate's entries for the view.
+    var selected = [];
+    index.conditions.forEach(function(condition) {
+      condition.replicates.forEach(function(info, rep_i) {
+        const passes = vis_config.data_filter({
+          environment: condition.environment,
+          sensors: condition.DISABLE_REACTION_SENSORS == "0",
+          random_seed: info.RANDOM_SEED,
+          index: rep_i
+        });
+        if (!passes) return;
+        var replicate_tiles = [];
+        if (bin_width != undefined) {
+          const tile = FindReplicateTile(
+            condition.occupancy_tiles, rep_i, function(t) { return t.bin_width == bin_width; }
+          );
+          if (tile == undefined) {
+            console.log(`No occupancy tile for bin width ${bin_width} (replicate ${rep_i})!`);
+          } else {
+            replicate_tiles.push({path: tile_dir + tile.file, tile_rep: rep_i - tile.first_replicate});
+          }
+        } else {
+          for (var ri = 0; ri < ranges.length; ri++) {
+            const tile = FindReplicateTile(
+              condition.sequence_tiles, rep_i, function(t) { return t.min == ranges[ri].min && t.max == ranges[ri].max; }
+            );
+            if (tile == undefined) {
+              console.log(`No sequence tile for update range ${ranges[ri].min}-${ranges[ri].max} (replicate ${rep_i})!`);
+              continue;
+            }
+            replicate_tiles.push({path: tile_dir + tile.file, tile_rep: rep_i - tile.first_replicate});
+          }
+        }
+        selected.push({info: info, index: rep_i, tiles: replicate_tiles});
+      });
+    });
+    return Promise.all(selected.map(function(rep) { return Promise.all(rep.tiles.map(function(t) { return FetchTile(t.path); })); }))
+      .then(function(replicate_tiles) {
+        // Entries are rebuilt for every view.
+        vis_config.seeds_by_condition = {};
+        var data = [];
+        for (var si = 0; si < selected.length; si++) {
+          const tiles = replicate_tiles[si];
+          var states = [];
+          var starts = [];
+          var durations = [];
+          for (var ti = 0; ti < tiles.length; ti++) {
+            const tile_rep = selected[si].tiles[ti].tile_rep;
+            const entries = (bin_width != undefined)
+              ? OccupancyTileEntries(tiles[ti], tile_rep, ranges)
+              : SequenceTileEntries(tiles[ti], tile_rep);
+            // Merge the replicate's entries across tiles (an entry that spans several slices is in each of their tiles).
+            for (var i = 0; i < entries.state.length; i++) {
+              if (starts.length && entries.start[i] <= starts[starts.length - 1]) continue;
+              states.push(index.states[entries.state[i]]);
+              starts.push(entries.start[i]);
+              durations.push(entries.duration[i]);
+            }
+          }
+          if (states.length) {
+            var entry = BuildLineageEntry(selected[si].info, states, starts, durations);
+            // (only selected replicates are built, so use the replicate's index within its condition)
+            entry.index = selected[si].index;
+            data.push(entry);
+          }
+        }
+        vis_config.full_update_range = {min: index.full_update_range.min, max: index.full_update_range.max};
+        return data;
+      });
+  });
+}
+
+// Return a replicate's entries ({state, start, duration} codes) in a sequence tile.
+var SequenceTileEntries = function(tile, tile_rep) {
+  const begin = tile.offsets[tile_rep];
+  const end = tile.offsets[tile_rep + 1];
+  return {
+    state: tile.state.slice(begin, end),
+    start: tile.start.slice(begin, end),
+    duration: tile.duration.slice(begin, end)
+  };
+}
+
+// Summarize a replicate's entries in an occupancy tile as a coarse sequence ({state, start, duration} codes):
+// in each time bin, the replicate is shown in the state it spent the most time in (consecutive bins in the
+// same state are merged). Only bins overlapping the update ranges are kept.
+var OccupancyTileEntries = function(tile, tile_rep, ranges) {
+  var entries = {state: [], start: [], duration: []};
+  const begin = tile.offsets[tile_rep];
+  const end = tile.offsets[tile_rep + 1];
+  // (triples are sorted by bin, then state)
+  for (var i = begin; i < end; i++) {
+    var top = i;
+    while (i + 1 < end && tile.bin[i + 1] == tile.bin[top]) {
+      i += 1;
+      if (tile.value[i] > tile.value[top]) top = i;
+    }
+    const start = tile.min + tile.bin[top] * tile.bin_width;
+    const duration = Math.min(tile.bin_width, tile.max - start);
+    const in_view = ranges.some(function(r) { return start <= r.max && start + duration >= r.min; });
+    if (!in_view) continue;
+    const last = entries.state.length - 1;
+    if (last >= 0 && entries.state[last] == tile.state[top] && entries.start[last] + entries.duration[last] == start) {
+      entries.duration[last] += duration;
+    } else {
+      entries.state.push(tile.state[top]);
+      entries.start.push(start);
+      entries.duration.push(duration);
+    }
+  }
+  return entries;
+}
+
+// Build a lineage data entry from a replicate's information (environment, sensors, random seed) and its
+// phenotype sequence (parallel lists of states, starts, and durations).
+var BuildLineageEntry = function(row, phen_seq_states, phen_seq_starts, phen_seq_durations) {
   // Extract relevant data.
   const environment = row.environment;
   const sensors = row.DISABLE_REACTION_SENSORS == "0";
   const exp_condition = `${environment}__${sensors}`
   const random_seed = row.RANDOM_SEED;
-  const phen_seq_states = row.phen_seq_by_phen_state.split(",");
-  const phen_seq_starts = row.phen_seq_by_phen_start.split(",");
-  const phen_seq_durations = row.phen_seq_by_phen_duration.split(",");
   // Build a phenotype state sequence.
   var phen_seq = [];
   for (i = 0; i < phen_seq_states.length; i++) {
@@ -149,20 +341,26 @@ var LineageStateSequenceDataAccessor = function(row) {
 
 }
 
+// Returns (a promise of) the lineage data entries needed to draw the current view; set by main.
+var LoadViewData = null;
+
 var x_scale = "";
 // Call this function once to build the state sequence visualization and then to wire up the DrawVisualization function
 // to page events.
 var BuildVisualization = function(data) {
   console.log("BuildVisualization!");
   // Filter data
-  data = data.filter(vis_config.data_filter);
-  vis_config.expressed_states = new Set();
-  console.log(data);
-  for (di = 0; di < data.length; di++) {
-    for (pi = 0; pi < data[di].phenotype_seq.length; pi++) {
-      vis_config.expressed_states.add(data[di].phenotype_seq[pi].state);
+  var SetData = function(view_data) {
+    data = view_data.filter(vis_config.data_filter);
+    vis_config.expressed_states = new Set();
+    console.log(data);
+    for (di = 0; di < data.length; di++) {
+      for (pi = 0; pi < data[di].phenotype_seq.length; pi++) {
+        vis_config.expressed_states.add(data[di].phenotype_seq[pi].state);
+      }
     }
   }
+  SetData(data);
 
   // Setup the canvas
   var chart_area = d3.select("#"+vis_config.lineage_states_div_id);
@@ -174,6 +372,7 @@ var BuildVisualization = function(data) {
     console.log("DrawVisualization!");
 
     var display_full = !IsSliced();
+    var tick_height = GetTickHeight();
 
     // Clear canvas.
     canvas.selectAll("g").remove();
@@ -216,7 +415,7 @@ var BuildVisualization = function(data) {
     var frame_width = GetVisParentWidth(); // todo - add in some padding?
 
     // Height scales directly with data
-    var canvas_height = (total_range * vis_config.tick_height) +
+    var canvas_height = (total_range * tick_height) +
                         ((data_ranges.length-1) * vis_config.slice_vspacer);
     var frame_height = canvas_height + vis_config.margin.top + vis_config.margin.bottom;
 
@@ -262,7 +461,7 @@ var BuildVisualization = function(data) {
           // calculate how far down this slice should be transformed
           var down = 0;
           for (var ri = 0; ri < i; ri++) {
-            down += ( (data_ranges[ri].max - data_ranges[ri].min) * vis_config.tick_height ) + vis_config.slice_vspacer;
+            down += ( (data_ranges[ri].max - data_ranges[ri].min) * tick_height ) + vis_config.slice_vspacer;
           }
           return `translate(0, ${down})`;
 
@@ -275,13 +474,13 @@ var BuildVisualization = function(data) {
         function(slice_range, slice_id) {
           // Make a y axis for this data slice
           var y_domain = [slice_range.min, slice_range.max];
-          var y_range = [0, (slice_range.max - slice_range.min) * vis_config.tick_height];
+          var y_range = [0, (slice_range.max - slice_range.min) * tick_height];
           var y_scale = d3.scaleLinear()
             .domain(y_domain)
             .range(y_range)
             .clamp(true);
 
-          var y_axis = d3.axisLeft().scale(y_scale).ticks( (slice_range.max - slice_range.min) / vis_config.time_tick_interval );
+          var y_axis = d3.axisLeft().scale(y_scale).ticks( (slice_range.max - slice_range.min) / (vis_config.time_tick_interval * GetZoom()) );
           d3.select(this)
             .append("g")
             .attr("class", "axis y-axis")
@@ -429,10 +628,15 @@ var BuildVisualization = function(data) {
 
   // TODO - disable inputs until after wiring things up!
 
-  // Wire DrawVisualization up to slice toggle
-  $("#slice-toggle").change(
+  // Wire DrawVisualization up to slice toggle and zoom select (loading the data for the new view first)
+  $("#slice-toggle, #zoom-select").change(
     function() {
-      DrawVisualization();
+      LoadViewData().then(
+        function(view_data) {
+          SetData(view_data);
+          DrawVisualization();
+        }
+      );
     }
   );
 
@@ -448,8 +652,25 @@ var BuildVisualization = function(data) {
 }
 
 var main = function() {
-  d3.csv(vis_config.data_file_path, LineageStateSequenceDataAccessor)
-    .then(BuildVisualization);
+  if (vis_config.data_format == "tiles") {
+    LoadViewData = function() {
+      return LoadSequenceTiles(
+        vis_config.tile_index_path,
+        IsSliced() ? vis_config.sliced_update_ranges : null,
+        1 / GetTickHeight()
+      );
+    };
+  } else {
+    // All data is loaded up front (and sliced when drawn).
+    var all_data = null;
+    if (vis_config.data_format == "compact") {
+      all_data = LoadCompactLineageSequences(vis_config.compact_data_file_path);
+    } else {
+      all_data = d3.csv(vis_config.data_file_path, LineageStateSequenceDataAccessor);
+    }
+    LoadViewData = function() { return all_data; };
+  }
+  LoadViewData().then(BuildVisualization);
 
 }
 